@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Compare checksumdir dirhash with the parallel directory hashing of substrapp.
+
+python ./scripts/benchmark_dirhash.py --files 1000 --size 1048576 --workers 4
+python ./scripts/benchmark_dirhash.py --directory /path/to/data_sample
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from checksumdir import dirhash
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'substrabac'))
+
+from django.conf import settings  # noqa: E402
+
+settings.configure()
+
+from substrapp.dirhash import hash_directory  # noqa: E402
+
+
+def generate_directory(directory, files, size):
+    for i in range(files):
+        subdirectory = os.path.join(directory, f'{i % 10}')
+        os.makedirs(subdirectory, exist_ok=True)
+        with open(os.path.join(subdirectory, f'{i}.bin'), 'wb') as f:
+            f.write(os.urandom(size))
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--directory', help='directory to hash, generated if not provided')
+    parser.add_argument('--files', type=int, default=500, help='number of generated files')
+    parser.add_argument('--size', type=int, default=1024 * 1024, help='size of generated files (bytes)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    directory = args.directory
+    if directory is None:
+        directory = tempfile.mkdtemp()
+        generate_directory(directory, args.files, args.size)
+
+    try:
+        # read files once so that both implementations hash from the page cache
+        dirhash(directory, 'sha256')
+
+        expected, checksumdir_duration = timed(dirhash, directory, 'sha256')
+        result, parallel_duration = timed(hash_directory, directory, workers=args.workers)
+    finally:
+        if args.directory is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if result != expected:
+        sys.exit(f'Hashes differ: {result} vs {expected}')
+
+    print(f'checksumdir: {checksumdir_duration:.2f}s')
+    print(f'parallel ({args.workers} workers): {parallel_duration:.2f}s '
+          f'({checksumdir_duration / parallel_duration:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
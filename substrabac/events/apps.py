@@ -9,6 +9,7 @@ import contextlib
 from django.apps import AppConfig
 
 from django.conf import settings
+from django.db import connections
 
 import glob
 
@@ -19,7 +20,8 @@ from hfc.util.keyvaluestore import FileKeyValueStore
 
 from substrapp.tasks.tasks import prepare_tuple
 from substrapp.utils import get_owner
-from substrapp.ledger_utils import get_hfc
+from substrapp.ledger_utils import get_hfc, invalidate_tuples_cache
+from substrapp.ledger_mirror import is_ledger_mirror_enabled, mirror_tuples
 
 from celery.result import AsyncResult
 
@@ -46,6 +48,16 @@ def on_tuples(cc_event, block_number, tx_id, tx_status):
         if not _tuples:
             continue
 
+        # cached tuples (and models) queries are outdated
+        invalidate_tuples_cache(tuple_type, [_tuple['key'] for _tuple in _tuples])
+
+        if is_ledger_mirror_enabled():
+            try:
+                mirror_tuples(tuple_type, _tuples)
+            except Exception as e:
+                # the periodic synchronization will catch up
+                logger.exception(e)
+
         for _tuple in _tuples:
             key = _tuple['key']
             status = _tuple['status']
@@ -146,5 +158,8 @@ class EventsConfig(AppConfig):
             else:
                 break
 
+        # database connections must not be shared with the event process
+        connections.close_all()
+
         p1 = multiprocessing.Process(target=wait)
         p1.start()
@@ -1,9 +1,103 @@
 # encoding: utf-8
 
 from __future__ import unicode_literals, absolute_import
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
 
 
 class LimitedPagination(PageNumberPagination):
     page_size = 30
     max_page_size = 10000
+
+
+class LedgerCursorPagination(object):
+    """
+    Cursor pagination of ledger assets lists, ordered by key.
+
+    Ledger lists are not querysets, the cursor is the (encoded) key of the last asset
+    of the previous page. It is only applied when a `page_size` or a `cursor` is
+    requested, so that default responses of the list endpoints are unchanged.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = LimitedPagination.page_size
+    max_page_size = LimitedPagination.max_page_size
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.request = None
+        self.next_cursor = None
+
+    def is_requested(self, request):
+        return (self.cursor_query_param in request.query_params or
+                self.page_size_query_param in request.query_params)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        if page_size <= 0:
+            return self.page_size
+
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            return b64decode(encoded.encode('ascii'), altchars=b'-_', validate=True).decode('utf-8')
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def encode_cursor(key):
+        return b64encode(key.encode('utf-8'), altchars=b'-_').decode('ascii')
+
+    def paginate_groups(self, groups, request, get_key):
+        """
+        Return the page of each group of assets, or None if pagination is not requested.
+
+        All groups share the same cursor: a page ends at the smallest last key of the
+        truncated groups so that no asset is skipped or repeated on the next page.
+        """
+        if not self.is_requested(request):
+            return None
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        pages = []
+        last_keys = []
+        for group in groups:
+            page = sorted((asset for asset in group or [] if cursor is None or get_key(asset) > cursor),
+                          key=get_key)
+            if len(page) > page_size:
+                last_keys.append(get_key(page[page_size - 1]))
+            pages.append(page)
+
+        if last_keys:
+            self.next_cursor = min(last_keys)
+            pages = [[asset for asset in page if get_key(asset) <= self.next_cursor] for page in pages]
+
+        return pages
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_cursor))
+
+    def get_paginated_data(self, data):
+        return OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ])
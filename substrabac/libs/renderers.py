@@ -0,0 +1,40 @@
+# encoding: utf-8
+
+from __future__ import unicode_literals, absolute_import
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+
+class StreamingJSONRenderer(JSONRenderer):
+    """
+    A JSONRenderer which encodes data chunk by chunk, so that large lists are sent
+    without building the whole response body in memory.
+    """
+    chunk_size = 64 * 1024
+
+    def render_stream(self, data):
+        separators = (',', ':') if self.compact else (', ', ': ')
+        encoder = encoders.JSONEncoder(ensure_ascii=self.ensure_ascii, separators=separators)
+
+        buffer = []
+        buffer_size = 0
+        for chunk in encoder.iterencode(data):
+            buffer.append(chunk)
+            buffer_size += len(chunk)
+            if buffer_size >= self.chunk_size:
+                yield ''.join(buffer).encode('utf-8')
+                buffer = []
+                buffer_size = 0
+
+        if buffer:
+            yield ''.join(buffer).encode('utf-8')
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+
+    def __init__(self, data, status=None):
+        renderer = StreamingJSONRenderer()
+        super(StreamingJSONResponse, self).__init__(renderer.render_stream(data), status=status,
+                                                    content_type=renderer.media_type)
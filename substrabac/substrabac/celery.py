@@ -21,7 +21,9 @@ app.autodiscover_tasks()
 
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
-    from substrapp.tasks.tasks import prepare_training_task, prepare_testing_task
+    from django.conf import settings
+    from substrapp.tasks.tasks import (prepare_training_task, prepare_testing_task, sync_ledger_mirror_task,
+                                       report_ledger_task, reconcile_data_samples_task)
 
     period = 3 * 3600
     sender.add_periodic_task(period, prepare_training_task.s(), queue='scheduler',
@@ -29,6 +31,21 @@ def setup_periodic_tasks(sender, **kwargs):
     sender.add_periodic_task(period, prepare_testing_task.s(), queue='scheduler',
                              name='query Testuples to prepare test task on todo testuples')
 
+    ledger_mirror = getattr(settings, 'LEDGER_MIRROR', {})
+    if ledger_mirror.get('ENABLED', False):
+        sender.add_periodic_task(ledger_mirror.get('SYNC_PERIOD', 300), sync_ledger_mirror_task.s(), queue='scheduler',
+                                 name='query ledger assets to synchronize the local ledger mirror')
+
+    ledger_reporter = getattr(settings, 'LEDGER_REPORTER', {})
+    if ledger_reporter.get('ENABLED', False):
+        sender.add_periodic_task(ledger_reporter.get('PERIOD', 30), report_ledger_task.s(), queue='scheduler',
+                                 name='submit pending tuple status reports to the ledger')
+
+    bulk_import = getattr(settings, 'BULK_IMPORT', {})
+    if bulk_import.get('RECONCILE_PERIOD'):
+        sender.add_periodic_task(bulk_import['RECONCILE_PERIOD'], reconcile_data_samples_task.s(), queue='scheduler',
+                                 name='validate pending data samples registered on the ledger')
+
 
 @after_task_publish.connect
 def update_task_state(sender=None, headers=None, body=None, **kwargs):
@@ -156,14 +156,56 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_TASK_TRACK_STARTED = True  # since 4.0
-CELERY_WORKER_CONCURRENCY = 1
+CELERY_WORKER_CONCURRENCY = int(os.environ.get('CELERY_WORKER_CONCURRENCY', 1))
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'amqp://localhost:5672//'),
 
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
 
+# Uploaded files above FILE_UPLOAD_MAX_MEMORY_SIZE are streamed to MEDIA_ROOT and hashed while received
+FILE_UPLOAD_HANDLERS = os.environ.get(
+    'FILE_UPLOAD_HANDLERS',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler,substrapp.upload.HashingFileUploadHandler'
+).split(',')
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.environ.get('FILE_UPLOAD_MAX_MEMORY_SIZE', 2621440))  # bytes
+UPLOAD = {
+    'CHUNK_SIZE': int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024)),  # bytes written and hashed at once
+    # upload sessions not updated for SESSION_EXPIRY are removed
+    'SESSION_EXPIRY': int(os.environ.get('UPLOAD_SESSION_EXPIRY', 24 * 60 * 60)),  # seconds
+}
+
 
 BASIC_AUTHENTICATION_MODULE = 'rest_framework.authentication'
 
+# HTTP sessions used to fetch assets from other nodes, pooled and kept alive per node
+NODE_HTTP_CLIENT = {
+    'POOL_MAXSIZE': int(os.environ.get('NODE_HTTP_POOL_MAXSIZE', 10)),
+    'CONNECT_TIMEOUT': float(os.environ.get('NODE_HTTP_CONNECT_TIMEOUT', 5)),  # seconds
+    'READ_TIMEOUT': float(os.environ.get('NODE_HTTP_READ_TIMEOUT', 300)),  # seconds between two bytes received
+    'RETRIES': int(os.environ.get('NODE_HTTP_RETRIES', 3)),
+    'BACKOFF_FACTOR': float(os.environ.get('NODE_HTTP_BACKOFF_FACTOR', 0.5)),
+}
+
+# Directory hashing (data samples)
+DIRHASH = {
+    'WORKERS': int(os.environ.get('DIRHASH_WORKERS', 4)),  # processes hashing the files of a directory
+    'PARALLEL_MIN_FILES': int(os.environ.get('DIRHASH_PARALLEL_MIN_FILES', 8)),
+}
+
+# Storage of the data samples registered from a path, first supported strategy of reflink, link and copy
+DATA_SAMPLE_STORAGE = {
+    'STRATEGIES': [x for x in os.environ.get('DATA_SAMPLE_STORAGE_STRATEGIES', 'reflink,link,copy').split(',') if x],
+    'WORKERS': int(os.environ.get('DATA_SAMPLE_STORAGE_WORKERS', 0)) or None,  # threads storing files, default to cpu count
+    'PARALLEL_MIN_FILES': int(os.environ.get('DATA_SAMPLE_STORAGE_PARALLEL_MIN_FILES', 64)),
+}
+
+# Bulk registration of data samples (bulkcreatedatasample)
+BULK_IMPORT = {
+    'CHUNK_SIZE': int(os.environ.get('BULK_IMPORT_CHUNK_SIZE', 500)),  # data samples registered per ledger invoke
+    'WORKERS': int(os.environ.get('BULK_IMPORT_WORKERS', 0)) or None,  # threads hashing inputs, default to cpu count
+    # period of the validation of pending data samples against the ledger, 0 to disable
+    'RECONCILE_PERIOD': int(os.environ.get('BULK_IMPORT_RECONCILE_PERIOD', 600)),  # seconds
+}
+
 
 TRUE_VALUES = {
     't', 'T',
@@ -21,6 +21,40 @@ LEDGER = json.load(open(LEDGER_CONFIG_FILE, 'r'))
 
 LEDGER_SYNC_ENABLED = True
 LEDGER_CALL_RETRY = True
+# seconds before the cached hfc client of a thread is rebuilt and the channel discovered again
+LEDGER_CLIENT_TTL = int(os.environ.get('LEDGER_CLIENT_TTL', 3600))
+
+LEDGER_CACHE = {
+    'ENABLED': True,
+    'MAX_SIZE': int(os.environ.get('LEDGER_CACHE_MAX_SIZE', 1024)),
+    # alias of a django cache shared between processes (web, events, workers), local only if None:
+    # invalidations then only evict the entries of the process which invalidates them, so that only
+    # the pinned queries of immutable assets (algos, objectives) are cached
+    'BACKEND': os.environ.get('LEDGER_CACHE_BACKEND'),
+    # seconds per chaincode function, overrides substrapp.ledger_utils.LEDGER_CACHE_TTL
+    'TTL': {},
+}
+
+LEDGER_MIRROR = {
+    # serve list searches from a local copy of the ledger assets
+    'ENABLED': os.environ.get('LEDGER_MIRROR_ENABLED', 'False').lower() in ('true', '1'),
+    # seconds between two catch-up synchronizations with the ledger
+    'SYNC_PERIOD': int(os.environ.get('LEDGER_MIRROR_SYNC_PERIOD', 300)),
+}
+
+LEDGER_REPORTER = {
+    # submit the tuple statuses from a reporter task instead of the compute task, the reports are kept
+    # in the database and submitted by a worker consuming the scheduler queue
+    'ENABLED': os.environ.get('LEDGER_REPORTER_ENABLED', 'False').lower() in ('true', '1'),
+    # seconds between two submissions of the pending reports
+    'PERIOD': int(os.environ.get('LEDGER_REPORTER_PERIOD', 30)),
+    # reports submitted concurrently
+    'BATCH_SIZE': int(os.environ.get('LEDGER_REPORTER_BATCH_SIZE', 50)),
+    'WORKERS': int(os.environ.get('LEDGER_REPORTER_WORKERS', 4)),
+    # seconds before retrying a failed report, doubled on each attempt
+    'BACKOFF_BASE': int(os.environ.get('LEDGER_REPORTER_BACKOFF_BASE', 2)),
+    'BACKOFF_MAX': int(os.environ.get('LEDGER_REPORTER_BACKOFF_MAX', 300)),
+}
 
 PEER_PORT = LEDGER['peer']['port'][os.environ.get('SUBSTRABAC_PEER_PORT', 'external')]
 
@@ -14,3 +14,6 @@ REST_FRAMEWORK = {
     'ALLOWED_VERSIONS': ('0.0',),
     'DEFAULT_VERSION': '0.0',
 }
+
+# ledger list responses with at least this number of assets are streamed
+LIST_STREAMING_MIN_SIZE = 1000
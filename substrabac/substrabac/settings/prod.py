@@ -14,6 +14,35 @@ TASK = {
     'CAPTURE_LOGS': to_bool(os.environ.get('TASK_CAPTURE_LOGS', True)),
     'CLEAN_EXECUTION_ENVIRONMENT': to_bool(os.environ.get('TASK_CLEAN_EXECUTION_ENVIRONMENT', True)),
     'CACHE_DOCKER_IMAGES': to_bool(os.environ.get('TASK_CACHE_DOCKER_IMAGES', False)),
+    'DOCKER_IMAGES_CACHE_MAX_SIZE': int(os.environ.get('TASK_DOCKER_IMAGES_CACHE_MAX_SIZE', 20 * 1024 ** 3)),  # bytes
+    # requires CACHE_DOCKER_IMAGES
+    'METRICS_CONTAINER_POOL': to_bool(os.environ.get('TASK_METRICS_CONTAINER_POOL', False)),
+    'METRICS_POOL_IDLE_TIMEOUT': int(os.environ.get('TASK_METRICS_POOL_IDLE_TIMEOUT', 600)),  # seconds
+    'CACHE_ASSETS': to_bool(os.environ.get('TASK_CACHE_ASSETS', True)),
+    'ASSETS_CACHE_MAX_SIZE': int(os.environ.get('TASK_ASSETS_CACHE_MAX_SIZE', 10 * 1024 ** 3)),  # bytes
+    'PREFETCH_WORKERS': int(os.environ.get('TASK_PREFETCH_WORKERS', 8)),
+    'PREFETCH_CONCURRENCY_PER_NODE': int(os.environ.get('TASK_PREFETCH_CONCURRENCY_PER_NODE', 4)),
+    # number of tuples in each stage of the pipeline, defaults to CELERY_WORKER_CONCURRENCY;
+    # a celery concurrency above the train limit overlaps the fetch and build of tuples with training
+    'PIPELINE': {
+        'fetch': int(os.environ.get('TASK_PIPELINE_FETCH', CELERY_WORKER_CONCURRENCY)),
+        'build': int(os.environ.get('TASK_PIPELINE_BUILD', CELERY_WORKER_CONCURRENCY)),
+        'train': int(os.environ.get('TASK_PIPELINE_TRAIN', CELERY_WORKER_CONCURRENCY)),
+        'persist': int(os.environ.get('TASK_PIPELINE_PERSIST', CELERY_WORKER_CONCURRENCY)),
+        'evaluate': int(os.environ.get('TASK_PIPELINE_EVALUATE', CELERY_WORKER_CONCURRENCY)),
+        'report': int(os.environ.get('TASK_PIPELINE_REPORT', CELERY_WORKER_CONCURRENCY)),
+    },
+    'RESOURCES_RECONCILIATION_PERIOD': int(os.environ.get('TASK_RESOURCES_RECONCILIATION_PERIOD', 30)),  # seconds
+    # resources requested by containers (cpu, memory_mb, gpu), default to an equal share of the host
+    'RESOURCES': {
+        'metrics': {
+            'cpu': float(os.environ.get('TASK_METRICS_CPU', 1)),
+            'memory_mb': int(os.environ.get('TASK_METRICS_MEMORY_MB', 2048)),
+            'gpu': 0,
+        },
+    },
+    # full, incremental or trust
+    'DATA_SAMPLE_HASH_VERIFICATION': os.environ.get('TASK_DATA_SAMPLE_HASH_VERIFICATION', 'incremental'),
 }
 
 BASICAUTH_USERNAME = os.environ.get('BACK_AUTH_USER')
@@ -0,0 +1,351 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from os.path import normpath
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from substrapp.dirhash import compute_dirhash
+from substrapp.ledger_utils import query_ledger, LedgerError, LedgerTimeout
+from substrapp.models import DataSample, DataSampleImport
+from substrapp.serializers import LedgerDataSampleSerializer
+from substrapp.signals.datasample.pre_save import data_sample_pre_save
+from substrapp.storage import COPY
+from substrapp.utils import store_datasamples_archive
+from substrapp.views.utils import LedgerException
+
+logger = logging.getLogger(__name__)
+
+# Bulk registration of data samples.
+#
+# The inputs (archives or directories) are processed by chunks of BULK_IMPORT CHUNK_SIZE samples, so that
+# the memory used does not depend on the number of samples: the samples of a chunk are hashed by a pool
+# of threads (archives are extracted and hashed in a single pass), stored with a single bulk insert, then
+# registered on the ledger with a single invoke.
+#
+# The progress of each input (hashed → linked → saved → committed) is recorded in the DataSampleImport
+# journal of the import, so that an interrupted import resumes each input from its last confirmed step
+# when run again: directories are not hashed again, stored data samples are not copied again. Data samples
+# whose registration timed out are validated by the reconciler, which compares the pending data samples
+# with the ledger.
+
+DEFAULT_CHUNK_SIZE = 500
+# sqlite cannot bind more than 999 variables in a query
+QUERY_CHUNK_SIZE = 500
+
+
+def _get_bulk_import_setting(name, default):
+    return getattr(settings, 'BULK_IMPORT', {}).get(name, default)
+
+
+def iter_inputs(paths, multiple=False):
+    """Yield the archives or directories of the data samples, the sub-directories of `paths` if `multiple`."""
+    for input_path in paths:
+        if not multiple:
+            yield input_path
+            continue
+
+        if not path.isdir(input_path):
+            raise Exception(f'{input_path} is not a directory')
+        for name in sorted(os.listdir(input_path)):
+            if path.isdir(path.join(input_path, name)):
+                yield path.join(input_path, name)
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def hash_input(input_path):
+    """Return the data sample of an input, archives are extracted to a temporary directory."""
+    if not path.exists(input_path):
+        raise Exception(f'File or Path: {input_path} does not exist')
+
+    if path.isfile(input_path):
+        with open(input_path, 'rb') as f:
+            pkhash, extracted_path = store_datasamples_archive(f)
+        return {'input': input_path, 'pkhash': pkhash, 'path': extracted_path, 'extracted': True}
+
+    if path.isdir(input_path):
+        return {'input': input_path, 'pkhash': compute_dirhash(input_path), 'path': normpath(input_path),
+                'extracted': False}
+
+    raise Exception(f'{input_path} is not a file or a directory')
+
+
+def store_data_sample(sample):
+    """Return the unsaved instance of a data sample, its files stored in MEDIA_ROOT/datasamples/<pkhash>.
+
+    Instances are bulk inserted which does not send the pre_save signal, it is applied here.
+    """
+    instance = DataSample(pkhash=sample['pkhash'], path=sample['path'], validated=False)
+
+    if sample['extracted']:
+        directory = path.join(getattr(settings, 'MEDIA_ROOT'), f'datasamples/{instance.pk}')
+        shutil.rmtree(directory, ignore_errors=True)
+        os.rename(sample['path'], directory)
+        instance.path = directory
+        instance.storage = COPY
+    else:
+        data_sample_pre_save(DataSample, instance)
+
+    return instance
+
+
+def _remove_extracted(samples):
+    for sample in samples:
+        if sample['extracted']:
+            shutil.rmtree(sample['path'], ignore_errors=True)
+
+
+def _get_existing(pkhashes):
+    existing = {}
+    for i in range(0, len(pkhashes), QUERY_CHUNK_SIZE):
+        existing.update(
+            (pkhash, {'pkhash': pkhash, 'path': data_path, 'validated': validated})
+            for pkhash, data_path, validated in DataSample.objects.filter(
+                pkhash__in=pkhashes[i:i + QUERY_CHUNK_SIZE]).values_list('pkhash', 'path', 'validated'))
+    return existing
+
+
+def register_data_samples(instances, data_manager_keys, test_only):
+    """Register the saved instances of a chunk on the ledger, delete them if they cannot be registered."""
+    ledger_serializer = LedgerDataSampleSerializer(data={
+        'test_only': test_only,
+        'data_manager_keys': data_manager_keys,
+        'instances': instances,
+    })
+
+    if not ledger_serializer.is_valid():
+        DataSample.objects.filter(pkhash__in=[x.pk for x in instances]).delete()
+        raise ValidationError(ledger_serializer.errors)
+
+    return ledger_serializer.create(ledger_serializer.validated_data)
+
+
+def get_import_key(paths, multiple, data_manager_keys, test_only):
+    """Identify an import, to resume it."""
+    return hashlib.sha256(json.dumps([paths, multiple, sorted(data_manager_keys), test_only]).encode()).hexdigest()
+
+
+def _update_journal(import_key, samples, state):
+    positions = [x['position'] for x in samples]
+    for i in range(0, len(positions), QUERY_CHUNK_SIZE):
+        DataSampleImport.objects.filter(
+            import_key=import_key, position__in=positions[i:i + QUERY_CHUNK_SIZE]).update(state=state)
+    for sample in samples:
+        sample['state'] = state
+
+
+def _resume_sample(sample, entry):
+    """Restore the progress of an input from the journal, return whether it must be hashed."""
+    if entry is None or entry.input_path != sample['input']:
+        # inputs of multiple imports are shifted when sub-directories are added or removed
+        return True
+    if entry.state == DataSampleImport.HASHED and not path.isdir(sample['input']):
+        # the temporary directory of the archive has been removed
+        return True
+
+    sample.update({'pkhash': entry.pkhash, 'path': entry.path, 'storage': entry.storage, 'extracted': False,
+                   'state': entry.state})
+    return False
+
+
+def _hash_samples(executor, import_key, samples):
+    futures = [executor.submit(hash_input, x['input']) for x in samples]
+    try:
+        results = [future.result() for future in futures]
+    except Exception:
+        _remove_extracted(future.result() for future in futures if not future.exception())
+        raise
+
+    for sample, result in zip(samples, results):
+        sample.update(result)
+        sample['state'] = DataSampleImport.HASHED
+
+    positions = [x['position'] for x in samples]
+    for i in range(0, len(positions), QUERY_CHUNK_SIZE):
+        DataSampleImport.objects.filter(
+            import_key=import_key, position__in=positions[i:i + QUERY_CHUNK_SIZE]).delete()
+    DataSampleImport.objects.bulk_create([
+        DataSampleImport(import_key=import_key, position=x['position'], input_path=x['input'],
+                         pkhash=x['pkhash'], path=x['path'], state=DataSampleImport.HASHED)
+        for x in samples
+    ])
+
+
+def _check_duplicates(samples, seen):
+    for sample in samples:
+        if sample['pkhash'] in seen:
+            raise Exception(f'Your data sample archives/paths contain same files leading to same '
+                            f'pkhash, please review the content of your achives/paths. '
+                            f'{sample["input"]} and {seen[sample["pkhash"]]} are the same')
+        seen[sample['pkhash']] = sample['input']
+
+
+def _link_samples(executor, import_key, samples):
+    instances = list(executor.map(store_data_sample, samples))
+
+    with transaction.atomic():
+        for sample, instance in zip(samples, instances):
+            sample.update({'path': instance.path, 'storage': instance.storage, 'extracted': False,
+                           'state': DataSampleImport.LINKED})
+            DataSampleImport.objects.filter(import_key=import_key, position=sample['position']).update(
+                path=instance.path, storage=instance.storage, state=DataSampleImport.LINKED)
+
+
+def _resume_existing(import_key, samples, existing_samples):
+    """Update the progress of the inputs according to the data samples in the database."""
+    states = {
+        DataSampleImport.COMMITTED: [],
+        DataSampleImport.SAVED: [],
+        DataSampleImport.LINKED: [],
+    }
+
+    for sample in samples:
+        existing_sample = existing_samples.get(sample['pkhash'])
+        if existing_sample and sample['state'] == DataSampleImport.HASHED:
+            # registered before this import
+            states[DataSampleImport.COMMITTED].append(sample)
+        elif existing_sample and sample['state'] == DataSampleImport.LINKED:
+            # saved before the import was interrupted
+            states[DataSampleImport.SAVED].append(sample)
+        elif existing_sample and sample['state'] == DataSampleImport.SAVED and existing_sample['validated']:
+            # validated by the reconciler or the asynchronous registration
+            states[DataSampleImport.COMMITTED].append(sample)
+        elif not existing_sample and sample['state'] == DataSampleImport.SAVED:
+            # deleted as its registration failed
+            states[DataSampleImport.LINKED].append(sample)
+
+    for state, state_samples in states.items():
+        _update_journal(import_key, state_samples, state)
+
+
+def import_data_samples(paths, data_manager_keys, test_only=False, multiple=False, progress=None):
+    """Register the data samples of `paths` (archives or directories), return the data samples.
+
+    An interrupted import is resumed when called again with the same arguments. `progress` is called after
+    each chunk with the number of inputs processed, data samples registered and data samples already
+    existing. Inputs containing the same files as a previous input of the import raise.
+    """
+    chunk_size = _get_bulk_import_setting('CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    workers = _get_bulk_import_setting('WORKERS', None) or os.cpu_count()
+
+    import_key = get_import_key(paths, multiple, data_manager_keys, test_only)
+    journal = DataSampleImport.objects.filter(import_key=import_key)
+    if journal.exists():
+        logger.info(f'Resume import {import_key} of data samples')
+        if journal.filter(state=DataSampleImport.SAVED).exists():
+            # data samples of the interrupted import may have been registered
+            reconcile_data_samples()
+
+    seen = {}
+    data_samples = []
+    not_validated = []
+    position = created = existing = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in iter_chunks(iter_inputs(paths, multiple), chunk_size):
+            entries = {x.position: x for x in journal.filter(position__gte=position,
+                                                             position__lt=position + len(chunk))}
+            samples = [{'position': position + i, 'input': input_path, 'extracted': False}
+                       for i, input_path in enumerate(chunk)]
+            position += len(chunk)
+
+            try:
+                _hash_samples(executor, import_key,
+                              [x for x in samples if _resume_sample(x, entries.get(x['position']))])
+                _check_duplicates(samples, seen)
+
+                existing_samples = _get_existing([x['pkhash'] for x in samples])
+                _resume_existing(import_key, samples, existing_samples)
+
+                _link_samples(executor, import_key, [x for x in samples if x['state'] == DataSampleImport.HASHED])
+            finally:
+                # archives of existing data samples, or of a failed chunk
+                _remove_extracted(x for x in samples if x['extracted'])
+
+            to_save = [x for x in samples if x['state'] == DataSampleImport.LINKED]
+            DataSample.objects.bulk_create(
+                DataSample(pkhash=x['pkhash'], path=x['path'], storage=x['storage'], validated=False) for x in to_save)
+            _update_journal(import_key, to_save, DataSampleImport.SAVED)
+
+            to_commit = [x for x in samples if x['state'] == DataSampleImport.SAVED]
+            data = {}
+            if to_commit:
+                instances = [DataSample(pkhash=x['pkhash'], path=x['path']) for x in to_commit]
+                try:
+                    data = register_data_samples(instances, data_manager_keys, test_only)
+                except LedgerTimeout:
+                    # the data samples may have been registered, they are validated by the reconciler
+                    logger.warning(f'Timeout registering {len(instances)} data samples on the ledger')
+                    not_validated.extend(x.pk for x in instances)
+                except LedgerError as e:
+                    # the data samples have been deleted
+                    _update_journal(import_key, to_commit, DataSampleImport.LINKED)
+                    raise LedgerException(str(e.msg), e.status)
+                except ValidationError as e:
+                    # the data samples have been deleted, their pkhashes are reported with the ones imported
+                    _update_journal(import_key, to_commit, DataSampleImport.LINKED)
+                    e.pkhashes = [x['pkhash'] for x in data_samples] + [x['pkhash'] for x in samples]
+                    raise
+                else:
+                    _update_journal(import_key, to_commit, DataSampleImport.COMMITTED)
+
+            validated = bool(data.get('validated'))
+            committed = {x['position'] for x in to_commit}
+            for sample in samples:
+                if sample['position'] in committed:
+                    data_samples.append({'pkhash': sample['pkhash'], 'path': sample['path'], 'validated': validated})
+                else:
+                    data_samples.append(existing_samples.get(sample['pkhash']) or {
+                        'pkhash': sample['pkhash'], 'path': sample['path'], 'validated': False})
+
+            created += len(to_commit)
+            existing += len(samples) - len(to_commit)
+            logger.info(f'{position} inputs processed: {created} data samples registered, {existing} existing')
+            if progress:
+                progress(position, created, existing)
+
+    if not_validated:
+        # the journal is kept to register the data samples which are not validated when resumed
+        raise LedgerException({'pkhash': not_validated, 'validated': False}, LedgerTimeout.status)
+
+    journal.delete()
+
+    return data_samples
+
+
+def reconcile_data_samples():
+    """Validate the pending data samples which are registered on the ledger, return their number.
+
+    Data samples are left pending when their registration timed out or their import was interrupted.
+    """
+    pending = list(DataSample.objects.filter(validated=False).values_list('pkhash', flat=True))
+    if not pending:
+        return 0
+
+    ledger_keys = {x['key'] for x in query_ledger(fcn='queryDataSamples', args=[]) or []}
+    registered = [pkhash for pkhash in pending if pkhash in ledger_keys]
+
+    with transaction.atomic():
+        for i in range(0, len(registered), QUERY_CHUNK_SIZE):
+            chunk = registered[i:i + QUERY_CHUNK_SIZE]
+            DataSample.objects.filter(pkhash__in=chunk).update(validated=True)
+            DataSampleImport.objects.filter(pkhash__in=chunk, state=DataSampleImport.SAVED).update(
+                state=DataSampleImport.COMMITTED)
+
+    logger.info(f'{len(registered)} of {len(pending)} pending data samples validated')
+    return len(registered)
@@ -0,0 +1,368 @@
+import hashlib
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from os import path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Incremental directory hashing.
+#
+# The hash of a directory is the checksumdir sha256 `dirhash`: the sha256 of the sorted sha256 of its files.
+# Once computed, the hash of each file is kept in a manifest, stored in
+# MEDIA_ROOT/hash_manifests/<hash[:2]>/<hash>.json and keyed by the resulting directory hash, with the
+# device, inode, size, modification and change times of the file. Verifying a directory against a hash only
+# rehashes the files whose stat changed since the manifest was registered. As linking a file updates its
+# change time, the manifest of data samples stored in MEDIA_ROOT (hardlinked, cloned or copied) is
+# registered with the hashes of the files of the registered paths unchanged before being stored (see
+# storage), and the stat of hardlinked models is registered again (see `link_hashed_file`).
+#
+# Files of large directories are hashed in parallel by a pool of processes (DIRHASH WORKERS setting)
+# created on first use and kept by each process, large files are mapped in memory. Daemonic processes
+# (celery prefork workers) cannot fork: their files are hashed in threads. The results are identical to checksumdir
+# `dirhash(dirname, 'sha256')`.
+#
+# Single files (models) are registered the same way, keyed by their salted hash, so that hardlinks of a
+# verified file are not read again.
+
+MANIFEST_DIRECTORY = 'hash_manifests'
+READ_SIZE = 1024 * 1024
+MMAP_MIN_SIZE = 16 * 1024 * 1024
+# files modified this recently may be modified again within the timestamp granularity, their stat is not kept
+RACY_DELAY = 2  # seconds
+DEFAULT_WORKERS = 4
+
+VERIFICATION_FULL = 'full'
+VERIFICATION_INCREMENTAL = 'incremental'
+VERIFICATION_TRUST = 'trust'
+
+
+def get_verification_mode():
+    return getattr(settings, 'TASK', {}).get('DATA_SAMPLE_HASH_VERIFICATION', VERIFICATION_INCREMENTAL)
+
+
+def get_manifest_path(dir_hash):
+    return path.join(getattr(settings, 'MEDIA_ROOT'), MANIFEST_DIRECTORY, dir_hash[:2], f'{dir_hash}.json')
+
+
+def load_manifest(dir_hash):
+    try:
+        with open(get_manifest_path(dir_hash)) as f:
+            return json.load(f)
+    except (OSError, ValueError):  # not registered or corrupted
+        return None
+
+
+def save_manifest(dir_hash, files):
+    manifest_path = get_manifest_path(dir_hash)
+    os.makedirs(path.dirname(manifest_path), exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.dirname(manifest_path), prefix='.manifest-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'hash': dir_hash, 'files': files}, f)
+        os.rename(tmp_path, manifest_path)
+    except BaseException:
+        if path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def remove_manifest(dir_hash):
+    try:
+        os.remove(get_manifest_path(dir_hash))
+    except FileNotFoundError:
+        pass
+
+
+def file_hash(file_path, salt=None):
+    """Return the sha256 of a file, followed by `salt` if any, as `substrapp.utils.get_hash`."""
+    sha256_hash = hashlib.sha256()
+    with open(file_path, 'rb', buffering=0) as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_MIN_SIZE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                sha256_hash.update(data)
+        else:
+            buffer = bytearray(READ_SIZE)
+            view = memoryview(buffer)
+            for size in iter(lambda: f.readinto(buffer), 0):
+                sha256_hash.update(view[:size])
+    if salt is not None:
+        sha256_hash.update(salt.encode())
+    return sha256_hash.hexdigest()
+
+
+def _get_dirhash_setting(name, default):
+    return getattr(settings, 'DIRHASH', {}).get(name, default)
+
+
+_hash_executor = None
+_hash_executor_lock = threading.Lock()
+_daemonic_fallback_logged = False
+
+
+def _get_hash_executor(workers):
+    """Return the pool of processes of the current process, None if processes cannot be forked."""
+    global _hash_executor, _daemonic_fallback_logged
+
+    if multiprocessing.current_process().daemon:
+        if not _daemonic_fallback_logged:
+            _daemonic_fallback_logged = True
+            logger.info('Daemonic process: files are hashed in threads')
+        return None
+
+    with _hash_executor_lock:
+        # the pool of the parent is not usable from a forked process
+        if _hash_executor is None or _hash_executor[0] != os.getpid() or _hash_executor[1] != workers:
+            if _hash_executor is not None and _hash_executor[0] == os.getpid():
+                _hash_executor[2].shutdown(wait=False)
+            _hash_executor = (os.getpid(), workers, ProcessPoolExecutor(max_workers=workers))
+        return _hash_executor[2]
+
+
+def _reset_hash_executor(executor):
+    global _hash_executor
+
+    with _hash_executor_lock:
+        if _hash_executor is not None and _hash_executor[2] is executor:
+            _hash_executor = None
+    executor.shutdown(wait=False)
+
+
+def hash_files(file_paths, workers=None):
+    """Return the sha256 of files, in the same order."""
+    workers = workers or _get_dirhash_setting('WORKERS', DEFAULT_WORKERS)
+    workers = min(workers, os.cpu_count())
+    if workers <= 1 or len(file_paths) < _get_dirhash_setting('PARALLEL_MIN_FILES', 8):
+        return [file_hash(file_path) for file_path in file_paths]
+
+    executor = _get_hash_executor(workers)
+    if executor is not None:
+        chunksize = max(1, len(file_paths) // (workers * 4))
+        try:
+            return list(executor.map(file_hash, file_paths, chunksize=chunksize))
+        except BrokenProcessPool as e:
+            # processes of the pool have been killed, a new pool is created on next call
+            logger.warning(f'Cannot hash files in processes: {e!r}')
+            _reset_hash_executor(executor)
+
+    # hashlib releases the GIL while hashing
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(file_hash, file_paths))
+
+
+def reduce_hash(file_hashes):
+    sha256_hash = hashlib.sha256()
+    for value in sorted(file_hashes):
+        sha256_hash.update(value.encode('utf-8'))
+    return sha256_hash.hexdigest()
+
+
+def list_files(dirname):
+    """Return the relative paths of the files hashed by checksumdir `dirhash`."""
+    if not path.isdir(dirname):
+        raise TypeError(f'{dirname} is not a directory.')
+
+    files = []
+    for root, _, filenames in os.walk(dirname, topdown=True, followlinks=False):
+        files.extend(path.relpath(path.join(root, filename), dirname) for filename in filenames)
+    return files
+
+
+def hash_directory(dirname, workers=None):
+    """Return the sha256 `dirhash` of a directory, hashing all its files."""
+    file_paths = [path.join(dirname, relative_path) for relative_path in list_files(dirname)]
+    return reduce_hash(hash_files(file_paths, workers=workers))
+
+
+def _stat_key(stat):
+    # the ctime cannot be set from user space, unlike the mtime restored after a rewrite
+    return [stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns]
+
+
+def compute_dirhash(dirname, expected_hash=None):
+    """Return the sha256 `dirhash` of a directory, reusing the hashes of unchanged files.
+
+    The unchanged files are looked up in the manifest registered for `expected_hash` (if any),
+    the manifest of the computed hash is then registered.
+    """
+    manifest = load_manifest(expected_hash) if expected_hash else None
+    known_files = manifest['files'] if manifest else {}
+
+    racy_mtime_ns = int((time.time() - RACY_DELAY) * 1e9)
+
+    files = {}
+    modified_files = {}
+    for relative_path in list_files(dirname):
+        stat_key = _stat_key(os.stat(path.join(dirname, relative_path)))
+
+        known_file = known_files.get(relative_path)
+        if known_file and known_file['stat'] == stat_key:
+            files[relative_path] = known_file
+        else:
+            modified_files[relative_path] = stat_key
+
+    file_hashes = hash_files([path.join(dirname, relative_path) for relative_path in modified_files])
+    for (relative_path, stat_key), hash_value in zip(modified_files.items(), file_hashes):
+        files[relative_path] = {
+            'hash': hash_value,
+            'stat': stat_key if stat_key[3] < racy_mtime_ns else None,
+        }
+
+    rehashed = len(modified_files)
+    dir_hash = reduce_hash(f['hash'] for f in files.values())
+    logger.debug(f'Directory {dirname} hashed: {rehashed}/{len(files)} files rehashed')
+
+    if manifest is None or dir_hash != expected_hash or rehashed:
+        save_manifest(dir_hash, files)
+
+    return dir_hash
+
+
+def register_dirhash(dirname, file_hashes, register=True):
+    """Return the `dirhash` of a directory whose files have been hashed while written, register its manifest.
+
+    `file_hashes` maps the relative path of the files to their hash, the directory is hashed again if it
+    contains other files (links extracted from an archive for instance).
+    """
+    if set(file_hashes) != set(list_files(dirname)):
+        return compute_dirhash(dirname) if register else hash_directory(dirname)
+
+    if not register:  # temporary directory
+        return reduce_hash(file_hashes.values())
+
+    racy_mtime_ns = int((time.time() - RACY_DELAY) * 1e9)
+
+    files = {}
+    for relative_path, hash_value in file_hashes.items():
+        stat_key = _stat_key(os.stat(path.join(dirname, relative_path)))
+        files[relative_path] = {
+            'hash': hash_value,
+            'stat': stat_key if stat_key[3] < racy_mtime_ns else None,
+        }
+
+    dir_hash = reduce_hash(f['hash'] for f in files.values())
+    save_manifest(dir_hash, files)
+
+    return dir_hash
+
+
+def get_unchanged_file_hashes(dirname, dir_hash):
+    """Return the hashes of the files of a directory unchanged since the manifest of `dir_hash` was registered."""
+    manifest = load_manifest(dir_hash)
+    known_files = manifest['files'] if manifest else {}
+
+    file_hashes = {}
+    for relative_path, known_file in known_files.items():
+        try:
+            stat_key = _stat_key(os.stat(path.join(dirname, relative_path)))
+        except FileNotFoundError:
+            continue
+        if known_file['stat'] == stat_key:
+            file_hashes[relative_path] = known_file['hash']
+    return file_hashes
+
+
+def register_copied_dirhash(src_dirname, dirname, dir_hash, file_hashes):
+    """Return the `dirhash` of a copy of a directory, register its manifest.
+
+    `file_hashes` are the hashes of the source files unchanged before the copy (see
+    `get_unchanged_file_hashes`), linking a file updates its ctime. Files modified while copied and
+    other files are hashed.
+    """
+    manifest = load_manifest(dir_hash)
+    known_files = manifest['files'] if manifest else {}
+
+    copied_file_hashes = {}
+    for relative_path, hash_value in file_hashes.items():
+        stat_key = _stat_key(os.stat(path.join(src_dirname, relative_path)))
+        # the change time of the source is updated by hardlinks
+        known_stat = (known_files.get(relative_path) or {}).get('stat')
+        if known_stat is not None and known_stat[:4] == stat_key[:4]:
+            copied_file_hashes[relative_path] = hash_value
+
+    if set(copied_file_hashes) != set(list_files(dirname)):
+        return compute_dirhash(dirname, dir_hash)
+
+    return register_dirhash(dirname, copied_file_hashes)
+
+
+def verify_dirhash(dirname, expected_hash, mode=None):
+    """Return whether the hash of a directory is `expected_hash`, according to the verification mode.
+
+    - full: hash every file of the directory
+    - incremental: rehash the files modified since the manifest of `expected_hash` was registered
+    - trust: trust the manifest registered for `expected_hash` without reading the directory,
+      fall back to incremental if there is none
+    """
+    mode = mode or get_verification_mode()
+
+    if mode == VERIFICATION_FULL:
+        return hash_directory(dirname) == expected_hash
+
+    if mode == VERIFICATION_TRUST and load_manifest(expected_hash) is not None:
+        return path.isdir(dirname)
+
+    if mode not in (VERIFICATION_INCREMENTAL, VERIFICATION_TRUST):
+        raise Exception(f'Unknown data sample hash verification mode: {mode}')
+
+    return compute_dirhash(dirname, expected_hash) == expected_hash
+
+
+def compute_file_hash(file_path, salt=None):
+    """Return the salted sha256 of a file and register its manifest."""
+    stat_key = _stat_key(os.stat(file_path))
+    racy_mtime_ns = int((time.time() - RACY_DELAY) * 1e9)
+
+    hash_value = file_hash(file_path, salt)
+    save_manifest(hash_value, {
+        path.basename(file_path): {
+            'hash': hash_value,
+            'stat': stat_key if stat_key[3] < racy_mtime_ns else None,
+        }
+    })
+    return hash_value
+
+
+def link_hashed_file(src_path, dst_path, hash_value):
+    """Hardlink a file registered in the manifest of `hash_value`, keeping it registered.
+
+    Linking updates the ctime of the inode, its registered stat is updated if it was unchanged before the link.
+    """
+    stat_key = _stat_key(os.stat(src_path))
+    os.link(src_path, dst_path)
+
+    manifest = load_manifest(hash_value) if hash_value else None
+    if manifest is None:
+        return
+
+    linked_stat_key = _stat_key(os.stat(dst_path))
+    files = manifest['files']
+    registered_files = [x for x in files.values() if x['stat'] == stat_key]
+    for registered_file in registered_files:
+        registered_file['stat'] = linked_stat_key
+    if registered_files:
+        save_manifest(hash_value, files)
+
+
+def verify_file_hash(file_path, expected_hash, salt=None):
+    """Return whether the salted sha256 of a file is `expected_hash`.
+
+    The file is not read if it has the stat registered in the manifest of `expected_hash` (same inode).
+    """
+    manifest = load_manifest(expected_hash)
+    if manifest is not None:
+        stat_key = _stat_key(os.stat(file_path))
+        if any(registered_file['stat'] == stat_key for registered_file in manifest['files'].values()):
+            return True
+
+    return compute_file_hash(file_path, salt) == expected_hash
@@ -0,0 +1,325 @@
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from substrapp.ledger_utils import query_ledger
+from substrapp.models import (AlgoMirror, ObjectiveMirror, DataManagerMirror, TraintupleMirror, TesttupleMirror,
+                              ModelMirror)
+
+logger = logging.getLogger(__name__)
+
+# sqlite cannot bind more than 999 variables in a query
+CHUNK_SIZE = 500
+
+
+def is_ledger_mirror_enabled():
+    return getattr(settings, 'LEDGER_MIRROR', {}).get('ENABLED', False)
+
+
+def _nested(data, *keys):
+    for key in keys:
+        if not data:
+            return None
+        data = data.get(key)
+    return data
+
+
+def _tuple_fields(_tuple):
+    return {
+        'creator': _tuple['creator'],
+        'worker': _nested(_tuple, 'dataset', 'worker'),
+        'status': _tuple['status'],
+        'tag': _tuple.get('tag') or '',
+        'algo_key': _nested(_tuple, 'algo', 'hash'),
+        'objective_key': _nested(_tuple, 'objective', 'hash'),
+        'data_manager_key': _nested(_tuple, 'dataset', 'openerHash'),
+    }
+
+
+def algo_fields(algo):
+    return {
+        'name': algo['name'],
+        'owner': algo['owner'],
+    }
+
+
+def objective_fields(objective):
+    return {
+        'name': objective['name'],
+        'owner': objective['owner'],
+        'metrics_name': _nested(objective, 'metrics', 'name') or '',
+        'test_data_manager_key': _nested(objective, 'testDataset', 'dataManagerKey'),
+    }
+
+
+def data_manager_fields(data_manager):
+    return {
+        'name': data_manager['name'],
+        'owner': data_manager['owner'],
+        'type': data_manager.get('type') or '',
+        'objective_key': data_manager.get('objectiveKey') or None,
+    }
+
+
+def traintuple_fields(traintuple):
+    fields = _tuple_fields(traintuple)
+    fields.update({
+        'out_model_hash': _nested(traintuple, 'outModel', 'hash'),
+        'compute_plan_id': traintuple.get('computePlanID') or '',
+        'rank': traintuple.get('rank'),
+    })
+    return fields
+
+
+def testtuple_fields(testtuple):
+    fields = _tuple_fields(testtuple)
+    fields.update({
+        'traintuple_key': _nested(testtuple, 'model', 'traintupleKey'),
+        'certified': bool(testtuple.get('certified')),
+    })
+    return fields
+
+
+def model_fields(model):
+    traintuple = model['traintuple']
+    return {
+        'out_model_hash': _nested(traintuple, 'outModel', 'hash'),
+        'algo_key': _nested(traintuple, 'algo', 'hash'),
+        'objective_key': _nested(traintuple, 'objective', 'hash'),
+        'data_manager_key': _nested(traintuple, 'dataset', 'openerHash'),
+    }
+
+
+# mirror model, list query, and indexed fields of each asset type
+MIRRORS = {
+    'algo': (AlgoMirror, 'queryAlgos', algo_fields),
+    'objective': (ObjectiveMirror, 'queryObjectives', objective_fields),
+    'dataset': (DataManagerMirror, 'queryDataManagers', data_manager_fields),
+    'traintuple': (TraintupleMirror, 'queryTraintuples', traintuple_fields),
+    'testtuple': (TesttupleMirror, 'queryTesttuples', testtuple_fields),
+    'model': (ModelMirror, 'queryModels', model_fields),
+}
+
+
+def _get_key(asset_type, asset):
+    if asset_type == 'model':
+        return asset['traintuple']['key']
+    return asset['key']
+
+
+def mirror_assets(asset_type, assets):
+    """Create or update the local copy of ledger assets."""
+    model, _, get_fields = MIRRORS[asset_type]
+
+    assets = {_get_key(asset_type, asset): asset for asset in assets or []}
+    keys = list(assets.keys())
+
+    with transaction.atomic():
+        for i in range(0, len(keys), CHUNK_SIZE):
+            chunk = keys[i:i + CHUNK_SIZE]
+            existing = dict(model.objects.filter(key__in=chunk).values_list('key', 'data'))
+
+            new_instances = []
+            for key in chunk:
+                data = json.dumps(assets[key], sort_keys=True)
+                fields = get_fields(assets[key])
+
+                if key not in existing:
+                    new_instances.append(model(key=key, data=data, **fields))
+                elif existing[key] != data:
+                    model.objects.filter(key=key).update(data=data, **fields)
+
+            model.objects.bulk_create(new_instances)
+
+
+EMPTY_TESTTUPLE = {
+    'key': '',
+    'algo': None,
+    'certified': False,
+    'creator': '',
+    'dataset': None,
+    'log': '',
+    'model': None,
+    'objective': None,
+    'status': '',
+    'tag': '',
+}
+
+
+def mirror_tuples(tuple_type, tuples):
+    """Update the local copy of tuples (and of their models) from a `tuples-updated` event."""
+    if tuple_type not in ('traintuple', 'testtuple'):
+        return
+
+    mirror_assets(tuple_type, tuples)
+
+    # models pair a traintuple with its certified testtuple
+    if tuple_type == 'traintuple':
+        instances = ModelMirror.objects.in_bulk([_tuple['key'] for _tuple in tuples])
+        models = [{
+            'traintuple': _tuple,
+            'testtuple': instances[_tuple['key']].to_ledger()['testtuple']
+            if _tuple['key'] in instances else EMPTY_TESTTUPLE,
+        } for _tuple in tuples]
+    else:
+        testtuples = {_tuple['model']['traintupleKey']: _tuple
+                      for _tuple in tuples if _tuple.get('certified') and _tuple.get('model')}
+        instances = ModelMirror.objects.in_bulk(list(testtuples.keys()))
+        models = [dict(instance.to_ledger(), testtuple=testtuples[key]) for key, instance in instances.items()]
+
+    mirror_assets('model', models)
+
+
+# asset type and query of the assets registered by a chaincode function
+REGISTERED_ASSETS = {
+    'registerAlgo': ('algo', 'queryAlgo'),
+    'registerObjective': ('objective', 'queryObjective'),
+    'registerDataManager': ('dataset', 'queryDataManager'),
+}
+
+
+def mirror_registered_asset(fcn, key):
+    """Add an asset registered by a successful invoke to the local copy, as assets do not trigger events."""
+    if not is_ledger_mirror_enabled() or fcn not in REGISTERED_ASSETS:
+        return
+
+    asset_type, query = REGISTERED_ASSETS[fcn]
+    try:
+        mirror_assets(asset_type, [query_ledger(fcn=query, args={'key': key})])
+    except Exception as e:
+        # the periodic synchronization will catch up
+        logger.warning(f'Cannot mirror {asset_type} {key}: {e}')
+
+
+def sync_ledger_mirror():
+    """Catch up the local copy with the ledger, for assets which do not trigger events."""
+    for asset_type, (_, list_query, _) in MIRRORS.items():
+        assets = query_ledger(fcn=list_query, args=[])
+        mirror_assets(asset_type, assets)
+        logger.info(f'Ledger mirror: {len(assets or [])} {asset_type} synchronized')
+
+
+# Search filters
+#
+# The attributes stored in an indexed column, by asset type. Other attributes are
+# matched in python on the serialized assets remaining after the SQL filters.
+INDEXED_ATTRIBUTES = {
+    'algo': {'key': 'key', 'name': 'name', 'owner': 'owner'},
+    'objective': {'key': 'key', 'name': 'name', 'owner': 'owner', 'metrics': 'metrics_name'},
+    'dataset': {'key': 'key', 'name': 'name', 'owner': 'owner', 'type': 'type', 'objectiveKey': 'objective_key'},
+    'traintuple': {'key': 'key', 'creator': 'creator', 'status': 'status', 'tag': 'tag',
+                   'computePlanID': 'compute_plan_id', 'rank': 'rank'},
+    'testtuple': {'key': 'key', 'creator': 'creator', 'status': 'status', 'tag': 'tag',
+                  'certified': 'certified'},
+}
+
+
+def _match(asset_type, asset, attribute, values, strict):
+    if asset_type == 'objective' and attribute == 'metrics':  # specific to nested metrics
+        return asset[attribute]['name'] in values
+    if strict:
+        return asset[attribute] in values
+    return asset.get(attribute) in values
+
+
+def _filter_attributes(asset_type, queryset, subfilters, strict=True):
+    unindexed_subfilters = {}
+
+    for attribute, values in subfilters.items():
+        column = INDEXED_ATTRIBUTES[asset_type].get(attribute)
+        if column is None or column in ('rank', 'certified'):  # not string columns
+            unindexed_subfilters[attribute] = values
+        else:
+            queryset = queryset.filter(**{f'{column}__in': values})
+
+    if unindexed_subfilters:
+        keys = [instance.key for instance in queryset
+                if all(_match(asset_type, instance.to_ledger(), attribute, values, strict)
+                       for attribute, values in unindexed_subfilters.items())]
+        queryset = queryset.model.objects.filter(key__in=keys)
+
+    return queryset
+
+
+def _filter_model_attributes(queryset, subfilters):
+    """Filter traintuples or models on their out model attributes."""
+    for attribute, values in subfilters.items():
+        if attribute == 'hash':
+            queryset = queryset.filter(out_model_hash__in=values)
+        else:
+            queryset = queryset.filter(out_model_hash__isnull=False)
+            if queryset.model is ModelMirror:
+                keys = [instance.key for instance in queryset
+                        if instance.to_ledger()['traintuple']['outModel'][attribute] in values]
+            else:
+                keys = [instance.key for instance in queryset
+                        if instance.to_ledger()['outModel'][attribute] in values]
+            queryset = queryset.model.objects.filter(key__in=keys)
+
+    return queryset
+
+
+def _filter_by_other_asset(object_type, queryset, filter_key, subfilters):
+    if filter_key == 'model':
+        traintuples = _filter_model_attributes(TraintupleMirror.objects.all(), subfilters)
+
+        if object_type == 'algo':
+            return queryset.filter(key__in=traintuples.values('algo_key'))
+        elif object_type == 'dataset':
+            return queryset.filter(objective_key__in=traintuples.values('objective_key'))
+        elif object_type == 'objective':
+            return queryset.filter(key__in=traintuples.values('objective_key'))
+
+    else:
+        other_model = MIRRORS[filter_key][0]
+        others = _filter_attributes(filter_key, other_model.objects.all(), subfilters)
+
+        if filter_key == 'algo' and object_type == 'model':
+            return queryset.filter(algo_key__in=others.values('key'))
+        elif filter_key == 'dataset' and object_type == 'model':
+            return queryset.filter(data_manager_key__in=others.values('key'))
+        elif filter_key == 'dataset' and object_type == 'objective':
+            return queryset.filter(Q(key__in=others.values('objective_key')) |
+                                   Q(test_data_manager_key__in=others.values('key')))
+        elif filter_key == 'objective' and object_type == 'model':
+            return queryset.filter(objective_key__in=others.values('key'))
+        elif filter_key == 'objective' and object_type == 'dataset':
+            return queryset.filter(objective_key__in=others.values('key'))
+
+    return queryset
+
+
+def filter_mirror(object_type, filters, authorized_filters):
+    """SQL implementation of `substrapp.views.filters_utils.filter_list` on the local copy of the ledger."""
+    model = MIRRORS[object_type][0]
+
+    object_list = []
+
+    for user_filter in filters:
+
+        for filter_key, subfilters in user_filter.items():
+
+            if filter_key not in authorized_filters[object_type]:
+                raise Exception(f'Not authorized filter key {filter_key} for asset {object_type}')
+
+            queryset = model.objects.all()
+
+            if filter_key == object_type:
+                # Filter by own asset
+                if filter_key == 'model':
+                    # every model attribute is matched against its hash
+                    for values in subfilters.values():
+                        queryset = _filter_model_attributes(queryset, {'hash': values})
+                else:
+                    queryset = _filter_attributes(object_type, queryset, subfilters,
+                                                  strict=object_type == 'objective')
+            else:
+                # Filter by other asset
+                queryset = _filter_by_other_asset(object_type, queryset, filter_key, subfilters)
+
+            object_list.append([instance.to_ledger() for instance in queryset])
+
+    return object_list
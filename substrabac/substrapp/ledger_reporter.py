@@ -0,0 +1,146 @@
+import json
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from substrapp.ledger_utils import (invoke_ledger, LedgerStatusError, LedgerNotFound, LedgerForbidden,
+                                    LedgerConflict, WAIT_FOR_EVENT_TIMEOUT)
+from substrapp.models import LedgerReport
+
+logger = logging.getLogger(__name__)
+
+# Asynchronous reports of the tuple statuses to the ledger.
+#
+# The success or failure of a tuple is stored as a pending report in the database instead of being
+# invoked by the task, which would wait for the commit event (up to 45s) and sleep between retries.
+# Pending reports are submitted by the reporter task, queued after each report and run periodically:
+# a batch of reports is claimed and submitted concurrently, reports which fail are retried with an
+# exponential backoff. As they are persisted, reports survive a restart of the worker.
+
+# the report is already applied or can never be
+FINAL_ERRORS = (LedgerStatusError, LedgerNotFound, LedgerForbidden, LedgerConflict)
+# time for a report to be submitted once its claim is renewed, before it may be claimed by another reporter
+SUBMIT_TIMEOUT = WAIT_FOR_EVENT_TIMEOUT + 15  # seconds
+
+
+def _get_reporter_setting(name, default):
+    return getattr(settings, 'LEDGER_REPORTER', {}).get(name, default)
+
+
+def is_ledger_reporter_enabled():
+    return _get_reporter_setting('ENABLED', False)
+
+
+def get_backoff(attempts):
+    base = _get_reporter_setting('BACKOFF_BASE', 2)
+    return min(base * 2 ** (attempts - 1), _get_reporter_setting('BACKOFF_MAX', 300))
+
+
+def enqueue_report(tuple_type, tuple_key, fcn, args):
+    """Store a status update of a tuple, replacing the pending one if any."""
+    LedgerReport.objects.update_or_create(
+        tuple_key=tuple_key,
+        defaults={
+            'tuple_type': tuple_type,
+            'fcn': fcn,
+            'args': json.dumps(args),
+            'attempts': 0,
+            'next_attempt_at': timezone.now(),
+            'last_error': '',
+        })
+
+
+# Threads submitting reports, kept between reporter tasks to reuse their ledger clients
+_report_executor = None
+_report_executor_pid = None
+_report_executor_lock = threading.Lock()
+
+
+def get_report_executor():
+    global _report_executor, _report_executor_pid
+
+    with _report_executor_lock:
+        if _report_executor is None or _report_executor_pid != os.getpid():
+            _report_executor = ThreadPoolExecutor(max_workers=_get_reporter_setting('WORKERS', 4))
+            _report_executor_pid = os.getpid()
+
+    return _report_executor
+
+
+def get_claim_timeout(batch_size):
+    """Return the time for the reports of a batch to be submitted by the reporter threads."""
+    return math.ceil(batch_size / _get_reporter_setting('WORKERS', 4)) * SUBMIT_TIMEOUT
+
+
+def _claimed(report):
+    # a report replaced by `enqueue_report` while submitted is kept pending
+    return LedgerReport.objects.filter(pk=report.pk, next_attempt_at=report.next_attempt_at)
+
+
+def _renew_claim(report, timeout):
+    """Extend the claim of a report, return False if it has been replaced or claimed by another reporter."""
+    claimed_at = timezone.now() + timedelta(seconds=timeout)
+    # only one reporter updates the attempt date it read
+    if not _claimed(report).update(next_attempt_at=claimed_at):
+        return False
+    report.next_attempt_at = claimed_at
+    return True
+
+
+def claim_reports(batch_size):
+    """Return due reports which have not been claimed by another reporter meanwhile."""
+    claim_timeout = get_claim_timeout(batch_size)
+    return [report for report in LedgerReport.objects.filter(next_attempt_at__lte=timezone.now())[:batch_size]
+            if _renew_claim(report, claim_timeout)]
+
+
+def submit_report(report):
+    try:
+        # the claim of the batch may have expired while waiting for a reporter thread
+        if not _renew_claim(report, SUBMIT_TIMEOUT):
+            logger.info(f'{report} replaced or claimed by another reporter')
+            return
+
+        invoke_ledger(fcn=report.fcn, args=report.get_args(), sync=True)
+    except FINAL_ERRORS as e:
+        logger.error(f'Drop {report}: {e}')
+        _claimed(report).delete()
+    except Exception as e:
+        attempts = report.attempts + 1
+        backoff = get_backoff(attempts)
+        logger.warning(f'Cannot submit {report} (attempt {attempts}): {e} retrying in {backoff}s')
+        _claimed(report).update(
+            attempts=attempts,
+            next_attempt_at=timezone.now() + timedelta(seconds=backoff),
+            last_error=str(e))
+    else:
+        logger.info(f'{report} submitted')
+        _claimed(report).delete()
+    finally:
+        # submitting threads outlive the task, do not keep their db connections open
+        if threading.current_thread() is not threading.main_thread():
+            connections.close_all()
+
+
+def flush_reports():
+    """Submit the due pending reports, return the number of reports processed."""
+    batch_size = _get_reporter_setting('BATCH_SIZE', 50)
+    processed = 0
+
+    while True:
+        reports = claim_reports(batch_size)
+        if not reports:
+            return processed
+
+        list(get_report_executor().map(submit_report, reports))
+        processed += len(reports)
+
+        if len(reports) < batch_size:
+            return processed
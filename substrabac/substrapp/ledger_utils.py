@@ -1,10 +1,16 @@
+import collections
 import contextlib
 import functools
+import hashlib
 import json
 import logging
+import os
+import threading
 import time
+import uuid
 
 from django.conf import settings
+from django.core.cache import caches
 from rest_framework import status
 from aiogrpc import RpcError
 
@@ -12,6 +18,11 @@ from aiogrpc import RpcError
 LEDGER = getattr(settings, 'LEDGER', None)
 logger = logging.getLogger(__name__)
 
+# A hfc client is bound to its asyncio event loop and to its gRPC channels, none of
+# which can be shared between threads or survive a fork (celery prefork children).
+# Clients are therefore cached per thread and dropped when the process id changes.
+_hfc_local = threading.local()
+
 
 class LedgerError(Exception):
     status = status.HTTP_400_BAD_REQUEST
@@ -109,14 +120,41 @@ def retry_on_error(delay=1, nbtries=5, backoff=2):
     return _retry
 
 
+def _get_cached_hfc():
+    hfc = getattr(_hfc_local, 'hfc', None)
+
+    if hfc is not None:
+        ttl = getattr(settings, 'LEDGER_CLIENT_TTL', 3600)
+        if hfc['pid'] == os.getpid() and time.time() - hfc['created_at'] < ttl:
+            return hfc['loop'], hfc['client']
+        # expired or inherited from the parent process: rebuild it (discovery included)
+        reset_hfc()
+
+    loop, client = LEDGER['hfc']()
+    _hfc_local.hfc = {
+        'pid': os.getpid(),
+        'created_at': time.time(),
+        'loop': loop,
+        'client': client,
+    }
+
+    return loop, client
+
+
+def reset_hfc():
+    """Drop the hfc client of the current thread, a new one is created on next call."""
+    hfc = getattr(_hfc_local, 'hfc', None)
+    _hfc_local.hfc = None
+
+    # never close a loop inherited from a parent process, it is not ours
+    if hfc is not None and hfc['pid'] == os.getpid():
+        hfc['loop'].close()
+
+
 @contextlib.contextmanager
 def get_hfc():
-    loop, client = LEDGER['hfc']()
-    try:
-        yield (loop, client)
-    finally:
-        del client
-        loop.close()
+    loop, client = _get_cached_hfc()
+    yield (loop, client)
 
 
 def call_ledger(call_type, fcn, args=None, kwargs=None):
@@ -166,6 +204,9 @@ def call_ledger(call_type, fcn, args=None, kwargs=None):
             try:  # get first failed response from list of protobuf ProposalResponse
                 response = [r for r in e.args[0] if r.response.status != 200][0].response.message
             except Exception:
+                # not a chaincode error: the peers or the orderer may have changed or the
+                # connection is broken, discover the network again on next call
+                reset_hfc()
                 raise LedgerError(str(e))
 
         # Deserialize the stringified json
@@ -187,10 +228,238 @@ def call_ledger(call_type, fcn, args=None, kwargs=None):
         return response
 
 
+# Seconds a query response is kept in cache, per chaincode function. Algos and
+# objectives cannot change once registered: they are pinned (None) until evicted.
+# Functions which are not listed are never cached, nor are the unpinned ones
+# without a cache backend shared between processes.
+LEDGER_CACHE_TTL = {
+    'queryAlgo': None,
+    'queryObjective': None,
+    'queryDataManager': 60,
+    'queryDataset': 60,
+    'queryAlgos': 30,
+    'queryObjectives': 30,
+    'queryDataManagers': 30,
+    'queryDataSamples': 30,
+    'queryTraintuple': 5,
+    'queryTesttuple': 5,
+    'queryTraintuples': 5,
+    'queryTesttuples': 5,
+    'queryModels': 5,
+    'queryModelDetails': 5,
+}
+
+# List queries to invalidate once an invoke of the chaincode function succeeded
+LEDGER_CACHE_INVALIDATIONS = {
+    'registerAlgo': ['queryAlgos'],
+    'registerObjective': ['queryObjectives', 'queryDataManagers'],
+    'registerDataManager': ['queryDataManagers'],
+    'updateDataManager': ['queryDataManagers'],
+    'registerDataSample': ['queryDataSamples'],
+    'updateDataSample': ['queryDataSamples'],
+    'createTraintuple': ['queryTraintuples', 'queryModels'],
+    'createTesttuple': ['queryTesttuples', 'queryModels'],
+    'createComputePlan': ['queryTraintuples', 'queryTesttuples', 'queryModels'],
+}
+
+# Tuple status updates, the tuple type of each chaincode function
+TUPLE_LOG_FUNCTIONS = {
+    'logStartTrain': 'traintuple',
+    'logSuccessTrain': 'traintuple',
+    'logFailTrain': 'traintuple',
+    'logStartTest': 'testtuple',
+    'logSuccessTest': 'testtuple',
+    'logFailTest': 'testtuple',
+}
+
+TUPLE_CACHE_QUERIES = {
+    'traintuple': ('queryTraintuple', 'queryTraintuples'),
+    'testtuple': ('queryTesttuple', 'queryTesttuples'),
+}
+
+
+class LedgerCache(object):
+    """LRU cache of serialized ledger responses, local to the process.
+
+    If a django cache is given as backend, it is shared between processes (web server, events app and
+    celery workers): each entry is stored in the backend with a version, and a local entry is only served
+    while its version is the one of the backend, so that invalidations are seen by all of them. Without
+    backend, invalidations only evict the entries of the calling process: see `get_ledger_cache_ttl`.
+    """
+
+    def __init__(self, max_size=1024, backend=None):
+        self.max_size = max_size
+        self.backend = backend
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _version_key(key):
+        return f'{key}:version'
+
+    def _set_local(self, key, value, ttl, version=None):
+        expires_at = None if ttl is None else time.time() + ttl
+
+        with self._lock:
+            self._entries[key] = (value, expires_at, version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _get_local(self, key, version=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at, entry_version = entry
+            if (expires_at is None or expires_at > time.time()) and entry_version == version:
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+        return None
+
+    def get(self, key, ttl):
+        if self.backend is None:
+            return self._get_local(key)
+
+        # the version is checked before a local hit, the value is only fetched when it changed
+        version = self.backend.get(self._version_key(key))
+        if version is None:
+            return None
+        value = self._get_local(key, version)
+        if value is not None:
+            return value
+
+        entries = self.backend.get_many([key, self._version_key(key)])
+        value, version = entries.get(key), entries.get(self._version_key(key))
+        if value is not None and version is not None:
+            self._set_local(key, value, ttl, version)
+        return value
+
+    def set(self, key, value, ttl):
+        version = None
+        if self.backend is not None:
+            version = uuid.uuid4().hex
+            self.backend.set_many({key: value, self._version_key(key): version}, timeout=ttl)
+        self._set_local(key, value, ttl, version)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.backend is not None:
+            self.backend.delete_many([key, self._version_key(key)])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_ledger_cache = None
+
+
+def get_ledger_cache():
+    global _ledger_cache
+
+    config = getattr(settings, 'LEDGER_CACHE', {})
+    if not config.get('ENABLED', False):
+        return None
+
+    if _ledger_cache is None:
+        backend = config.get('BACKEND')
+        _ledger_cache = LedgerCache(
+            max_size=config.get('MAX_SIZE', 1024),
+            backend=caches[backend] if backend else None
+        )
+
+    return _ledger_cache
+
+
+def get_ledger_cache_ttl(fcn):
+    """Return a (cacheable, ttl) tuple for a chaincode query function."""
+    config = getattr(settings, 'LEDGER_CACHE', {})
+    ttls = dict(LEDGER_CACHE_TTL)
+    ttls.update(config.get('TTL', {}))
+
+    if fcn not in ttls or ttls[fcn] == 0:
+        return False, None
+    # other processes would not see the invalidations of this one and serve stale assets
+    if not config.get('BACKEND') and ttls[fcn] is not None:
+        return False, None
+    return True, ttls[fcn]
+
+
+def get_ledger_cache_key(fcn, args=None):
+    # list queries are called indifferently with args None or []
+    serialized_args = json.dumps(args or None, sort_keys=True)
+    return f'ledger:{fcn}:{hashlib.sha256(serialized_args.encode()).hexdigest()}'
+
+
+def invalidate_ledger_cache(fcn, args=None):
+    cache = get_ledger_cache()
+    if cache is not None:
+        cache.delete(get_ledger_cache_key(fcn, args))
+
+
+def invalidate_tuples_cache(tuple_type, tuple_keys):
+    """Invalidate cached queries of tuples which have been updated."""
+    if tuple_type not in TUPLE_CACHE_QUERIES:
+        return
+
+    query, list_query = TUPLE_CACHE_QUERIES[tuple_type]
+
+    for tuple_key in tuple_keys:
+        invalidate_ledger_cache(query, {'key': tuple_key})
+        if tuple_type == 'traintuple':
+            invalidate_ledger_cache('queryModelDetails', {'key': tuple_key})
+
+    invalidate_ledger_cache(list_query)
+    invalidate_ledger_cache('queryModels')
+
+
+def invalidate_invoked_assets_cache(fcn, args):
+    """Invalidate cached queries of assets updated by a successful invoke."""
+    for query in LEDGER_CACHE_INVALIDATIONS.get(fcn, []):
+        invalidate_ledger_cache(query)
+
+    if not isinstance(args, dict):
+        return
+
+    if fcn in TUPLE_LOG_FUNCTIONS:
+        invalidate_tuples_cache(TUPLE_LOG_FUNCTIONS[fcn], [args['key']])
+
+    # data managers embed their data samples and their objective
+    data_manager_keys = list(args.get('dataManagerKeys', []))
+    if args.get('dataManagerKey'):
+        data_manager_keys.append(args['dataManagerKey'])
+
+    for data_manager_key in data_manager_keys:
+        invalidate_ledger_cache('queryDataManager', {'key': data_manager_key})
+        invalidate_ledger_cache('queryDataset', {'key': data_manager_key})
+
+
 @retry_on_error()
 def query_ledger(fcn, args=None):
     # careful, passing invoke parameters to query_ledger will NOT fail
-    return call_ledger('query', fcn=fcn, args=args)
+    cache = get_ledger_cache()
+    cacheable, ttl = get_ledger_cache_ttl(fcn)
+
+    if cache is None or not cacheable:
+        return call_ledger('query', fcn=fcn, args=args)
+
+    key = get_ledger_cache_key(fcn, args)
+    cached_response = cache.get(key, ttl)
+    if cached_response is not None:
+        # deserialize on each hit: callers are free to update the response
+        return json.loads(cached_response)
+
+    response = call_ledger('query', fcn=fcn, args=args)
+    cache.set(key, json.dumps(response), ttl)
+
+    return response
+
+
+# time waited for the commit event of a synchronous invoke
+WAIT_FOR_EVENT_TIMEOUT = 45  # seconds
 
 
 @retry_on_error()
@@ -200,13 +469,15 @@ def invoke_ledger(fcn, args=None, cc_pattern=None, sync=False, only_pkhash=True)
     }
 
     if sync:
-        params['wait_for_event_timeout'] = 45
+        params['wait_for_event_timeout'] = WAIT_FOR_EVENT_TIMEOUT
 
     if cc_pattern:
         params['cc_pattern'] = cc_pattern
 
     response = call_ledger('invoke', fcn=fcn, args=args, kwargs=params)
 
+    invalidate_invoked_assets_cache(fcn, args)
+
     if only_pkhash:
         return {'pkhash': response.get('key', response.get('keys'))}
     else:
@@ -218,23 +489,20 @@ def get_object_from_ledger(pk, query):
     return query_ledger(fcn=query, args={'key': pk})
 
 
-@retry_on_error()
-def log_fail_tuple(tuple_type, tuple_key, err_msg):
+def get_fail_tuple_invoke(tuple_type, tuple_key, err_msg):
+    """Return the chaincode function and arguments logging the failure of a tuple."""
     err_msg = str(err_msg).replace('"', "'").replace('\\', "").replace('\\n', "")[:200]
 
     fail_type = 'logFailTrain' if tuple_type == 'traintuple' else 'logFailTest'
 
-    return invoke_ledger(
-        fcn=fail_type,
-        args={
-            'key': tuple_key,
-            'log': err_msg,
-        },
-        sync=True)
+    return fail_type, {
+        'key': tuple_key,
+        'log': err_msg,
+    }
 
 
-@retry_on_error()
-def log_success_tuple(tuple_type, tuple_key, res):
+def get_success_tuple_invoke(tuple_type, tuple_key, res):
+    """Return the chaincode function and arguments logging the success of a tuple."""
     if tuple_type == 'traintuple':
         invoke_fcn = 'logSuccessTrain'
         invoke_args = {
@@ -258,7 +526,19 @@ def log_success_tuple(tuple_type, tuple_key, res):
     else:
         raise NotImplementedError()
 
-    return invoke_ledger(fcn=invoke_fcn, args=invoke_args, sync=True)
+    return invoke_fcn, invoke_args
+
+
+@retry_on_error()
+def log_fail_tuple(tuple_type, tuple_key, err_msg):
+    fcn, args = get_fail_tuple_invoke(tuple_type, tuple_key, err_msg)
+    return invoke_ledger(fcn=fcn, args=args, sync=True)
+
+
+@retry_on_error()
+def log_success_tuple(tuple_type, tuple_key, res):
+    fcn, args = get_success_tuple_invoke(tuple_type, tuple_key, res)
+    return invoke_ledger(fcn=fcn, args=args, sync=True)
 
 
 @retry_on_error()
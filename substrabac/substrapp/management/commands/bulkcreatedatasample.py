@@ -1,17 +1,14 @@
 import json
 import ntpath
-import os
-from os.path import normpath
 
-from checksumdir import dirhash
-from django.core.files.base import ContentFile
 from django.core.management.base import BaseCommand, CommandError
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 
-from substrapp.serializers.datasample import DataSampleSerializer
+from substrapp.bulk_import import import_data_samples
 from substrapp.views import DataSampleViewSet
-from substrapp.utils import get_dir_hash
 from substrapp.views.datasample import LedgerException
+from substrapp.views.utils import get_success_create_code
 
 
 def path_leaf(path):
@@ -26,79 +23,25 @@ class InvalidException(Exception):
         super(LedgerException).__init__()
 
 
-# check if not already in data sample list
-def check(file_or_path, pkhash, data_sample):
-    err_msg = 'Your data sample archives/paths contain same files leading to same pkhash, ' \
-              'please review the content of your achives/paths. %s and %s are the same'
-    for x in data_sample:
-        if pkhash == x['pkhash']:
-            if 'file' in x:
-                p = x['file'].name
-            else:
-                p = x['path']
-            raise Exception(err_msg % (file_or_path, p))
-
-
-def map_data_sample(paths):
-    data_sample = []
-    for file_or_path in paths:
-        if os.path.exists(file_or_path):
-
-            # file case
-            if os.path.isfile(file_or_path):
-                with open(file_or_path, 'rb') as f:
-                    filename = path_leaf(file_or_path)
-                    file = ContentFile(f.read(), filename)
-                    pkhash = get_dir_hash(file)
-
-                    check(file_or_path, pkhash, data_sample)
-
-                    data_sample.append({
-                        'pkhash': pkhash,
-                        'file': file
-                    })
-
-            # directory case
-            elif os.path.isdir(file_or_path):
-                pkhash = dirhash(file_or_path, 'sha256')
-
-                check(file_or_path, pkhash, data_sample)
-
-                data_sample.append({
-                    'pkhash': pkhash,
-                    'path': normpath(file_or_path)
-                })
-            else:
-                raise Exception(f'{file_or_path} is not a file or a directory')
-
-        else:
-            raise Exception(f'File or Path: {file_or_path} does not exist')
-
-    return data_sample
-
-
-def bulk_create_data_sample(data):
+def bulk_create_data_sample(data, progress=None):
     data_manager_keys = data.get('data_manager_keys', [])
     test_only = data.get('test_only', False)
     paths = data.get('paths', None)
+    multiple = data.get('multiple', False)
 
     DataSampleViewSet.check_datamanagers(data_manager_keys)
 
     if not (paths and type(paths)) == list:
         raise Exception('Please specify a list of paths (can be archives or directories)')
 
-    data_samples = map_data_sample(paths)
-
-    serializer = DataSampleSerializer(data=data_samples, many=True)
+    # create on db + ledger by chunks
     try:
-        serializer.is_valid(raise_exception=True)
-    except Exception as e:
-        raise InvalidException(msg=str(e), data=[x['pkhash'] for x in data_samples])
+        data_samples = import_data_samples(paths, data_manager_keys, test_only=test_only, multiple=multiple,
+                                           progress=progress)
+    except ValidationError as e:
+        raise InvalidException(msg=str(e), data=getattr(e, 'pkhashes', []))
 
-    # create on ledger + db
-    ledger_data = {'test_only': test_only,
-                   'data_manager_keys': data_manager_keys}
-    return DataSampleViewSet.commit(serializer, ledger_data)
+    return data_samples, get_success_create_code()
 
 
 class Command(BaseCommand):
@@ -109,11 +52,16 @@ class Command(BaseCommand):
     python ./manage.py bulkcreatedatasample data.json
     # data.json:
     # {"paths": ["./data1.zip", "./data2.zip", "./train/data", "./train/data2"], "data_manager_keys": ["9a832ed6cee6acf7e33c3acffbc89cebf10ef503b690711bdee048b873daf528"], "test_only": false}
+    # with "multiple": true, paths are parent directories of data sample directories
+    # an interrupted import is resumed by running the command again with the same data
     '''
 
     def add_arguments(self, parser):
         parser.add_argument('data', type=str)
 
+    def progress(self, position, created, existing):
+        self.stdout.write(f'{position} paths processed: {created} data samples added, {existing} already existing')
+
     def handle(self, *args, **options):
 
         # load args
@@ -135,7 +83,7 @@ class Command(BaseCommand):
             return self.stderr.write('The data_manager_keys you provided is not an array')
 
         try:
-            res, st = bulk_create_data_sample(data)
+            res, st = bulk_create_data_sample(data, progress=self.progress)
         except LedgerException as e:
             if e.st == status.HTTP_408_REQUEST_TIMEOUT:
                 self.stdout.write(self.style.WARNING(json.dumps(e.data, indent=2)))
@@ -0,0 +1,118 @@
+# Generated by Django 2.1.2 on 2026-10-16 22:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlgoMirror',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.TextField()),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(db_index=True, max_length=1024)),
+                ('owner', models.CharField(db_index=True, max_length=1024)),
+            ],
+            options={
+                'ordering': ['key'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DataManagerMirror',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.TextField()),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(db_index=True, max_length=1024)),
+                ('owner', models.CharField(db_index=True, max_length=1024)),
+                ('type', models.CharField(db_index=True, max_length=1024)),
+                ('objective_key', models.CharField(db_index=True, max_length=64, null=True)),
+            ],
+            options={
+                'ordering': ['key'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ModelMirror',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.TextField()),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+                ('out_model_hash', models.CharField(db_index=True, max_length=64, null=True)),
+                ('algo_key', models.CharField(db_index=True, max_length=64, null=True)),
+                ('objective_key', models.CharField(db_index=True, max_length=64, null=True)),
+                ('data_manager_key', models.CharField(db_index=True, max_length=64, null=True)),
+            ],
+            options={
+                'ordering': ['key'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ObjectiveMirror',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.TextField()),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(db_index=True, max_length=1024)),
+                ('owner', models.CharField(db_index=True, max_length=1024)),
+                ('metrics_name', models.CharField(db_index=True, max_length=1024)),
+                ('test_data_manager_key', models.CharField(db_index=True, max_length=64, null=True)),
+            ],
+            options={
+                'ordering': ['key'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='TesttupleMirror',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.TextField()),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+                ('creator', models.CharField(db_index=True, max_length=1024)),
+                ('worker', models.CharField(db_index=True, max_length=1024, null=True)),
+                ('status', models.CharField(db_index=True, max_length=64)),
+                ('tag', models.CharField(blank=True, db_index=True, max_length=1024)),
+                ('algo_key', models.CharField(db_index=True, max_length=64, null=True)),
+                ('objective_key', models.CharField(db_index=True, max_length=64, null=True)),
+                ('data_manager_key', models.CharField(db_index=True, max_length=64, null=True)),
+                ('traintuple_key', models.CharField(db_index=True, max_length=64, null=True)),
+                ('certified', models.BooleanField(default=False)),
+            ],
+            options={
+                'ordering': ['key'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='TraintupleMirror',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.TextField()),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+                ('creator', models.CharField(db_index=True, max_length=1024)),
+                ('worker', models.CharField(db_index=True, max_length=1024, null=True)),
+                ('status', models.CharField(db_index=True, max_length=64)),
+                ('tag', models.CharField(blank=True, db_index=True, max_length=1024)),
+                ('algo_key', models.CharField(db_index=True, max_length=64, null=True)),
+                ('objective_key', models.CharField(db_index=True, max_length=64, null=True)),
+                ('data_manager_key', models.CharField(db_index=True, max_length=64, null=True)),
+                ('out_model_hash', models.CharField(db_index=True, max_length=64, null=True)),
+                ('compute_plan_id', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('rank', models.IntegerField(null=True)),
+            ],
+            options={
+                'ordering': ['key'],
+                'abstract': False,
+            },
+        ),
+    ]
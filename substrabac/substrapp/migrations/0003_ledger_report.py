@@ -0,0 +1,29 @@
+# Generated by Django 2.1.2 on 2026-10-16 23:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0002_ledger_mirror'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerReport',
+            fields=[
+                ('tuple_key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('tuple_type', models.CharField(max_length=64)),
+                ('fcn', models.CharField(max_length=64)),
+                ('args', models.TextField()),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(db_index=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['next_attempt_at'],
+            },
+        ),
+    ]
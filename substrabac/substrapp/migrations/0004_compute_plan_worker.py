@@ -0,0 +1,21 @@
+# Generated by Django 2.1.2 on 2026-10-16 23:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0003_ledger_report'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComputePlanWorker',
+            fields=[
+                ('compute_plan_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('worker', models.CharField(max_length=1024)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
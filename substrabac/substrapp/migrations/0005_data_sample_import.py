@@ -0,0 +1,33 @@
+# Generated by Django 2.1.2 on 2026-10-16 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0004_compute_plan_worker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataSampleImport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('import_key', models.CharField(max_length=64)),
+                ('position', models.IntegerField()),
+                ('input_path', models.TextField()),
+                ('pkhash', models.CharField(db_index=True, max_length=64)),
+                ('path', models.TextField(blank=True)),
+                ('state', models.CharField(choices=[('hashed', 'hashed'), ('linked', 'linked'), ('saved', 'saved'), ('committed', 'committed')], default='hashed', max_length=16)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['import_key', 'position'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='datasampleimport',
+            unique_together={('import_key', 'position')},
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.1.2 on 2026-10-16 23:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0005_data_sample_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasample',
+            name='storage',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='datasampleimport',
+            name='storage',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.1.2 on 2026-10-16 23:33
+
+from django.db import migrations, models
+import substrapp.models.uploadsession
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0006_data_sample_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.CharField(default=substrapp.models.uploadsession.get_session_id, editable=False, max_length=32, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('offset', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
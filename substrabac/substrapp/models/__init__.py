@@ -5,5 +5,13 @@ from .objective import Objective
 from .datamanager import DataManager
 from .algo import Algo
 from .model import Model
+from .mirror import (AlgoMirror, ObjectiveMirror, DataManagerMirror, TraintupleMirror, TesttupleMirror,
+                     ModelMirror)
+from .report import LedgerReport
+from .computeplan import ComputePlanWorker
+from .datasampleimport import DataSampleImport
+from .uploadsession import UploadSession
 
-__all__ = ['DataSample', 'Objective', 'DataManager', 'Algo', 'Model']
+__all__ = ['DataSample', 'Objective', 'DataManager', 'Algo', 'Model',
+           'AlgoMirror', 'ObjectiveMirror', 'DataManagerMirror', 'TraintupleMirror', 'TesttupleMirror',
+           'ModelMirror', 'LedgerReport', 'ComputePlanWorker', 'DataSampleImport', 'UploadSession']
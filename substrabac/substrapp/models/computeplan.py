@@ -0,0 +1,11 @@
+from django.db import models
+
+
+class ComputePlanWorker(models.Model):
+    """Worker running the tuples of a compute plan, its name is the queue of the worker"""
+    compute_plan_id = models.CharField(primary_key=True, max_length=64)
+    worker = models.CharField(max_length=1024)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Compute plan {self.compute_plan_id} on {self.worker}'
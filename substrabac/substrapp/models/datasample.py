@@ -8,6 +8,7 @@ class DataSample(models.Model):
     pkhash = models.CharField(primary_key=True, max_length=64, blank=True)
     validated = models.BooleanField(default=False)
     path = models.FilePathField(max_length=500, blank=True, null=True)  # path max length to 500 instead of default 100
+    storage = models.CharField(max_length=16, blank=True)  # strategy used to store the data in MEDIA_ROOT
 
     def save(self, *args, **kwargs):
         if not self.pkhash:
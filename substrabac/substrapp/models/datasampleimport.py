@@ -0,0 +1,31 @@
+from django.db import models
+
+
+class DataSampleImport(models.Model):
+    """Progress of an input (archive or directory) of a bulk import of data samples"""
+    HASHED = 'hashed'
+    LINKED = 'linked'  # stored in MEDIA_ROOT/datasamples
+    SAVED = 'saved'  # saved in the database
+    COMMITTED = 'committed'  # registered on the ledger
+    STATES = (
+        (HASHED, HASHED),
+        (LINKED, LINKED),
+        (SAVED, SAVED),
+        (COMMITTED, COMMITTED),
+    )
+
+    import_key = models.CharField(max_length=64)
+    position = models.IntegerField()
+    input_path = models.TextField()
+    pkhash = models.CharField(max_length=64, db_index=True)
+    path = models.TextField(blank=True)
+    storage = models.CharField(max_length=16, blank=True)
+    state = models.CharField(max_length=16, choices=STATES, default=HASHED)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Import {self.import_key} of {self.input_path} {self.state}'
+
+    class Meta:
+        unique_together = (('import_key', 'position'),)
+        ordering = ['import_key', 'position']
@@ -0,0 +1,71 @@
+import json
+
+from django.db import models
+
+
+class LedgerMirror(models.Model):
+    """Local copy of a ledger asset, indexed on the fields used by search filters"""
+    key = models.CharField(primary_key=True, max_length=64)
+    data = models.TextField()  # serialized json, as returned by the chaincode
+    last_modified = models.DateTimeField(auto_now=True)
+
+    def to_ledger(self):
+        return json.loads(self.data)
+
+    def __str__(self):
+        return f'{self.__class__.__name__} with key {self.key}'
+
+    class Meta:
+        abstract = True
+        ordering = ['key']
+
+
+class AlgoMirror(LedgerMirror):
+    name = models.CharField(max_length=1024, db_index=True)
+    owner = models.CharField(max_length=1024, db_index=True)
+
+
+class ObjectiveMirror(LedgerMirror):
+    name = models.CharField(max_length=1024, db_index=True)
+    owner = models.CharField(max_length=1024, db_index=True)
+    metrics_name = models.CharField(max_length=1024, db_index=True)
+    test_data_manager_key = models.CharField(max_length=64, db_index=True, null=True)
+
+
+class DataManagerMirror(LedgerMirror):
+    name = models.CharField(max_length=1024, db_index=True)
+    owner = models.CharField(max_length=1024, db_index=True)
+    type = models.CharField(max_length=1024, db_index=True)
+    objective_key = models.CharField(max_length=64, db_index=True, null=True)
+
+
+class TupleMirror(LedgerMirror):
+    creator = models.CharField(max_length=1024, db_index=True)
+    worker = models.CharField(max_length=1024, db_index=True, null=True)
+    status = models.CharField(max_length=64, db_index=True)
+    tag = models.CharField(max_length=1024, db_index=True, blank=True)
+    algo_key = models.CharField(max_length=64, db_index=True, null=True)
+    objective_key = models.CharField(max_length=64, db_index=True, null=True)
+    data_manager_key = models.CharField(max_length=64, db_index=True, null=True)
+
+    class Meta(LedgerMirror.Meta):
+        abstract = True
+
+
+class TraintupleMirror(TupleMirror):
+    out_model_hash = models.CharField(max_length=64, db_index=True, null=True)
+    compute_plan_id = models.CharField(max_length=64, db_index=True, blank=True)
+    rank = models.IntegerField(null=True)
+
+
+class TesttupleMirror(TupleMirror):
+    traintuple_key = models.CharField(max_length=64, db_index=True, null=True)
+    certified = models.BooleanField(default=False)
+
+
+class ModelMirror(LedgerMirror):
+    """A traintuple and its certified testtuple, keyed by traintuple key"""
+    out_model_hash = models.CharField(max_length=64, db_index=True, null=True)
+    algo_key = models.CharField(max_length=64, db_index=True, null=True)
+    objective_key = models.CharField(max_length=64, db_index=True, null=True)
+    data_manager_key = models.CharField(max_length=64, db_index=True, null=True)
@@ -0,0 +1,24 @@
+import json
+
+from django.db import models
+
+
+class LedgerReport(models.Model):
+    """Tuple status update pending submission to the ledger"""
+    tuple_key = models.CharField(primary_key=True, max_length=64)
+    tuple_type = models.CharField(max_length=64)
+    fcn = models.CharField(max_length=64)
+    args = models.TextField()  # serialized json
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(db_index=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def get_args(self):
+        return json.loads(self.args)
+
+    def __str__(self):
+        return f'{self.fcn} report of {self.tuple_type} {self.tuple_key}'
+
+    class Meta:
+        ordering = ['next_attempt_at']
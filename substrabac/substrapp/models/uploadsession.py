@@ -0,0 +1,20 @@
+import uuid
+
+from django.db import models
+
+
+def get_session_id():
+    return uuid.uuid4().hex
+
+
+class UploadSession(models.Model):
+    """Resumable upload of a data sample archive, received by chunks in MEDIA_ROOT/upload_sessions/<id>"""
+    id = models.CharField(primary_key=True, max_length=32, default=get_session_id, editable=False)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField(null=True, blank=True)  # unknown until the last chunk
+    offset = models.BigIntegerField(default=0)  # bytes received
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Upload {self.id} of {self.filename} at {self.offset}'
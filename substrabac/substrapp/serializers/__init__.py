@@ -5,10 +5,11 @@ from .objective import ObjectiveSerializer
 from .model import ModelSerializer
 from .datamanager import DataManagerSerializer
 from .algo import AlgoSerializer
+from .uploadsession import UploadSessionSerializer
 from .ledger import *
 
 __all__ = ['DataSampleSerializer', 'ObjectiveSerializer', 'ModelSerializer',
-           'DataManagerSerializer', 'AlgoSerializer',
+           'DataManagerSerializer', 'AlgoSerializer', 'UploadSessionSerializer',
            'LedgerObjectiveSerializer', 'LedgerModelSerializer',
            'LedgerDataSampleSerializer', 'LedgerAlgoSerializer',
            'LedgerTrainTupleSerializer', 'LedgerTestTupleSerializer',
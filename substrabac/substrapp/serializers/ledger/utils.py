@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.core.exceptions import ObjectDoesNotExist
 from substrapp.ledger_utils import invoke_ledger, LedgerError, LedgerTimeout
+from substrapp.ledger_mirror import mirror_registered_asset
 
 
 class PermissionsSerializer(serializers.Serializer):
@@ -26,6 +27,9 @@ def create_ledger_asset(model, fcn, args, pkhash, sync=False):
             instance.delete()
         raise
 
+    # searchable without waiting for the synchronization of the ledger mirror
+    mirror_registered_asset(fcn, pkhash)
+
     if instance:
         instance.validated = True
         instance.save()
@@ -0,0 +1,11 @@
+from rest_framework import serializers
+
+from substrapp.models import UploadSession
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'filename', 'size', 'offset')
+        read_only_fields = ('id', 'offset')
@@ -3,9 +3,13 @@ from shutil import rmtree
 
 from django.conf import settings
 
+from substrapp.dirhash import remove_manifest
+
 
 def data_sample_post_delete(sender, instance, **kwargs):
     # remove created folder
     directory = path.join(getattr(settings, 'MEDIA_ROOT'), 'datasamples', instance.pk)
     if path.exists(directory):
         rmtree(directory)
+
+    remove_manifest(instance.pk)
@@ -1,18 +1,15 @@
-from os import path, link
+from os import path
 from os.path import normpath
-import shutil
 from django.conf import settings
 
+from substrapp.storage import store_data_sample_directory
+
 
 def data_sample_pre_save(sender, instance, **kwargs):
     directory = path.join(getattr(settings, 'MEDIA_ROOT'), 'datasamples/{0}'.format(instance.pk))
+    if not isinstance(instance.path, str) or normpath(instance.path) == directory:  # not a path or already stored
+        return
 
-    # try to make an hard link to keep a free copy of the data
+    # store a copy (reflink, hardlink or copy) of the data
     # if not possible, keep the real path location
-    try:
-        shutil.copytree(normpath(instance.path), directory, copy_function=link)
-    except Exception:
-        shutil.rmtree(directory, ignore_errors=True)
-    else:
-        # override path for getting our hardlink
-        instance.path = directory
+    instance.path, instance.storage = store_data_sample_directory(normpath(instance.path), instance.pk)
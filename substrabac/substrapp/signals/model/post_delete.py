@@ -2,6 +2,8 @@ import shutil
 from os import path
 from django.conf import settings
 
+from substrapp.dirhash import remove_manifest
+
 
 def model_post_delete(sender, instance, **kwargs):
     instance.file.delete(False)
@@ -9,3 +11,5 @@ def model_post_delete(sender, instance, **kwargs):
     directory = path.join(getattr(settings, 'MEDIA_ROOT'), 'models/{0}'.format(instance.pk))
     if path.exists(directory):
         shutil.rmtree(directory)
+
+    remove_manifest(instance.pk)
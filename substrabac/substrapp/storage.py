@@ -0,0 +1,143 @@
+import logging
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+from django.conf import settings
+
+from substrapp.dirhash import list_files, get_unchanged_file_hashes, register_copied_dirhash
+from substrapp.utils import reflink
+
+logger = logging.getLogger(__name__)
+
+# Storage of the data samples in MEDIA_ROOT/datasamples/<pkhash>.
+#
+# Data samples registered from a path are stored with the first strategy of the DATA_SAMPLE_STORAGE
+# STRATEGIES setting supported between the registered path and MEDIA_ROOT:
+# - reflink: copy-on-write clone of the files (btrfs, xfs), independent from the registered path
+# - link: hardlinks of the files, which share their content and inode with the registered path
+# - copy: copy of the files
+# The strategy is probed once per pair of devices and recorded on the data sample, the files of large
+# directories are stored by a pool of threads. The manifest of the stored directory is registered with the
+# hashes of the registered path, so that the stored files are not hashed again when verified.
+# If no strategy is supported, the data sample references the registered path.
+
+REFLINK = 'reflink'
+LINK = 'link'
+COPY = 'copy'
+REFERENCE = 'reference'
+
+
+def _reflink(src, dst):
+    reflink(src, dst)
+    shutil.copystat(src, dst)
+
+
+STORE_FUNCTIONS = {
+    REFLINK: _reflink,
+    LINK: os.link,
+    COPY: shutil.copy2,
+}
+
+# strategy by source device, destination device and configured strategies
+_strategies = {}
+_strategies_lock = threading.Lock()
+
+
+def _get_storage_setting(name, default):
+    return getattr(settings, 'DATA_SAMPLE_STORAGE', {}).get(name, default)
+
+
+def get_strategies():
+    return _get_storage_setting('STRATEGIES', [REFLINK, LINK, COPY])
+
+
+def probe_strategy(src_file, dst_directory):
+    """Return the first strategy storing `src_file` in `dst_directory`, REFERENCE if none is supported."""
+    os.makedirs(dst_directory, exist_ok=True)
+    key = (os.stat(src_file).st_dev, os.stat(dst_directory).st_dev, tuple(get_strategies()))
+
+    with _strategies_lock:
+        if key in _strategies:
+            return _strategies[key]
+
+        strategy = REFERENCE
+        probe_path = path.join(dst_directory, f'.probe-{uuid.uuid4().hex}')
+        for candidate in get_strategies():
+            try:
+                STORE_FUNCTIONS[candidate](src_file, probe_path)
+            except OSError as e:
+                logger.debug(f'Cannot store data samples with {candidate}: {e}')
+                continue
+            else:
+                strategy = candidate
+                break
+            finally:
+                if path.exists(probe_path):
+                    os.remove(probe_path)
+
+        logger.info(f'Data samples of device {key[0]} stored in device {key[1]} with {strategy}')
+        _strategies[key] = strategy
+        return strategy
+
+
+def store_directory(src_directory, dst_directory, strategy=None):
+    """Store the files of a directory in `dst_directory`, return the strategy used."""
+    relative_paths = list_files(src_directory)
+    if strategy is None:
+        if not relative_paths:
+            strategy = COPY
+        else:
+            strategy = probe_strategy(path.join(src_directory, relative_paths[0]), path.dirname(dst_directory))
+    if strategy == REFERENCE:
+        return strategy
+
+    for root, _, _ in os.walk(src_directory, followlinks=False):
+        os.makedirs(path.join(dst_directory, path.relpath(root, src_directory)), exist_ok=True)
+
+    store_file = STORE_FUNCTIONS[strategy]
+
+    def store(relative_path):
+        store_file(path.join(src_directory, relative_path), path.join(dst_directory, relative_path))
+
+    workers = _get_storage_setting('WORKERS', None) or os.cpu_count()
+    if workers > 1 and len(relative_paths) >= _get_storage_setting('PARALLEL_MIN_FILES', 64):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(store, relative_paths))
+    else:
+        for relative_path in relative_paths:
+            store(relative_path)
+
+    return strategy
+
+
+def store_data_sample_directory(src_directory, pkhash):
+    """Store a data sample directory in MEDIA_ROOT/datasamples/<pkhash>, return its path and the strategy used."""
+    dst_directory = path.join(getattr(settings, 'MEDIA_ROOT'), 'datasamples', pkhash)
+    # left by a previous registration
+    shutil.rmtree(dst_directory, ignore_errors=True)
+
+    dir_hash = pkhash
+    try:
+        # before being stored, as hardlinks update the change time of the files
+        file_hashes = get_unchanged_file_hashes(src_directory, pkhash)
+        strategy = store_directory(src_directory, dst_directory)
+        if strategy != REFERENCE:
+            dir_hash = register_copied_dirhash(src_directory, dst_directory, pkhash, file_hashes)
+    except Exception as e:
+        logger.warning(f'Cannot store data sample {pkhash}: {e}')
+        strategy = REFERENCE
+
+    if strategy == REFERENCE:
+        shutil.rmtree(dst_directory, ignore_errors=True)
+        return src_directory, strategy
+
+    if dir_hash != pkhash:
+        shutil.rmtree(dst_directory, ignore_errors=True)
+        raise Exception(f'Data sample {src_directory} has been modified while stored: '
+                        f'its hash is {dir_hash}, expected {pkhash}')
+
+    return dst_directory, strategy
@@ -0,0 +1,127 @@
+import contextlib
+import fcntl
+import logging
+import os
+import time
+from os import path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed cache of the remote assets (algos, metrics and models) used by tasks.
+#
+# Assets are stored in MEDIA_ROOT/asset_cache/<hash[:2]>/<hash>, keyed by the ledger hash which has
+# been verified when the asset was downloaded. Files are downloaded in a temporary file then renamed,
+# so that a cached file is always complete. A lock file per asset ensures that concurrent worker
+# processes requiring the same asset download it only once.
+
+CACHE_DIRECTORY = 'asset_cache'
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3  # bytes
+# assets used more recently are not evicted, as tasks may not have copied them yet
+EVICTION_MIN_AGE = 600  # seconds
+
+
+def is_asset_cache_enabled():
+    return getattr(settings, 'TASK', {}).get('CACHE_ASSETS', False)
+
+
+def get_asset_cache_directory():
+    return path.join(getattr(settings, 'MEDIA_ROOT'), CACHE_DIRECTORY)
+
+
+def get_asset_cache_max_size():
+    return getattr(settings, 'TASK', {}).get('ASSETS_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE)
+
+
+def get_cached_asset_path(content_hash):
+    return path.join(get_asset_cache_directory(), content_hash[:2], content_hash)
+
+
+@contextlib.contextmanager
+def file_lock(lock_path, blocking=True):
+    """Exclusive lock between processes, yield False if non blocking and already locked"""
+    with open(lock_path, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _touch(asset_path):
+    # mark as recently used for the LRU eviction
+    try:
+        os.utime(asset_path)
+    except FileNotFoundError:  # not cached or evicted
+        return False
+    return True
+
+
+def is_cached_asset_path(asset_path):
+    return path.dirname(path.dirname(asset_path)) == get_asset_cache_directory()
+
+
+def get_cached_asset(content_hash, download):
+    """Return the path of an asset in the cache, calling `download` on cache miss.
+
+    `download(dst_path)` must atomically create `dst_path` once the hash of the asset has been verified.
+    """
+    asset_path = get_cached_asset_path(content_hash)
+
+    if _touch(asset_path):
+        logger.debug(f'Asset {content_hash} found in cache')
+        return asset_path
+
+    os.makedirs(path.dirname(asset_path), exist_ok=True)
+
+    with file_lock(f'{asset_path}.lock'):
+        # another process may have downloaded the asset while waiting for the lock
+        if _touch(asset_path):
+            logger.debug(f'Asset {content_hash} found in cache')
+            return asset_path
+
+        download(asset_path)
+
+    evict_cached_assets(get_asset_cache_max_size())
+
+    return asset_path
+
+
+def evict_cached_assets(max_size):
+    """Remove least recently used assets until the cache size is below `max_size`"""
+    directory = get_asset_cache_directory()
+
+    with file_lock(path.join(directory, '.eviction.lock'), blocking=False) as locked:
+        if not locked:  # another process is already evicting
+            return
+
+        assets = []
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                if filename.startswith('.') or filename.endswith('.lock'):
+                    continue
+                try:
+                    stat = os.stat(path.join(root, filename))
+                except FileNotFoundError:
+                    continue
+                assets.append((stat.st_mtime, stat.st_size, path.join(root, filename)))
+
+        size = sum(asset_size for _, asset_size, _ in assets)
+        min_mtime = time.time() - EVICTION_MIN_AGE
+
+        for mtime, asset_size, asset_path in sorted(assets):
+            if size <= max_size or mtime > min_mtime:
+                break
+
+            with file_lock(f'{asset_path}.lock'):
+                try:
+                    os.remove(asset_path)
+                except FileNotFoundError:
+                    continue
+            size -= asset_size
+            logger.info(f'Asset {path.basename(asset_path)} evicted from cache')
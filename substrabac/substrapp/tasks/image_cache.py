@@ -0,0 +1,113 @@
+import logging
+import os
+import time
+from os import path
+
+import docker
+from django.conf import settings
+
+from substrapp.tasks.asset_cache import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Cache of the docker images of algos and metrics.
+#
+# Images are tagged with the content hash of the algo or metrics archive they are built from, so that
+# they are built once and reused by every tuple. Concurrent builds of a same image are deduplicated with
+# a lock file per image in MEDIA_ROOT/image_cache, whose modification time also records the last use of
+# the image for the LRU garbage collection.
+
+CACHE_DIRECTORY = 'image_cache'
+IMAGE_LABEL = 'substra_image_cache'
+DEFAULT_MAX_SIZE = 20 * 1024 ** 3  # bytes
+# images used more recently are not removed, as containers may not have been started yet
+EVICTION_MIN_AGE = 600  # seconds
+
+
+def is_image_cache_enabled():
+    return getattr(settings, 'TASK', {}).get('CACHE_DOCKER_IMAGES', False)
+
+
+def get_image_cache_max_size():
+    return getattr(settings, 'TASK', {}).get('DOCKER_IMAGES_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE)
+
+
+def get_image_name(kind, content_hash):
+    return f'substra/{kind}_{content_hash}'
+
+
+def _get_marker_path(image_name):
+    directory = path.join(getattr(settings, 'MEDIA_ROOT'), CACHE_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+    return path.join(directory, image_name.replace('/', '_'))
+
+
+def _image_exists(client, image_name):
+    try:
+        client.images.get(image_name)
+    except docker.errors.ImageNotFound:
+        return False
+    return True
+
+
+def get_cached_image(client, image_name, build):
+    """Return `image_name`, calling `build()` if it does not exist yet."""
+    marker_path = _get_marker_path(image_name)
+
+    with file_lock(marker_path):
+        # the image may have been built by another task while waiting for the lock
+        if _image_exists(client, image_name):
+            logger.debug(f'Image {image_name} found in cache')
+        else:
+            build()
+        # mark as recently used
+        os.utime(marker_path)
+
+    evict_cached_images(client, get_image_cache_max_size())
+
+    return image_name
+
+
+def evict_cached_images(client, max_size):
+    """Remove least recently used images until the size of the cached images is below `max_size`.
+
+    Layers shared between images are counted for each image.
+    """
+    directory = path.join(getattr(settings, 'MEDIA_ROOT'), CACHE_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+
+    with file_lock(path.join(directory, '.eviction.lock'), blocking=False) as locked:
+        if not locked:  # another process is already evicting
+            return
+
+        try:
+            images = client.images.list(filters={'label': IMAGE_LABEL})
+        except docker.errors.APIError as e:
+            logger.error(f'Cannot list cached images: {e}')
+            return
+
+        cached_images = []
+        for image in images:
+            for image_name in image.tags:
+                image_name = image_name.split(':')[0]
+                try:
+                    last_use = os.stat(_get_marker_path(image_name)).st_mtime
+                except FileNotFoundError:
+                    last_use = 0
+                cached_images.append((last_use, image.attrs['Size'], image_name))
+
+        size = sum(image_size for _, image_size, _ in cached_images)
+        min_last_use = time.time() - EVICTION_MIN_AGE
+
+        for last_use, image_size, image_name in sorted(cached_images):
+            if size <= max_size or last_use > min_last_use:
+                break
+
+            with file_lock(_get_marker_path(image_name)):
+                try:
+                    client.images.remove(image_name)
+                except docker.errors.APIError as e:  # used by a container
+                    logger.warning(f'Cannot remove image {image_name}: {e}')
+                    continue
+            size -= image_size
+            logger.info(f'Image {image_name} evicted from cache')
@@ -0,0 +1,256 @@
+import hashlib
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from os import path
+
+import docker
+from django.conf import settings
+
+from substrapp.tasks.image_cache import get_cached_image, IMAGE_LABEL
+from substrapp.tasks.utils import build_image, get_container_args, container_format_log, DOCKER_LABEL, POOL_LABEL
+
+logger = logging.getLogger(__name__)
+
+# Pool of warm metrics containers.
+#
+# Instead of running a container for each evaluation, a container is kept running for each metrics image,
+# opener and data samples, so with the same volumes and sandboxing as an evaluation container, and the
+# evaluations are executed in it. The predictions of an evaluation are copied to a jobs directory mounted
+# in the container and linked to /sandbox/pred, so that the metrics run as in a new container.
+# Containers are removed once idle for TASK METRICS_POOL_IDLE_TIMEOUT seconds.
+# Idle containers hold no resources: each evaluation allocates its resources to a job lease and applies
+# them to the container before being executed, the lease is released once the evaluation is done.
+# Containers are labeled with the pid and hostname of their worker, so that a worker only removes the
+# orphan containers of its own processes when the docker socket is shared.
+#
+# Images must be tagged by content hash (TASK CACHE_DOCKER_IMAGES), so that they are not removed while used.
+
+POOL_DIRECTORY = 'metrics_pool'
+POOL_HOST_LABEL = 'substra_metrics_pool_host'
+JOBS_PATH = '/sandbox/jobs'
+DEFAULT_IDLE_TIMEOUT = 600  # seconds
+SWEEP_PERIOD = 60  # seconds
+CPU_PERIOD = 100000  # microseconds
+
+# warm containers of the process by pool key
+_pool = {}
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def is_metrics_pool_enabled():
+    return getattr(settings, 'TASK', {}).get('METRICS_CONTAINER_POOL', False)
+
+
+def get_idle_timeout():
+    return getattr(settings, 'TASK', {}).get('METRICS_POOL_IDLE_TIMEOUT', DEFAULT_IDLE_TIMEOUT)
+
+
+def get_pool_key(image_name, opener_file, data_path):
+    sha256_hash = hashlib.sha256(image_name.encode())
+    with open(opener_file, 'rb') as f:
+        sha256_hash.update(f.read())
+    for data_sample_key in sorted(os.listdir(data_path)):
+        sha256_hash.update(data_sample_key.encode())
+    return sha256_hash.hexdigest()
+
+
+def _get_pool(client):
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            # containers of the parent process are not managed by forked processes
+            _pool = {}
+            _pool_pid = os.getpid()
+            threading.Thread(target=_sweep_forever, daemon=True).start()
+            remove_orphan_containers(client)
+        return _pool
+
+
+def _get_resources_args(allocation):
+    # the cpu time is limited by a quota rather than nano cpus, as it can be updated
+    nano_cpus = allocation['nano_cpus']
+    return {
+        'cpuset_cpus': allocation['cpu_set'],
+        'cpu_period': CPU_PERIOD,
+        'cpu_quota': nano_cpus * CPU_PERIOD // 10 ** 9 if nano_cpus else -1,
+        'mem_limit': f'{allocation["memory_mb"]}M',
+        'memswap_limit': f'{2 * allocation["memory_mb"]}M',
+    }
+
+
+def _start_container(client, entry, image_name, opener_file, data_path, allocation):
+    directory = entry['directory']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(path.join(directory, 'data'))
+    os.makedirs(path.join(directory, 'jobs'))
+    shutil.copyfile(opener_file, path.join(directory, 'opener.py'))
+
+    volumes = {
+        path.join(directory, 'data'): {'bind': '/sandbox/data', 'mode': 'ro'},
+        path.join(directory, 'jobs'): {'bind': JOBS_PATH, 'mode': 'rw'},
+        path.join(directory, 'opener.py'): {'bind': '/sandbox/opener/__init__.py', 'mode': 'ro'},
+    }
+    for data_sample_key in os.listdir(data_path):
+        real_path = os.path.realpath(path.join(data_path, data_sample_key))
+        os.symlink(real_path, path.join(directory, 'data', data_sample_key))
+        volumes[real_path] = {'bind': real_path, 'mode': 'ro'}
+
+    # the metrics are executed with the command of the image, the container only waits for them
+    image_config = client.images.get(image_name).attrs['Config']
+    entry['command'] = (image_config.get('Entrypoint') or []) + (image_config.get('Cmd') or [])
+    entry['workdir'] = image_config.get('WorkingDir') or None
+
+    container_name = f'metrics_pool_{entry["key"][:16]}_{uuid.uuid4().hex[:8]}'
+    task_args = get_container_args(image_name, container_name, allocation, volumes,
+                                   ['-c', 'while true; do sleep 3600; done'], capture_logs=False)
+    task_args.pop('nano_cpus', None)
+    task_args.update(_get_resources_args(allocation))
+    task_args.update({
+        'entrypoint': 'sh',
+        'detach': True,
+        'labels': {DOCKER_LABEL: '', POOL_LABEL: str(os.getpid()), POOL_HOST_LABEL: socket.gethostname()},
+    })
+    client.containers.run(**task_args)
+
+    entry.update({
+        'container_name': container_name,
+        'client': client,
+        # gpus are set in the environment of the container, which cannot be updated
+        'gpu_set': allocation['gpu_set'],
+    })
+    logger.info(f'Metrics container {container_name} started')
+
+
+def _stop_container(entry):
+    container_name = entry['container_name']
+    if container_name is None:
+        return
+
+    try:
+        entry['client'].containers.get(container_name).remove(force=True)
+    except docker.errors.NotFound:
+        pass
+    finally:
+        entry['container_name'] = None
+        shutil.rmtree(entry['directory'], ignore_errors=True)
+    logger.info(f'Metrics container {container_name} removed')
+
+
+def _is_running(entry):
+    if entry['container_name'] is None:
+        return False
+    try:
+        return entry['client'].containers.get(entry['container_name']).status == 'running'
+    except docker.errors.NotFound:
+        return False
+
+
+def _run_job(entry, allocation, pred_path, capture_logs):
+    job_id = uuid.uuid4().hex
+    job_directory = path.join(entry['directory'], 'jobs', job_id)
+    shutil.copytree(pred_path, job_directory)
+
+    try:
+        container = entry['client'].containers.get(entry['container_name'])
+        container.update(**_get_resources_args(allocation))
+        script = f'rm -rf /sandbox/pred && ln -s {JOBS_PATH}/{job_id} /sandbox/pred && exec "$@"'
+        exit_code, output = container.exec_run(['sh', '-c', script, 'sh'] + entry['command'],
+                                               workdir=entry['workdir'])
+        if capture_logs:
+            container_format_log(entry['container_name'], output)
+        if exit_code != 0:
+            raise Exception(f'Metrics evaluation failed in container {entry["container_name"]} '
+                            f'with exit code {exit_code}')
+
+        # results written in the predictions directory
+        for filename in os.listdir(job_directory):
+            job_file = path.join(job_directory, filename)
+            if path.isfile(job_file):
+                shutil.copyfile(job_file, path.join(pred_path, filename))
+    finally:
+        shutil.rmtree(job_directory, ignore_errors=True)
+
+
+def evaluate_in_pool(client, resources_manager, dockerfile_path, image_name, opener_file, data_path, pred_path,
+                     resources=None, capture_logs=True):
+    """Run the metrics in a warm container, return False if it is busy with another evaluation."""
+    get_cached_image(client, image_name,
+                     lambda: build_image(client, dockerfile_path, image_name, labels={IMAGE_LABEL: ''}))
+
+    key = get_pool_key(image_name, opener_file, data_path)
+    pool = _get_pool(client)
+
+    with _pool_lock:
+        entry = pool.setdefault(key, {
+            'key': key,
+            'directory': path.join(getattr(settings, 'MEDIA_ROOT'), POOL_DIRECTORY, key[:16], str(os.getpid())),
+            'container_name': None,
+            'lock': threading.Lock(),
+            'used_at': time.time(),
+        })
+
+    if not entry['lock'].acquire(blocking=False):
+        return False
+
+    job_name = f'metrics_pool_job_{uuid.uuid4().hex}'
+    try:
+        allocation = resources_manager.allocate(job_name, resources)
+        try:
+            if not _is_running(entry) or entry['gpu_set'] != allocation['gpu_set']:
+                if entry['container_name'] is not None:
+                    _stop_container(entry)
+                _start_container(client, entry, image_name, opener_file, data_path, allocation)
+
+            _run_job(entry, allocation, pred_path, capture_logs)
+        finally:
+            resources_manager.release(job_name)
+    finally:
+        entry['used_at'] = time.time()
+        entry['lock'].release()
+
+    return True
+
+
+def sweep_idle_containers():
+    """Remove the warm containers idle for longer than the idle timeout."""
+    with _pool_lock:
+        entries = list(_pool.items())
+
+    for key, entry in entries:
+        if entry['container_name'] is None or time.time() - entry['used_at'] < get_idle_timeout():
+            continue
+        if not entry['lock'].acquire(blocking=False):
+            continue
+        try:
+            _stop_container(entry)
+        except Exception as e:
+            logger.error(f'Cannot remove metrics container {entry["container_name"]}: {e}')
+        finally:
+            entry['lock'].release()
+
+
+def remove_orphan_containers(client):
+    """Remove the warm containers of the processes of this worker which no longer exist."""
+    # pids of other hosts (or containers) are not in the pid namespace of this worker
+    labels = [POOL_LABEL, f'{POOL_HOST_LABEL}={socket.gethostname()}']
+    for container in client.containers.list(all=True, filters={'label': labels}):
+        try:
+            os.kill(int(container.labels[POOL_LABEL]), 0)
+        except ProcessLookupError:
+            container.remove(force=True)
+            logger.info(f'Orphan metrics container {container.name} removed')
+        except (ValueError, PermissionError):
+            continue
+
+
+def _sweep_forever():
+    while True:
+        time.sleep(SWEEP_PERIOD)
+        sweep_idle_containers()
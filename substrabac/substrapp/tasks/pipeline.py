@@ -0,0 +1,92 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Pipelined execution of the tuples of a worker.
+#
+# A tuple goes through the stages fetch (inputs) → build (images) → train (algo container) → persist (model)
+# → evaluate (metrics container) → report (ledger). The number of tuples in each stage is bounded by the
+# TASK PIPELINE setting and shared between the concurrent tasks of the worker through the manager process.
+# With a celery concurrency above the train limit, the inputs of the next tuples are fetched and their
+# images built while a tuple is training, instead of each task holding a worker slot for its whole lifetime.
+
+STAGES = ('fetch', 'build', 'train', 'persist', 'evaluate', 'report')
+# holders of a stage are checked periodically in case their process has been killed
+STALE_CHECK_PERIOD = 30  # seconds
+
+
+def get_stage_limit(stage):
+    """Return the number of tuples allowed in a stage, defaults to the celery concurrency (not bounded)."""
+    if stage not in STAGES:
+        raise Exception(f'Unknown pipeline stage: {stage}')
+    limit = getattr(settings, 'TASK', {}).get('PIPELINE', {}).get(stage)
+    return int(limit or getattr(settings, 'CELERY_WORKER_CONCURRENCY', 1))
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class PipelineManager():
+    """Bound the number of tuples in each stage of the pipeline.
+
+    Shared between tasks through a manager process: `acquire` waits on a condition notified by `release`.
+    """
+
+    __condition = threading.Condition()
+    __holders = {stage: {} for stage in STAGES}  # stage: {token: pid}
+
+    @classmethod
+    def acquire(cls, stage, limit, pid):
+        """Enter a stage once less than `limit` tuples are in it, return the token to release it."""
+        token = uuid.uuid4().hex
+
+        with cls.__condition:
+            holders = cls.__holders[stage]
+            while len(holders) >= limit:
+                if not cls.__condition.wait(STALE_CHECK_PERIOD):
+                    for stale_token, holder_pid in list(holders.items()):
+                        if not _is_alive(holder_pid):
+                            logger.warning(f'Drop {stage} stage of killed process {holder_pid}')
+                            del holders[stale_token]
+            holders[token] = pid
+
+        return token
+
+    @classmethod
+    def release(cls, stage, token):
+        with cls.__condition:
+            cls.__holders[stage].pop(token, None)
+            cls.__condition.notify_all()
+
+    @classmethod
+    def occupancy(cls):
+        with cls.__condition:
+            return {stage: len(holders) for stage, holders in cls.__holders.items()}
+
+
+@contextlib.contextmanager
+def pipeline_stage(pipeline_manager, stage, tuple_key):
+    """Run the body of the context in a stage of the pipeline, waiting for a free slot if needed."""
+    start = time.time()
+    token = pipeline_manager.acquire(stage, get_stage_limit(stage), os.getpid())
+    started = time.time()
+
+    try:
+        yield
+    finally:
+        pipeline_manager.release(stage, token)
+        logger.info(f'[{tuple_key}] stage {stage}: waited {started - start:.2f}s, ran {time.time() - started:.2f}s')
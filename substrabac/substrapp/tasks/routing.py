@@ -0,0 +1,50 @@
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Affinity of compute plans to workers.
+#
+# The tuples of a compute plan share a local docker volume, they must run on the same worker. The worker of
+# a compute plan is registered in the ComputePlanWorker table when its first tuple starts, the next tuples
+# of the plan are routed to its queue, and the registration is removed once the last rank of the plan ends.
+
+
+def get_default_worker_queue():
+    return f"{settings.LEDGER['name']}.worker"
+
+
+def get_worker_queue(subtuple):
+    """Return the queue of the worker which must run a tuple."""
+    from substrapp.models import ComputePlanWorker
+
+    compute_plan_id = subtuple.get('computePlanID')
+    if not compute_plan_id:
+        return get_default_worker_queue()
+
+    try:
+        return ComputePlanWorker.objects.get(pk=compute_plan_id).worker
+    except ComputePlanWorker.DoesNotExist:  # first tuple of the compute plan
+        return get_default_worker_queue()
+
+
+def register_compute_plan_worker(compute_plan_id, worker):
+    """Register the worker of a compute plan if it has none yet, return the registered worker."""
+    from substrapp.models import ComputePlanWorker
+
+    compute_plan_worker, _ = ComputePlanWorker.objects.get_or_create(
+        compute_plan_id=compute_plan_id,
+        defaults={'worker': worker})
+
+    if compute_plan_worker.worker != worker:
+        logger.warning(f'Tuple of compute plan {compute_plan_id} running on {worker} '
+                       f'instead of {compute_plan_worker.worker}')
+
+    return compute_plan_worker.worker
+
+
+def release_compute_plan_worker(compute_plan_id):
+    from substrapp.models import ComputePlanWorker
+
+    ComputePlanWorker.objects.filter(pk=compute_plan_id).delete()
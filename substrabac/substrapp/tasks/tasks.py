@@ -2,25 +2,37 @@ from __future__ import absolute_import, unicode_literals
 
 import os
 import shutil
-import tempfile
 from os import path
 import json
 from multiprocessing.managers import BaseManager
+from concurrent.futures import wait
 import logging
+import threading
+import time
 
 import docker
-from checksumdir import dirhash
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.files import File
+from django.db import connections
 from django.conf import settings
 from rest_framework.reverse import reverse
 from celery.result import AsyncResult
 from celery.exceptions import Ignore
 
 from substrabac.celery import app
-from substrapp.utils import get_hash, get_owner, create_directory, uncompress_content
-from substrapp.ledger_utils import (log_start_tuple, log_success_tuple, log_fail_tuple,
-                                    query_tuples, LedgerError, LedgerStatusError, get_object_from_ledger)
-from substrapp.tasks.utils import ResourcesManager, compute_docker, get_asset_content
+from substrapp.utils import get_hash, get_owner, create_directory, uncompress_path, reflink_or_copy
+from substrapp.dirhash import verify_dirhash, verify_file_hash, compute_file_hash, link_hashed_file
+from substrapp.ledger_utils import (log_start_tuple, log_success_tuple, log_fail_tuple, get_success_tuple_invoke,
+                                    get_fail_tuple_invoke, query_tuples, LedgerError, LedgerStatusError,
+                                    get_object_from_ledger)
+from substrapp.tasks.utils import (ResourcesManager, compute_docker, prepare_image, get_asset_path,
+                                   release_asset_path, get_prefetch_executor)
+from substrapp.tasks.image_cache import is_image_cache_enabled, get_image_name
+from substrapp.tasks.metrics_pool import is_metrics_pool_enabled, evaluate_in_pool
+from substrapp.tasks.pipeline import PipelineManager, pipeline_stage
+from substrapp.tasks.routing import get_worker_queue, register_compute_plan_worker, release_compute_plan_worker
+from substrapp.tasks.workspace import (is_workspace_asset, register_workspace_asset, is_workspace_path,
+                                       get_workspace_model_path, add_workspace_model, remove_workspace)
 from substrapp.tasks.exception_handler import compute_error_code
 
 
@@ -38,102 +50,115 @@ def get_objective(subtuple):
     if objective is None or not objective.metrics:
         objective_metadata = get_object_from_ledger(objective_hash, 'queryObjective')
 
-        content = get_asset_content(
+        metrics_path = get_asset_path(
             objective_metadata['metrics']['storageAddress'],
             objective_metadata['owner'],
             objective_metadata['metrics']['hash'],
         )
 
-        objective, _ = Objective.objects.update_or_create(pkhash=objective_hash, validated=True)
+        try:
+            objective, _ = Objective.objects.update_or_create(pkhash=objective_hash, validated=True)
 
-        tmp_file = tempfile.TemporaryFile()
-        tmp_file.write(content)
-        objective.metrics.save('metrics.archive', tmp_file)
+            with open(metrics_path, 'rb') as f:
+                objective.metrics.save('metrics.archive', File(f))
+        finally:
+            release_asset_path(metrics_path)
 
-    return objective.metrics.read()
+    return objective.metrics.path
 
 
 def get_algo(subtuple):
     algo_hash = subtuple['algo']['hash']
     algo_metadata = get_object_from_ledger(algo_hash, 'queryAlgo')
 
-    algo_content = get_asset_content(
+    algo_path = get_asset_path(
         algo_metadata['content']['storageAddress'],
         algo_metadata['owner'],
         algo_metadata['content']['hash'],
     )
 
-    return algo_content
+    return algo_path
+
+
+def get_local_model(model):
+    """Return the path of a model trained on this node, or None."""
+    from substrapp.models import Model
+
+    local_model = Model.objects.filter(pk=model['hash']).first()
+    if local_model is None or not path.exists(local_model.file.path):
+        return None
+
+    # hashed when saved, the file is not read again if unchanged
+    if not verify_file_hash(local_model.file.path, model['hash'], model['traintupleKey']):
+        logging.warning(f'Local model {model["hash"]} is corrupted, fetching it')
+        return None
+
+    return local_model.file.path
 
 
 def _get_model(model):
+    # models trained on this node are neither queried nor downloaded
+    if model.get('hash'):
+        model_path = get_local_model(model)
+        if model_path is not None:
+            return model_path
+
     traintuple_hash = model['traintupleKey']
     traintuple_metadata = get_object_from_ledger(traintuple_hash, 'queryTraintuple')
 
-    model_content = get_asset_content(
+    model_path = get_asset_path(
         traintuple_metadata['outModel']['storageAddress'],
         traintuple_metadata['dataset']['worker'],
         traintuple_metadata['outModel']['hash'],
         salt=traintuple_hash,
     )
 
-    return model_content
+    return model_path
 
 
-def get_model(subtuple):
-    model = subtuple.get('model')
-    if model:
-        return _get_model(model)
-    else:
-        return None
-
-
-def get_models(subtuple):
-    input_models = subtuple.get('inModels')
-    if input_models:
-        return [_get_model(item) for item in input_models]
-    else:
-        return []
-
-
-def _put_model(subtuple, subtuple_directory, model_content, model_hash, traintuple_key):
-    if not model_content:
-        raise Exception('Model content should not be empty')
+def _put_model(subtuple, subtuple_directory, model_path, model_hash, traintuple_key):
+    if not model_path:
+        raise Exception('Model path should not be empty')
 
     from substrapp.models import Model
 
-    # store a model in local subtuple directory from input model content
+    # store a model in local subtuple directory from input model file
     model_dst_path = path.join(subtuple_directory, f'model/{traintuple_key}')
+
+    if is_workspace_path(model_path):
+        # trained by a previous rank of the compute plan, verified when saved
+        link_hashed_file(model_path, model_dst_path, model_hash)
+        return
+
     model = None
     try:
         model = Model.objects.get(pk=model_hash)
-    except ObjectDoesNotExist:  # write it to local disk
-        with open(model_dst_path, 'wb') as f:
-            f.write(model_content)
+    except ObjectDoesNotExist:  # copy it to local disk
+        reflink_or_copy(model_path, model_dst_path)
     else:
-        # verify that local db model file is not corrupted
-        if get_hash(model.file.path, traintuple_key) != model_hash:
+        # verify that local db model file is not corrupted, hashes of unchanged files are reused
+        if not verify_file_hash(model.file.path, model_hash, traintuple_key):
             raise Exception('Model Hash in Subtuple is not the same as in local db')
 
         if not os.path.exists(model_dst_path):
-            os.link(model.file.path, model_dst_path)
+            link_hashed_file(model.file.path, model_dst_path, model_hash)
         else:
             # verify that local subtuple model file is not corrupted
-            if get_hash(model_dst_path, traintuple_key) != model_hash:
+            if not verify_file_hash(model_dst_path, model_hash, traintuple_key):
                 raise Exception('Model Hash in Subtuple is not the same as in local medias')
 
 
-def put_model(subtuple, subtuple_directory, model_content):
-    return _put_model(subtuple, subtuple_directory, model_content, subtuple['model']['hash'],
+def put_model(subtuple, subtuple_directory, model_path):
+    return _put_model(subtuple, subtuple_directory, model_path, subtuple['model']['hash'],
                       subtuple['model']['traintupleKey'])
 
 
-def put_models(subtuple, subtuple_directory, models_content):
-    if not models_content:
-        raise Exception('Models content should not be empty')
+def put_models(subtuple, subtuple_directory, models_path):
+    if not models_path:
+        raise Exception('Models path should not be empty')
 
-    for model_content, model in zip(models_content, subtuple['inModels']):
-        _put_model(model, subtuple_directory, model_content, model['hash'], model['traintupleKey'])
+    for model_path, model in zip(models_path, subtuple['inModels']):
+        _put_model(model, subtuple_directory, model_path, model['hash'], model['traintupleKey'])
 
 
 def put_opener(subtuple, subtuple_directory):
@@ -142,9 +167,13 @@ def put_opener(subtuple, subtuple_directory):
 
     datamanager = DataManager.objects.get(pk=data_opener_hash)
 
-    # verify that local db opener file is not corrupted
-    if get_hash(datamanager.data_opener.path) != data_opener_hash:
-        raise Exception('DataOpener Hash in Subtuple is not the same as in local db')
+    # verify that local db opener file is not corrupted, once per compute plan
+    compute_plan_id = subtuple.get('computePlanID')
+    if not (compute_plan_id and is_workspace_asset(compute_plan_id, 'opener', data_opener_hash)):
+        if get_hash(datamanager.data_opener.path) != data_opener_hash:
+            raise Exception('DataOpener Hash in Subtuple is not the same as in local db')
+        if compute_plan_id:
+            register_workspace_asset(compute_plan_id, 'opener', data_opener_hash)
 
     opener_dst_path = path.join(subtuple_directory, 'opener/opener.py')
     if not os.path.exists(opener_dst_path):
@@ -158,11 +187,17 @@ def put_opener(subtuple, subtuple_directory):
 def put_data_sample(subtuple, subtuple_directory):
     from substrapp.models import DataSample
 
+    compute_plan_id = subtuple.get('computePlanID')
+
     for data_sample_key in subtuple['dataset']['keys']:
         data_sample = DataSample.objects.get(pk=data_sample_key)
-        data_sample_hash = dirhash(data_sample.path, 'sha256')
-        if data_sample_hash != data_sample_key:
-            raise Exception('Data Sample Hash in Subtuple is not the same as in local db')
+
+        # data samples are verified once per compute plan
+        if not (compute_plan_id and is_workspace_asset(compute_plan_id, 'data_sample', data_sample_key)):
+            if not verify_dirhash(data_sample.path, data_sample_key):
+                raise Exception('Data Sample Hash in Subtuple is not the same as in local db')
+            if compute_plan_id:
+                register_workspace_asset(compute_plan_id, 'data_sample', data_sample_key)
 
         # create a symlink on the folder containing data
         subtuple_data_directory = path.join(subtuple_directory, 'data', data_sample_key)
@@ -173,13 +208,13 @@ def put_data_sample(subtuple, subtuple_directory):
             raise Exception('Failed to create sym link for subtuple data sample')
 
 
-def put_metric(subtuple_directory, metrics_content):
+def put_metric(subtuple_directory, metrics_path):
     metrics_dst_path = path.join(subtuple_directory, 'metrics/')
-    uncompress_content(metrics_content, metrics_dst_path)
+    uncompress_path(metrics_path, metrics_dst_path)
 
 
-def put_algo(subtuple_directory, algo_content):
-    uncompress_content(algo_content, subtuple_directory)
+def put_algo(subtuple_directory, algo_path):
+    uncompress_path(algo_path, subtuple_directory)
 
 
 def build_subtuple_folders(subtuple):
@@ -200,11 +235,13 @@ def remove_subtuple_materials(subtuple_directory):
         logging.exception(e)
 
 
-# Instatiate Ressource Manager in BaseManager to share it between celery concurrent tasks
+# Instatiate Ressource Manager and Pipeline Manager in BaseManager to share them between celery concurrent tasks
 BaseManager.register('ResourcesManager', ResourcesManager)
+BaseManager.register('PipelineManager', PipelineManager)
 manager = BaseManager()
 manager.start()
 resources_manager = manager.ResourcesManager()
+pipeline_manager = manager.PipelineManager()
 
 
 @app.task(ignore_result=True)
@@ -217,6 +254,50 @@ def prepare_testing_task():
     prepare_task('testtuple')
 
 
+@app.task(ignore_result=True)
+def sync_ledger_mirror_task():
+    from substrapp.ledger_mirror import sync_ledger_mirror
+    sync_ledger_mirror()
+
+
+@app.task(ignore_result=True)
+def report_ledger_task():
+    from substrapp.ledger_reporter import flush_reports
+    flush_reports()
+
+
+@app.task(ignore_result=True)
+def reconcile_data_samples_task():
+    from substrapp.bulk_import import reconcile_data_samples
+    reconcile_data_samples()
+
+
+def report_tuple(tuple_type, tuple_key, res=None, error_code=None):
+    """Log the success (`res`) or failure (`error_code`) of a tuple in the ledger.
+
+    If the ledger reporter is enabled, the status is submitted asynchronously by the reporter task.
+    """
+    from substrapp.ledger_reporter import is_ledger_reporter_enabled, enqueue_report
+
+    if not is_ledger_reporter_enabled():
+        if error_code is not None:
+            return log_fail_tuple(tuple_type, tuple_key, error_code)
+        return log_success_tuple(tuple_type, tuple_key, res)
+
+    if error_code is not None:
+        fcn, args = get_fail_tuple_invoke(tuple_type, tuple_key, error_code)
+    else:
+        fcn, args = get_success_tuple_invoke(tuple_type, tuple_key, res)
+    enqueue_report(tuple_type, tuple_key, fcn, args)
+
+    try:
+        # not consumed by the workers, which would wait for the ledger commits
+        report_ledger_task.apply_async(queue='scheduler')
+    except Exception as e:
+        # the report is persisted, it will be submitted by the periodic reporter task
+        logging.warning(f'Cannot queue reporter task: {e}')
+
+
 def prepare_task(tuple_type):
     data_owner = get_owner()
     worker_queue = f"{settings.LEDGER['name']}.worker"
@@ -237,19 +318,9 @@ def prepare_task(tuple_type):
 
 @app.task(ignore_result=False)
 def prepare_tuple(subtuple, tuple_type):
-    from django_celery_results.models import TaskResult
-
-    compute_plan_id = None
-    worker_queue = f"{settings.LEDGER['name']}.worker"
-
-    if 'computePlanID' in subtuple and subtuple['computePlanID']:
-        compute_plan_id = subtuple['computePlanID']
-        flresults = TaskResult.objects.filter(
-            task_name='substrapp.tasks.tasks.compute_task',
-            result__icontains=f'"computePlanID": "{compute_plan_id}"')
-
-        if flresults and flresults.count() > 0:
-            worker_queue = json.loads(flresults.first().as_dict()['result'])['worker']
+    compute_plan_id = subtuple.get('computePlanID') or None
+    # tuples of a compute plan run on the worker of its first tuple
+    worker_queue = get_worker_queue(subtuple)
 
     try:
         log_start_tuple(tuple_type, subtuple['key'])
@@ -267,7 +338,7 @@ def prepare_tuple(subtuple, tuple_type):
     except Exception as e:
         error_code = compute_error_code(e)
         logging.error(error_code, exc_info=True)
-        log_fail_tuple(tuple_type, subtuple['key'], error_code)
+        report_tuple(tuple_type, subtuple['key'], error_code=error_code)
 
 
 @app.task(bind=True, ignore_result=False)
@@ -283,49 +354,114 @@ def compute_task(self, tuple_type, subtuple, compute_plan_id):
     result = {'worker': worker, 'queue': queue, 'computePlanID': compute_plan_id}
 
     try:
-        prepare_materials(subtuple, tuple_type)
+        if compute_plan_id is not None:
+            register_compute_plan_worker(compute_plan_id, worker)
+
+        with pipeline_stage(pipeline_manager, 'fetch', subtuple['key']):
+            prepare_materials(subtuple, tuple_type)
         res = do_task(subtuple, tuple_type)
     except Exception as e:
         error_code = compute_error_code(e)
         logging.error(error_code, exc_info=True)
 
         try:
-            log_fail_tuple(tuple_type, subtuple['key'], error_code)
+            with pipeline_stage(pipeline_manager, 'report', subtuple['key']):
+                report_tuple(tuple_type, subtuple['key'], error_code=error_code)
         except LedgerError as e:
             logging.exception(e)
 
         return result
 
     try:
-        log_success_tuple(tuple_type, subtuple['key'], res)
+        with pipeline_stage(pipeline_manager, 'report', subtuple['key']):
+            report_tuple(tuple_type, subtuple['key'], res=res)
     except LedgerError as e:
         logging.exception(e)
 
     return result
 
 
-def prepare_materials(subtuple, tuple_type):
+def _timed_fetch(description, fetch, *args):
+    start = time.time()
+    try:
+        return fetch(*args)
+    finally:
+        logging.info(f'Fetch {description}: {time.time() - start:.2f}s')
+        if threading.current_thread() is not threading.main_thread():
+            # fetching threads outlive the task, do not keep their db connections open
+            connections.close_all()
 
-    # get subtuple components
-    metrics_content = get_objective(subtuple)
-    algo_content = get_algo(subtuple)
+
+def prefetch_materials(subtuple, tuple_type):
+    """Fetch the metrics, algo and input models of a subtuple concurrently.
+
+    Return the metrics path, the algo path and the models path (to release once used).
+    """
     if tuple_type == 'testtuple':
-        model_content = get_model(subtuple)
+        input_models = [subtuple['model']] if subtuple.get('model') else []
     elif tuple_type == 'traintuple':
-        models_content = get_models(subtuple)
+        input_models = subtuple.get('inModels') or []
     else:
         raise NotImplementedError()
 
-    # create subtuple
-    subtuple_directory = build_subtuple_folders(subtuple)
-    put_opener(subtuple, subtuple_directory)
-    put_data_sample(subtuple, subtuple_directory)
-    put_metric(subtuple_directory, metrics_content)
-    put_algo(subtuple_directory, algo_content)
-    if tuple_type == 'testtuple':
-        put_model(subtuple, subtuple_directory, model_content)
-    elif tuple_type == 'traintuple' and models_content:
-        put_models(subtuple, subtuple_directory, models_content)
+    # models trained by previous ranks of a compute plan are kept in its workspace
+    compute_plan_id = subtuple.get('computePlanID')
+    workspace_models = {
+        model['traintupleKey']: get_workspace_model_path(compute_plan_id, model['traintupleKey'])
+        for model in input_models
+    } if compute_plan_id else {}
+
+    executor = get_prefetch_executor()
+    futures = [executor.submit(_timed_fetch, 'algo', get_algo, subtuple)]
+    futures.extend(executor.submit(_timed_fetch, f'model {model["traintupleKey"]}', _get_model, model)
+                   for model in input_models if not workspace_models.get(model['traintupleKey']))
+
+    # the objective is stored in the local db, fetch it from the task thread
+    try:
+        metrics_path = _timed_fetch('metrics', get_objective, subtuple)
+    except Exception as e:
+        error = e
+    else:
+        error = None
+
+    wait(futures)
+
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if error is not None or errors:
+        for future in futures:
+            if future.exception() is None:
+                release_asset_path(future.result())
+        raise error or errors[0]
+
+    algo_path = futures[0].result()
+    fetched_models_path = iter(future.result() for future in futures[1:])
+    models_path = [workspace_models.get(model['traintupleKey']) or next(fetched_models_path)
+                   for model in input_models]
+
+    return metrics_path, algo_path, models_path
+
+
+def prepare_materials(subtuple, tuple_type):
+
+    # get subtuple components
+    metrics_path, algo_path, models_path = prefetch_materials(subtuple, tuple_type)
+
+    try:
+        # create subtuple
+        subtuple_directory = build_subtuple_folders(subtuple)
+        put_opener(subtuple, subtuple_directory)
+        put_data_sample(subtuple, subtuple_directory)
+        put_metric(subtuple_directory, metrics_path)
+        put_algo(subtuple_directory, algo_path)
+        if tuple_type == 'testtuple':
+            put_model(subtuple, subtuple_directory, models_path[0] if models_path else None)
+        elif tuple_type == 'traintuple' and models_path:
+            put_models(subtuple, subtuple_directory, models_path)
+    finally:
+        # downloaded assets are released once copied in the subtuple directory
+        for asset_path in [algo_path] + models_path:
+            if not is_workspace_path(asset_path):
+                release_asset_path(asset_path)
 
     logging.info(f'Prepare materials for {tuple_type} task: success ')
 
@@ -359,6 +495,9 @@ def do_task(subtuple, tuple_type):
             rank = -1  # -1 means last subtuple in the compute plan
         raise e
     finally:
+        if rank == -1:
+            release_compute_plan_worker(compute_plan_id)
+
         # Clean subtuple materials
         if settings.TASK['CLEAN_EXECUTION_ENVIRONMENT']:
             remove_subtuple_materials(subtuple_directory)
@@ -369,10 +508,47 @@ def do_task(subtuple, tuple_type):
                     local_volume.remove(force=True)
                 except Exception:
                     logging.error(f'Cannot remove local volume {volume_id}', exc_info=True)
+                remove_workspace(client, compute_plan_id, remove_images=not is_image_cache_enabled())
 
     return result
 
 
+def get_resources(directory, kind):
+    """Return the resources requested by a container, `kind` being train, predict or metrics.
+
+    They default to the TASK RESOURCES setting and can be declared by algos and metrics
+    with a resources.json file in their archive, such as {"cpu": 0.5, "memory_mb": 1024, "gpu": 0}.
+    """
+    resources = dict(settings.TASK.get('RESOURCES', {}).get(kind) or {})
+
+    resources_path = path.join(directory, 'resources.json')
+    if path.exists(resources_path):
+        with open(resources_path) as f:
+            try:
+                resources.update(json.load(f))
+            except (ValueError, TypeError):
+                raise Exception(f'Invalid resources file: {resources_path}')
+
+    return resources
+
+
+def prepare_tuple_image(client, compute_plan_id, dockerfile_path, image_name, remove_image, cache_image):
+    """Build the image of a tuple, once for all the ranks of a compute plan."""
+    if compute_plan_id is None or cache_image:
+        prepare_image(client, dockerfile_path, image_name, remove_image, cache_image)
+        return
+
+    if is_workspace_asset(compute_plan_id, 'image', image_name):
+        try:
+            client.images.get(image_name)
+            return
+        except docker.errors.ImageNotFound:
+            logging.warning(f'Image {image_name} of compute plan {compute_plan_id} removed, building it again')
+
+    prepare_image(client, dockerfile_path, image_name, remove_image, cache_image)
+    register_workspace_asset(compute_plan_id, 'image', image_name)
+
+
 def _do_task(client, subtuple_directory, tuple_type, subtuple, compute_plan_id, rank, org_name):
 
     model_path = path.join(subtuple_directory, 'model')
@@ -381,10 +557,18 @@ def _do_task(client, subtuple_directory, tuple_type, subtuple, compute_plan_id,
     opener_file = path.join(subtuple_directory, 'opener/opener.py')
     algo_path = path.join(subtuple_directory)
 
-    algo_docker = f'substra/algo_{subtuple["key"][0:8]}'.lower()  # tag must be lowercase for docker
+    cache_image = is_image_cache_enabled()
+    if cache_image:
+        # images are shared by the tuples of a same algo
+        algo_docker = get_image_name('algo', subtuple['algo']['hash'])
+    elif compute_plan_id is not None:
+        # images are kept in the workspace of the compute plan for its next ranks
+        algo_docker = f'substra/algo_{subtuple["algo"]["hash"][0:16]}_{compute_plan_id[0:16]}'.lower()
+    else:
+        algo_docker = f'substra/algo_{subtuple["key"][0:8]}'.lower()  # tag must be lowercase for docker
     algo_docker_name = f'{tuple_type}_{subtuple["key"][0:8]}'
 
-    remove_image = not((compute_plan_id is not None and rank != -1) or settings.TASK['CACHE_DOCKER_IMAGES'])
+    remove_image = not(compute_plan_id is not None and rank != -1)
 
     # VOLUMES
 
@@ -430,40 +614,80 @@ def _do_task(client, subtuple_directory, tuple_type, subtuple, compute_plan_id,
         inmodels = subtuple['model']["traintupleKey"]
         command = f'{command} {inmodels}'
 
-    compute_docker(
-        client=client,
-        resources_manager=resources_manager,
-        dockerfile_path=algo_path,
-        image_name=algo_docker,
-        container_name=algo_docker_name,
-        volumes={**volumes, **model_volume, **symlinks_volume},
-        command=command,
-        remove_image=remove_image,
-        remove_container=settings.TASK['CLEAN_EXECUTION_ENVIRONMENT'],
-        capture_logs=settings.TASK['CAPTURE_LOGS']
-    )
+    metrics_path = f'{subtuple_directory}/metrics'
+    if cache_image:
+        eval_docker = get_image_name('metrics', subtuple['objective']['metrics']['hash'])
+    elif compute_plan_id is not None:
+        eval_docker = (f'substra/metrics_{subtuple["objective"]["metrics"]["hash"][0:16]}_'
+                       f'{compute_plan_id[0:16]}'.lower())
+    else:
+        eval_docker = f'substra/metrics_{subtuple["key"][0:8]}'.lower()  # tag must be lowercase for docker
+    eval_docker_name = f'{tuple_type}_{subtuple["key"][0:8]}_eval'
+
+    # images are built before waiting for a training slot, the metrics image is only built beforehand
+    # when it is kept, otherwise it would not be removed if the training fails
+    prebuild_metrics = cache_image or compute_plan_id is not None
+    with pipeline_stage(pipeline_manager, 'build', subtuple['key']):
+        prepare_tuple_image(client, compute_plan_id, algo_path, algo_docker, remove_image, cache_image)
+        if prebuild_metrics:
+            prepare_tuple_image(client, compute_plan_id, metrics_path, eval_docker, remove_image, cache_image)
+
+    with pipeline_stage(pipeline_manager, 'train', subtuple['key']):
+        compute_docker(
+            client=client,
+            resources_manager=resources_manager,
+            dockerfile_path=algo_path,
+            image_name=algo_docker,
+            container_name=algo_docker_name,
+            volumes={**volumes, **model_volume, **symlinks_volume},
+            command=command,
+            remove_image=remove_image,
+            remove_container=settings.TASK['CLEAN_EXECUTION_ENVIRONMENT'],
+            capture_logs=settings.TASK['CAPTURE_LOGS'],
+            resources=get_resources(algo_path, command.split(' ')[0]),
+            cache_image=cache_image,
+            build=False,
+        )
 
     # save model in database
     if tuple_type == 'traintuple':
-        end_model_file, end_model_file_hash = save_model(subtuple_directory, subtuple['key'])
-
-    # evaluation
-    metrics_path = f'{subtuple_directory}/metrics'
-    eval_docker = f'substra/metrics_{subtuple["key"][0:8]}'.lower()  # tag must be lowercase for docker
-    eval_docker_name = f'{tuple_type}_{subtuple["key"][0:8]}_eval'
+        with pipeline_stage(pipeline_manager, 'persist', subtuple['key']):
+            end_model_file, end_model_file_hash = save_model(subtuple_directory, subtuple['key'])
+            if compute_plan_id is not None:
+                # the next ranks use the model without fetching it
+                add_workspace_model(compute_plan_id, subtuple['key'], path.join(model_path, 'model'),
+                                    end_model_file_hash)
+
+    with pipeline_stage(pipeline_manager, 'evaluate', subtuple['key']):
+        # metrics may be evaluated in a warm container of the objective
+        evaluated = cache_image and is_metrics_pool_enabled() and evaluate_in_pool(
+            client=client,
+            resources_manager=resources_manager,
+            dockerfile_path=metrics_path,
+            image_name=eval_docker,
+            opener_file=opener_file,
+            data_path=data_path,
+            pred_path=pred_path,
+            resources=get_resources(metrics_path, 'metrics'),
+            capture_logs=settings.TASK['CAPTURE_LOGS'],
+        )
 
-    compute_docker(
-        client=client,
-        resources_manager=resources_manager,
-        dockerfile_path=metrics_path,
-        image_name=eval_docker,
-        container_name=eval_docker_name,
-        volumes={**volumes, **symlinks_volume},
-        command=None,
-        remove_image=remove_image,
-        remove_container=settings.TASK['CLEAN_EXECUTION_ENVIRONMENT'],
-        capture_logs=settings.TASK['CAPTURE_LOGS']
-    )
+        if not evaluated:
+            compute_docker(
+                client=client,
+                resources_manager=resources_manager,
+                dockerfile_path=metrics_path,
+                image_name=eval_docker,
+                container_name=eval_docker_name,
+                volumes={**volumes, **symlinks_volume},
+                command=None,
+                remove_image=remove_image,
+                remove_container=settings.TASK['CLEAN_EXECUTION_ENVIRONMENT'],
+                capture_logs=settings.TASK['CAPTURE_LOGS'],
+                resources=get_resources(metrics_path, 'metrics'),
+                cache_image=cache_image,
+                build=not prebuild_metrics,
+            )
 
     # load performance
     with open(path.join(pred_path, 'perf.json'), 'r') as perf_file:
@@ -481,12 +705,19 @@ def _do_task(client, subtuple_directory, tuple_type, subtuple, compute_plan_id,
 
 def save_model(subtuple_directory, subtuple_key):
     from substrapp.models import Model
+    from substrapp.models.model import upload_to
     end_model_path = path.join(subtuple_directory, 'model/model')
-    end_model_file_hash = get_hash(end_model_path, subtuple_key)
+    end_model_file_hash = compute_file_hash(end_model_path, subtuple_key)
     instance = Model.objects.create(pkhash=end_model_file_hash, validated=True)
 
-    with open(end_model_path, 'rb') as f:
-        instance.file.save('model', f)
+    # the model file is linked in the storage instead of being copied
+    instance.file.name = upload_to(instance, 'model')
+    os.makedirs(path.dirname(instance.file.path), exist_ok=True)
+    try:
+        link_hashed_file(end_model_path, instance.file.path, end_model_file_hash)
+    except OSError:  # not on the same file system
+        reflink_or_copy(end_model_path, instance.file.path)
+    instance.save()
     current_site = getattr(settings, "DEFAULT_DOMAIN")
     end_model_file = f'{current_site}{reverse("substrapp:model-file", args=[end_model_file_hash])}'
 
@@ -1,17 +1,29 @@
+import glob
+import math
 import os
 import docker
 import GPUtil as gputil
 import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import logging
 
 from subprocess import check_output
 from django.conf import settings
 from requests.auth import HTTPBasicAuth
-from substrapp.utils import get_owner, get_remote_file_content, NodeError
+from substrapp.utils import get_owner, get_remote_file_path, NodeError
+from substrapp.tasks.asset_cache import is_asset_cache_enabled, is_cached_asset_path, get_cached_asset
+from substrapp.tasks.image_cache import get_cached_image, IMAGE_LABEL
+from substrapp.tasks.pipeline import get_stage_limit
 
 
 DOCKER_LABEL = 'substra_task'
+# warm metrics containers, whose resources are leased by each job executed in them
+POOL_LABEL = 'substra_metrics_pool'
+# time for a leased container to be created before its lease may be dropped on reconciliation
+LEASE_GRACE_PERIOD = 60  # seconds
 
 logger = logging.getLogger(__name__)
 
@@ -31,79 +43,161 @@ def authenticate_worker(node_id):
     return auth
 
 
-def get_asset_content(url, node_id, content_hash, salt=None):
-    return get_remote_file_content(url, authenticate_worker(node_id), content_hash, salt=salt)
+# Threads fetching tuple inputs, kept between tasks of a worker process to reuse their ledger clients
+_prefetch_executor = None
+_prefetch_executor_pid = None
+_prefetch_executor_lock = threading.Lock()
 
+# limit the number of concurrent downloads from a same node
+_node_semaphores = {}
+_node_semaphores_lock = threading.Lock()
 
-def get_cpu_sets(cpu_count, concurrency):
-    cpu_step = max(1, cpu_count // concurrency)
-    cpu_sets = []
 
-    for cpu_start in range(0, cpu_count, cpu_step):
-        cpu_set = f'{cpu_start}-{min(cpu_start + cpu_step - 1, cpu_count - 1)}'
-        cpu_sets.append(cpu_set)
-        if len(cpu_sets) == concurrency:
-            break
+def get_prefetch_executor():
+    global _prefetch_executor, _prefetch_executor_pid
 
-    return cpu_sets
+    with _prefetch_executor_lock:
+        if _prefetch_executor is None or _prefetch_executor_pid != os.getpid():
+            max_workers = getattr(settings, 'TASK', {}).get('PREFETCH_WORKERS', 8)
+            _prefetch_executor = ThreadPoolExecutor(max_workers=max_workers)
+            _prefetch_executor_pid = os.getpid()
 
+    return _prefetch_executor
 
-def get_gpu_sets(gpu_list, concurrency):
 
-    if gpu_list:
-        gpu_count = len(gpu_list)
-        gpu_step = max(1, gpu_count // concurrency)
-        gpu_sets = []
-
-        for igpu_start in range(0, gpu_count, gpu_step):
-            gpu_sets.append(','.join(gpu_list[igpu_start: igpu_start + gpu_step]))
-    else:
-        gpu_sets = None
-
-    return gpu_sets
-
-
-def expand_cpu_set(cpu_set):
-    cpu_set_start, cpu_set_stop = map(int, cpu_set.split('-'))
-    return set(range(cpu_set_start, cpu_set_stop + 1))
-
-
-def reduce_cpu_set(expanded_cpu_set):
-    return f'{min(expanded_cpu_set)}-{max(expanded_cpu_set)}'
+def get_node_semaphore(node_id):
+    key = (os.getpid(), node_id)
 
+    with _node_semaphores_lock:
+        semaphore = _node_semaphores.get(key)
+        if semaphore is None:
+            concurrency = getattr(settings, 'TASK', {}).get('PREFETCH_CONCURRENCY_PER_NODE', 4)
+            semaphore = threading.BoundedSemaphore(concurrency)
+            _node_semaphores[key] = semaphore
 
-def expand_gpu_set(gpu_set):
-    return set(gpu_set.split(','))
+    return semaphore
 
 
-def reduce_gpu_set(expanded_gpu_set):
-    return ','.join(sorted(expanded_gpu_set))
+def get_download_directory():
+    return os.path.join(getattr(settings, 'MEDIA_ROOT'), 'asset_downloads')
 
 
-def filter_resources_sets(used_resources_sets, resources_sets, expand_resources_set, reduce_resources_set):
-    """ Filter resources_set used with resources_sets defined.
-        It will block a resources_set from resources_sets if an used_resources_set in a subset of a resources_set"""
+def get_asset_path(url, node_id, content_hash, salt=None):
+    """Download a remote asset and return the path of its verified content.
 
-    resources_expand = [expand_resources_set(resources_set) for resources_set in resources_sets]
-    used_resources_expand = [expand_resources_set(used_resources_set) for used_resources_set in used_resources_sets]
+    The path must be released with `release_asset_path` once the asset has been used.
+    """
+    def download(dst_path):
+        auth = authenticate_worker(node_id)
+        with get_node_semaphore(node_id):
+            return get_remote_file_path(url, auth, content_hash, dst_path, salt=salt)
 
-    real_used_resources_sets = []
+    if is_asset_cache_enabled():
+        return get_cached_asset(content_hash, download)
 
-    for resources_set in resources_expand:
-        for used_resources_set in used_resources_expand:
-            if resources_set.intersection(used_resources_set):
-                real_used_resources_sets.append(reduce_resources_set(resources_set))
-                break
+    download_directory = get_download_directory()
+    os.makedirs(download_directory, exist_ok=True)
+    return download(os.path.join(download_directory, f'{content_hash}-{uuid.uuid4().hex}'))
 
-    return list(set(resources_sets).difference(set(real_used_resources_sets)))
 
+def release_asset_path(asset_path):
+    # cached assets are kept for next tasks, local assets (models of this node) are not downloads
+    if is_cached_asset_path(asset_path) or os.path.dirname(asset_path) != get_download_directory():
+        return
 
-def filter_cpu_sets(used_cpu_sets, cpu_sets):
-    return filter_resources_sets(used_cpu_sets, cpu_sets, expand_cpu_set, reduce_cpu_set)
+    try:
+        os.remove(asset_path)
+    except FileNotFoundError:
+        pass
+
+
+def parse_cpu_set(cpu_set):
+    """Return the cpus of a docker cpu set, such as '0-3,8'."""
+    cpus = set()
+    for cpu_range in filter(None, cpu_set.split(',')):
+        start, _, stop = cpu_range.partition('-')
+        cpus.update(range(int(start), int(stop or start) + 1))
+    return cpus
+
+
+def format_cpu_set(cpus):
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(f'{start}-{stop}' if start != stop else f'{start}' for start, stop in ranges)
+
+
+def get_numa_nodes(cpu_count):
+    """Return the cpus of each NUMA node of the host."""
+    nodes = []
+    for node_path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist')):
+        try:
+            with open(node_path) as f:
+                cpus = parse_cpu_set(f.read().strip())
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [set(range(cpu_count))]
+
+
+def _contiguous_cpus(cpus, count):
+    # the `count` cpus with the smallest span
+    cpus = sorted(cpus)
+    start = min(range(len(cpus) - count + 1), key=lambda i: cpus[i + count - 1] - cpus[i])
+    return set(cpus[start:start + count])
+
+
+def place_cpus(cpu, cpu_usage, numa_nodes):
+    """Return the cpus to allocate to a container requesting `cpu` cpus, None if they are not available.
+
+    A fractional request smaller than one cpu shares the most used cpu it fits in. Other requests get
+    whole unused cpus, from the NUMA node with the least unused cpus which can hold them all, or else
+    spread over the least number of nodes.
+    """
+    if cpu < 1:
+        available = [c for c, usage in cpu_usage.items() if 1 - usage >= cpu - 1e-9]
+        if not available:
+            return None
+        return {max(available, key=lambda c: (cpu_usage[c], -c))}
+
+    count = math.ceil(cpu - 1e-9)
+    free_cpus = [node & {c for c, usage in cpu_usage.items() if usage == 0} for node in numa_nodes]
+
+    fitting_nodes = [node_cpus for node_cpus in free_cpus if len(node_cpus) >= count]
+    if fitting_nodes:
+        return _contiguous_cpus(min(fitting_nodes, key=len), count)
+
+    if sum(len(node_cpus) for node_cpus in free_cpus) < count:
+        return None
+
+    cpus = set()
+    for node_cpus in sorted(free_cpus, key=len, reverse=True):
+        cpus |= _contiguous_cpus(node_cpus, min(count - len(cpus), len(node_cpus)))
+        if len(cpus) == count:
+            return cpus
+
+
+def validate_resources(resources):
+    """Check a resources request: {'cpu': float, 'memory_mb': int, 'gpu': int}."""
+    unknown = set(resources) - {'cpu', 'memory_mb', 'gpu'}
+    if unknown:
+        raise Exception(f'Unknown resources: {", ".join(sorted(unknown))}')
 
+    try:
+        if 'cpu' in resources and not float(resources['cpu']) > 0:
+            raise ValueError()
+        if 'memory_mb' in resources and not int(resources['memory_mb']) > 0:
+            raise ValueError()
+        if 'gpu' in resources and not int(resources['gpu']) >= 0:
+            raise ValueError()
+    except (TypeError, ValueError):
+        raise Exception(f'Invalid resources: {resources}')
 
-def filter_gpu_sets(used_gpu_sets, gpu_sets):
-    return filter_resources_sets(used_gpu_sets, gpu_sets, expand_gpu_set, reduce_gpu_set)
+    return resources
 
 
 def container_format_log(container_name, container_logs):
@@ -112,17 +206,12 @@ def container_format_log(container_name, container_logs):
         logger.info(log)
 
 
-def compute_docker(client, resources_manager, dockerfile_path, image_name, container_name, volumes, command,
-                   remove_image=True, remove_container=True, capture_logs=True):
-
-    dockerfile_fullpath = os.path.join(dockerfile_path, 'Dockerfile')
-    if not os.path.exists(dockerfile_fullpath):
-        raise Exception(f'Dockerfile does not exist : {dockerfile_fullpath}')
-
+def build_image(client, dockerfile_path, image_name, remove_image=True, labels=None):
     try:
         client.images.build(path=dockerfile_path,
                             tag=image_name,
-                            rm=remove_image)
+                            rm=remove_image,
+                            labels=labels)
     except docker.errors.BuildError as e:
         # catch build errors and print them for easier debugging of failed build
         lines = [line['stream'].strip() for line in e.build_log if 'stream' in line]
@@ -131,15 +220,14 @@ def compute_docker(client, resources_manager, dockerfile_path, image_name, conta
         logger.error(f'BuildError: {error}')
         raise
 
-    # Limit ressources
-    memory_limit_mb = f'{resources_manager.memory_limit_mb()}M'
-    cpu_set, gpu_set = resources_manager.get_cpu_gpu_sets()    # blocking call
 
+def get_container_args(image_name, container_name, allocation, volumes, command, capture_logs=True):
+    """Return the arguments to run a sandboxed task container with the resources of `allocation`."""
     task_args = {
         'image': image_name,
         'name': container_name,
-        'cpuset_cpus': cpu_set,
-        'mem_limit': memory_limit_mb,
+        'cpuset_cpus': allocation['cpu_set'],
+        'mem_limit': f'{allocation["memory_mb"]}M',
         'command': command,
         'volumes': volumes,
         'shm_size': '8G',
@@ -155,97 +243,228 @@ def compute_docker(client, resources_manager, dockerfile_path, image_name, conta
         'cap_drop': ['ALL']
     }
 
-    if gpu_set is not None:
-        task_args['environment'] = {'NVIDIA_VISIBLE_DEVICES': gpu_set}
+    if allocation['nano_cpus'] is not None:
+        task_args['nano_cpus'] = allocation['nano_cpus']
+
+    if allocation['gpu_set'] is not None:
+        task_args['environment'] = {'NVIDIA_VISIBLE_DEVICES': allocation['gpu_set']}
         task_args['runtime'] = 'nvidia'
 
+    return task_args
+
+
+def prepare_image(client, dockerfile_path, image_name, remove_image=True, cache_image=False):
+    dockerfile_fullpath = os.path.join(dockerfile_path, 'Dockerfile')
+    if not os.path.exists(dockerfile_fullpath):
+        raise Exception(f'Dockerfile does not exist : {dockerfile_fullpath}')
+
+    if cache_image:
+        # images tagged by content hash, built once and kept
+        get_cached_image(client, image_name,
+                         lambda: build_image(client, dockerfile_path, image_name, labels={IMAGE_LABEL: ''}))
+    else:
+        build_image(client, dockerfile_path, image_name, remove_image=remove_image)
+
+
+def compute_docker(client, resources_manager, dockerfile_path, image_name, container_name, volumes, command,
+                   remove_image=True, remove_container=True, capture_logs=True, resources=None, cache_image=False,
+                   build=True):
+
+    # the image may have been prepared beforehand
+    if build:
+        prepare_image(client, dockerfile_path, image_name, remove_image, cache_image)
+
+    if cache_image:
+        remove_image = False
+
+    # Limit ressources
+    allocation = resources_manager.allocate(container_name, resources)    # blocking call
+
     try:
-        client.containers.run(**task_args)
-    finally:
-        # we need to remove the containers to be able to remove the local
-        # volume in case of compute plan
-        container = client.containers.get(container_name)
-        if capture_logs:
-            container_format_log(
-                container_name,
-                container.logs()
-            )
-        container.remove()
+        task_args = get_container_args(image_name, container_name, allocation, volumes, command, capture_logs)
 
-        # Remove images
-        if remove_image:
-            client.images.remove(image_name, force=True)
+        try:
+            client.containers.run(**task_args)
+        finally:
+            # we need to remove the containers to be able to remove the local
+            # volume in case of compute plan
+            container = client.containers.get(container_name)
+            if capture_logs:
+                container_format_log(
+                    container_name,
+                    container.logs()
+                )
+            container.remove()
+
+            # Remove images
+            if remove_image:
+                client.images.remove(image_name, force=True)
+    finally:
+        resources_manager.release(container_name)
 
 
 class ResourcesManager():
+    """Allocate the cpus, memory and gpus requested by task containers.
 
-    __concurrency = int(getattr(settings, 'CELERY_WORKER_CONCURRENCY'))
+    Containers are packed on the host cpus (see `place_cpus`) and memory. Allocations are kept in memory,
+    shared between tasks through a manager process: an allocation waits on a condition notified by
+    releases, and docker is only listed periodically to reconcile with the containers started elsewhere.
+    """
+
+    # containers run in the train stage of the pipeline
+    __concurrency = get_stage_limit('train')
     __cpu_count = os.cpu_count()
-    __cpu_sets = get_cpu_sets(__cpu_count, __concurrency)
+    __numa_nodes = get_numa_nodes(__cpu_count)
 
     # Set CUDA_DEVICE_ORDER so the IDs assigned by CUDA match those from nvidia-smi
     os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
     __gpu_list = [str(gpu.id) for gpu in gputil.getGPUs()]
-    __gpu_sets = get_gpu_sets(__gpu_list, __concurrency)  # Can be None if no gpu
 
-    __lock = threading.Lock()
+    __condition = threading.Condition()
+    __leases = {}  # container name: cpus, cpu, memory, gpus and lease time
+    # used by containers not leased by this manager, updated on reconciliation with docker
+    __unleased_cpu_usage = {}
+    __unleased_memory_mb = 0
+    __unleased_gpus = set()
+    __reconciled_at = 0
     __docker = docker.from_env()
 
     @classmethod
-    def memory_limit_mb(cls):
+    def host_memory_mb(cls):
         try:
-            return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024. ** 2)) // cls.__concurrency
+            return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024. ** 2))
         except ValueError:
             # fixes macOS issue https://github.com/SubstraFoundation/substrabac/issues/262
-            return int(check_output(['sysctl', '-n', 'hw.memsize']).strip()) // cls.__concurrency
+            return int(check_output(['sysctl', '-n', 'hw.memsize']).strip()) // 1024 ** 2
+
+    @classmethod
+    def memory_limit_mb(cls):
+        return cls.host_memory_mb() // cls.__concurrency
 
     @classmethod
-    def get_cpu_gpu_sets(cls):
+    def default_resources(cls):
+        # an equal share of the host for each concurrent task
+        return {
+            'cpu': max(1, cls.__cpu_count // cls.__concurrency),
+            'memory_mb': cls.memory_limit_mb(),
+            'gpu': len(cls.__gpu_list) // cls.__concurrency if cls.__gpu_list else 0,
+        }
 
-        cpu_set = None
-        gpu_set = None
+    @classmethod
+    def allocate(cls, container_name, resources=None):
+        """Allocate resources to a container, wait until they are released by other containers if needed.
+
+        `resources` may request 'cpu' (possibly fractional), 'memory_mb' and 'gpu', defaulting to an equal
+        share of the host. The allocation must be released with `release` once the container has exited.
+        """
+        request = dict(cls.default_resources(), **validate_resources(resources or {}))
+        cpu, memory_mb, gpu = float(request['cpu']), int(request['memory_mb']), int(request['gpu'])
+
+        if cpu > cls.__cpu_count or memory_mb > cls.host_memory_mb() or gpu > len(cls.__gpu_list):
+            raise Exception(f'Resources {request} exceed the host resources')
+
+        with cls.__condition:
+            while True:
+                if time.time() - cls.__reconciled_at >= cls.__reconciliation_period():
+                    cls.__reconcile()
+
+                cpus = place_cpus(cpu, cls.__cpu_usage(), cls.__numa_nodes)
+                gpus = sorted(set(cls.__gpu_list) - cls.__used_gpus())[:gpu]
+                if cpus is not None and memory_mb <= cls.__free_memory_mb() and len(gpus) == gpu:
+                    break
+
+                # woken up on release, reconcile periodically in case containers exited without release
+                cls.__condition.wait(cls.__reconciliation_period())
+
+            cls.__leases[container_name] = {
+                'cpus': cpus,
+                'cpu': cpu,
+                'memory_mb': memory_mb,
+                'gpus': gpus,
+                'leased_at': time.time(),
+            }
+
+        return {
+            'cpu_set': format_cpu_set(cpus),
+            # limit the cpu time when the cpus are shared or not fully requested
+            'nano_cpus': int(cpu * 1e9) if cpu != len(cpus) else None,
+            'memory_mb': memory_mb,
+            'gpu_set': ','.join(gpus) if gpus else None,
+        }
 
-        with cls.__lock:
-            # We can just wait for cpu because cpu and gpu is allocated the same way
-            while cpu_set is None:
+    @classmethod
+    def release(cls, container_name):
+        with cls.__condition:
+            cls.__leases.pop(container_name, None)
+            cls.__condition.notify_all()
 
-                # Get ressources used
-                filters = {'status': 'running',
-                           'label': [DOCKER_LABEL]}
+    @classmethod
+    def __reconciliation_period(cls):
+        return getattr(settings, 'TASK', {}).get('RESOURCES_RECONCILIATION_PERIOD', 30)
 
-                try:
-                    containers = [container.attrs
-                                  for container in cls.__docker.containers.list(filters=filters)]
-                except docker.errors.APIError as e:
-                    logger.error(e, exc_info=True)
-                    continue
+    @classmethod
+    def __cpu_usage(cls):
+        usage = {cpu: 0. for cpu in range(cls.__cpu_count)}
+        for cpu, cpu_usage in cls.__unleased_cpu_usage.items():
+            usage[cpu] = min(1., usage.get(cpu, 0.) + cpu_usage)
+        for lease in cls.__leases.values():
+            # whole cpus are not shared
+            share = lease['cpu'] if len(lease['cpus']) == 1 and lease['cpu'] < 1 else 1.
+            for cpu in lease['cpus']:
+                usage[cpu] = min(1., usage.get(cpu, 0.) + share)
+        return usage
 
-                # CPU
-                used_cpu_sets = [container['HostConfig']['CpusetCpus']
-                                 for container in containers
-                                 if container['HostConfig']['CpusetCpus']]
+    @classmethod
+    def __free_memory_mb(cls):
+        return (cls.host_memory_mb() - cls.__unleased_memory_mb -
+                sum(lease['memory_mb'] for lease in cls.__leases.values()))
 
-                cpu_sets_available = filter_cpu_sets(used_cpu_sets, cls.__cpu_sets)
+    @classmethod
+    def __used_gpus(cls):
+        return cls.__unleased_gpus.union(*(lease['gpus'] for lease in cls.__leases.values()))
+
+    @classmethod
+    def __reconcile(cls):
+        """Synchronize the leases with the task containers of docker.
+
+        Resources used by containers which are not leased (started by another process) are not allocated,
+        and leases of containers which no longer exist (process killed before the release) are dropped.
+        """
+        cls.__reconciled_at = time.time()
+
+        try:
+            containers = cls.__docker.containers.list(all=True, filters={'label': [DOCKER_LABEL]})
+        except Exception as e:
+            logger.error(f'Cannot reconcile resources with docker: {e}')
+            return
 
-                if cpu_sets_available:
-                    cpu_set = cpu_sets_available.pop()
+        container_names = {container.name for container in containers}
 
-                # GPU
-                if cls.__gpu_sets is not None:
-                    env_containers = [container['Config']['Env']
-                                      for container in containers]
+        for container_name, lease in list(cls.__leases.items()):
+            if container_name not in container_names and time.time() - lease['leased_at'] > LEASE_GRACE_PERIOD:
+                logger.warning(f'Drop resources lease of exited container {container_name}')
+                del cls.__leases[container_name]
 
-                    used_gpu_sets = []
+        cpu_usage = {}
+        memory_mb = 0
+        gpus = set()
 
-                    for env_list in env_containers:
-                        nvidia_env_var = [s.split('=')[1]
-                                          for s in env_list if "NVIDIA_VISIBLE_DEVICES" in s]
+        for container in containers:
+            if container.status != 'running' or container.name in cls.__leases or POOL_LABEL in container.labels:
+                continue
 
-                        used_gpu_sets.extend(nvidia_env_var)
+            host_config = container.attrs['HostConfig']
+            cpus = parse_cpu_set(host_config.get('CpusetCpus') or '')
+            share = host_config.get('NanoCpus') / 1e9 if host_config.get('NanoCpus') and len(cpus) == 1 else 1.
+            for cpu in cpus:
+                cpu_usage[cpu] = cpu_usage.get(cpu, 0.) + share
 
-                    gpu_sets_available = filter_gpu_sets(used_gpu_sets, cls.__gpu_sets)
+            memory_mb += (host_config.get('Memory') or 0) // 1024 ** 2
 
-                    if gpu_sets_available:
-                        gpu_set = gpu_sets_available.pop()
+            for env in container.attrs['Config']['Env'] or []:
+                if env.startswith('NVIDIA_VISIBLE_DEVICES='):
+                    gpus.update(env.split('=')[1].split(','))
 
-        return cpu_set, gpu_set
+        cls.__unleased_cpu_usage = cpu_usage
+        cls.__unleased_memory_mb = memory_mb
+        cls.__unleased_gpus = gpus
@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import shutil
+from os import path
+
+import docker
+from django.conf import settings
+
+from substrapp.dirhash import link_hashed_file
+from substrapp.tasks.asset_cache import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Workspaces of the compute plans of a worker.
+#
+# The ranks of a compute plan run on the same worker (see routing), they share a workspace in
+# MEDIA_ROOT/compute_plans/<compute_plan_id> which keeps, between ranks:
+# - the data samples and openers already validated against their hash, which are not verified again
+# - the algo and metrics images built for the plan, which are not built again
+# - the models trained by previous ranks (hardlinked), which are not fetched again
+# The state of the workspace is a json file updated under a file lock. The workspace is removed when the
+# last rank (-1) of the plan ends.
+
+WORKSPACE_DIRECTORY = 'compute_plans'
+STATE_FILENAME = 'workspace.json'
+
+
+def get_workspace_directory(compute_plan_id):
+    return path.join(getattr(settings, 'MEDIA_ROOT'), WORKSPACE_DIRECTORY, compute_plan_id)
+
+
+def is_workspace_path(file_path):
+    workspaces_directory = path.join(getattr(settings, 'MEDIA_ROOT'), WORKSPACE_DIRECTORY)
+    return path.commonpath([path.abspath(file_path), workspaces_directory]) == workspaces_directory
+
+
+def _get_state_path(compute_plan_id):
+    directory = get_workspace_directory(compute_plan_id)
+    os.makedirs(directory, exist_ok=True)
+    return path.join(directory, STATE_FILENAME)
+
+
+def _load_state(state_path):
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):  # new or corrupted workspace
+        return {}
+
+
+def is_workspace_asset(compute_plan_id, kind, key):
+    """Return whether an asset (data sample, opener or image) is registered in the workspace of the plan."""
+    return key in _load_state(_get_state_path(compute_plan_id)).get(kind, [])
+
+
+def register_workspace_asset(compute_plan_id, kind, key):
+    state_path = _get_state_path(compute_plan_id)
+
+    with file_lock(f'{state_path}.lock'):
+        state = _load_state(state_path)
+        if key in state.get(kind, []):
+            return
+        state.setdefault(kind, []).append(key)
+
+        tmp_path = f'{state_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp_path, state_path)
+
+
+def get_workspace_model_path(compute_plan_id, traintuple_key):
+    """Return the path of a model trained by a previous rank of the plan, or None."""
+    model_path = path.join(get_workspace_directory(compute_plan_id), 'models', traintuple_key)
+    return model_path if path.exists(model_path) else None
+
+
+def add_workspace_model(compute_plan_id, traintuple_key, model_path, model_hash):
+    models_directory = path.join(get_workspace_directory(compute_plan_id), 'models')
+    os.makedirs(models_directory, exist_ok=True)
+
+    workspace_model_path = path.join(models_directory, traintuple_key)
+    if path.exists(workspace_model_path):
+        return
+    try:
+        link_hashed_file(model_path, workspace_model_path, model_hash)
+    except OSError:  # not on the same file system
+        shutil.copyfile(model_path, workspace_model_path)
+
+
+def remove_workspace(client, compute_plan_id, remove_images=True):
+    """Remove the workspace of a compute plan and the images built for it."""
+    state_path = _get_state_path(compute_plan_id)
+
+    if remove_images:
+        for image_name in _load_state(state_path).get('image', []):
+            try:
+                client.images.remove(image_name, force=True)
+            except docker.errors.ImageNotFound:  # removed with the container of the last rank
+                pass
+            except docker.errors.APIError as e:
+                logger.warning(f'Cannot remove image {image_name} of compute plan {compute_plan_id}: {e}')
+
+    shutil.rmtree(get_workspace_directory(compute_plan_id), ignore_errors=True)
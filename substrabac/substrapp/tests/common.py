@@ -264,6 +264,27 @@ class FakeRequest(object):
     def __init__(self, status, content):
         self.status_code = status
         self.content = content
+        self.text = str(content)
+
+    def iter_content(self, chunk_size=1):
+        content = self.content.encode() if isinstance(self.content, str) else self.content
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+def fake_remote_file_path(*contents):
+    """Side effect of `get_remote_file_path` writing contents of successive downloads"""
+    contents = iter(contents)
+
+    def download(url, auth, content_hash, dst_path, salt=None):
+        with open(dst_path, 'wb') as f:
+            f.write(next(contents))
+        return dst_path
+
+    return download
 
 
 class FakeTask(object):
@@ -100,6 +100,27 @@ class AlgoQueryTests(APITestCase):
                              f'http://testserver/media/algos/{r["pkhash"]}/{self.algo_filename_zip}')
             self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_add_algo_streamed_upload(self):
+        self.add_default_objective()
+        pkhash, data = self.get_default_algo_data_zip()
+
+        url = reverse('substrapp:algo-list')
+        extra = {
+            'HTTP_ACCEPT': 'application/json;version=0.0',
+        }
+
+        with mock.patch('substrapp.serializers.ledger.utils.invoke_ledger') as minvoke_ledger:
+            minvoke_ledger.return_value = {'pkhash': pkhash}
+
+            response = self.client.post(url, data, format='multipart', **extra)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['pkhash'], pkhash)
+        # uploaded files are moved to their final location
+        self.assertEqual(os.listdir(os.path.join(MEDIA_ROOT, 'uploads')), [])
+        self.assertEqual(get_hash(Algo.objects.get(pk=pkhash).file), pkhash)
+
     @override_settings(LEDGER_SYNC_ENABLED=False)
     @override_settings(
         task_eager_propagates=True,
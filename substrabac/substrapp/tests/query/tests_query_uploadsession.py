@@ -0,0 +1,129 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import mock
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from substrapp.models import DataManager, DataSample, UploadSession
+from substrapp.utils import get_dir_hash, get_hash
+
+from ..common import get_sample_datamanager, get_sample_zip_data_sample, AuthenticatedClient
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+@override_settings(LEDGER={'name': 'test-org', 'peer': 'test-peer'})
+@override_settings(LEDGER_SYNC_ENABLED=True)
+@override_settings(UPLOAD={'CHUNK_SIZE': 100})
+class UploadSessionQueryTests(APITestCase):
+    client_class = AuthenticatedClient
+
+    def setUp(self):
+        if not os.path.exists(MEDIA_ROOT):
+            os.makedirs(MEDIA_ROOT)
+
+        data_file, self.data_file_filename = get_sample_zip_data_sample()
+        self.content = data_file.read()
+        data_file.seek(0)
+        self.pkhash = get_dir_hash(data_file.file)
+
+        _, _, self.data_data_opener, _ = get_sample_datamanager()
+        self.extra = {
+            'HTTP_ACCEPT': 'application/json;version=0.0',
+        }
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def create_session(self):
+        url = reverse('substrapp:upload_session-list')
+        response = self.client.post(url, {'filename': self.data_file_filename, 'size': len(self.content)},
+                                    format='json', **self.extra)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['offset'], 0)
+        return response.json()['id']
+
+    def upload_chunk(self, session_id, start, end):
+        url = reverse('substrapp:upload_session-chunk', args=[session_id])
+        return self.client.put(url, self.content[start:end + 1], content_type='application/octet-stream',
+                               HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.content)}', **self.extra)
+
+    def test_upload_session(self):
+        DataManager.objects.create(name='slide opener', description=get_sample_datamanager()[0],
+                                   data_opener=self.data_data_opener)
+        session_id = self.create_session()
+        middle = len(self.content) // 2
+
+        response = self.upload_chunk(session_id, 0, middle - 1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['offset'], middle)
+
+        # a chunk not starting at the offset is rejected with the offset to resume from
+        response = self.upload_chunk(session_id, 0, middle - 1)
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response.json()['offset'], middle)
+
+        url = reverse('substrapp:upload_session-detail', args=[session_id])
+        self.assertEqual(self.client.get(url, **self.extra).json()['offset'], middle)
+
+        response = self.upload_chunk(session_id, middle, len(self.content) - 1)
+        self.assertEqual(response.json()['offset'], len(self.content))
+
+        url = reverse('substrapp:upload_session-finalize', args=[session_id])
+        data = {
+            'data_manager_keys': [get_hash(self.data_data_opener)],
+            'test_only': True,
+            'sha256': hashlib.sha256(self.content).hexdigest(),
+        }
+        with mock.patch('substrapp.serializers.ledger.datasample.util.create_ledger_assets') as mcreate_ledger_assets, \
+                mock.patch('substrapp.upload.file_hash') as mfile_hash:
+            mcreate_ledger_assets.return_value = {'pkhash': [self.pkhash], 'validated': True}
+            response = self.client.post(url, data, format='multipart', **self.extra)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()[0]['pkhash'], self.pkhash)
+        # hashed while the chunks were received
+        self.assertFalse(mfile_hash.called)
+        self.assertTrue(DataSample.objects.filter(pkhash=self.pkhash).exists())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(MEDIA_ROOT, 'upload_sessions')), [])
+
+    def test_upload_session_overflow(self):
+        session_id = self.create_session()
+
+        # beyond the size announced when the session was created
+        url = reverse('substrapp:upload_session-chunk', args=[session_id])
+        response = self.client.put(url, self.content + b'overflow', content_type='application/octet-stream',
+                                   HTTP_CONTENT_RANGE=f'bytes 0-{len(self.content) + 7}/*', **self.extra)
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response.json()['offset'], 0)
+
+        url = reverse('substrapp:upload_session-detail', args=[session_id])
+        self.assertEqual(self.client.get(url, **self.extra).json()['offset'], 0)
+
+    def test_upload_session_incomplete(self):
+        session_id = self.create_session()
+
+        response = self.upload_chunk(session_id, 0, 9)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        url = reverse('substrapp:upload_session-chunk', args=[session_id])
+        response = self.client.put(url, self.content[10:20], content_type='application/octet-stream',
+                                   HTTP_CONTENT_RANGE='bytes 10-19', **self.extra)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        url = reverse('substrapp:upload_session-finalize', args=[session_id])
+        response = self.client.post(url, {}, format='multipart', **self.extra)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['offset'], 10)
+
+        url = reverse('substrapp:upload_session-detail', args=[session_id])
+        self.assertEqual(self.client.delete(url, **self.extra).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(MEDIA_ROOT, 'upload_sessions', session_id)))
@@ -0,0 +1,169 @@
+import os
+import shutil
+import tempfile
+import zipfile
+
+import mock
+from checksumdir import dirhash
+from django.test import TestCase, override_settings
+from rest_framework.exceptions import ValidationError
+
+from substrapp.bulk_import import import_data_samples, hash_input, reconcile_data_samples
+from substrapp.ledger_utils import LedgerBadResponse, LedgerTimeout
+from substrapp.models import DataSample, DataSampleImport
+from substrapp.views.utils import LedgerException
+
+MEDIA_ROOT = tempfile.mkdtemp()
+DATA_MANAGER_KEY = 'a' * 64
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, LEDGER_SYNC_ENABLED=True, BULK_IMPORT={'CHUNK_SIZE': 2, 'WORKERS': 2})
+class BulkImportTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(4):
+            data_path = os.path.join(self.directory, f'data{i}')
+            os.makedirs(data_path)
+            with open(os.path.join(data_path, 'data.csv'), 'w') as f:
+                f.write(str(i))
+            self.paths.append(data_path)
+
+        archive_path = os.path.join(self.directory, 'data.zip')
+        with zipfile.ZipFile(archive_path, 'w') as zf:
+            zf.writestr('data.csv', 'archive')
+        self.paths.append(archive_path)
+
+        self.checkpoint_path = os.path.join(self.directory, 'import.checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def test_import_data_samples(self):
+        progress = mock.MagicMock()
+
+        with mock.patch('substrapp.serializers.ledger.utils.invoke_ledger', return_value={}) as minvoke_ledger:
+            data_samples = import_data_samples(self.paths, [DATA_MANAGER_KEY], progress=progress)
+
+        # registered by chunks
+        self.assertEqual(minvoke_ledger.call_count, 3)
+        self.assertEqual([x[0] for x, _ in progress.call_args_list], [2, 4, 5])
+        self.assertEqual(len(data_samples), 5)
+        self.assertTrue(all(x['validated'] for x in data_samples))
+
+        self.assertEqual(DataSample.objects.filter(validated=True).count(), 5)
+        for data_sample in DataSample.objects.all():
+            self.assertEqual(data_sample.path, os.path.join(MEDIA_ROOT, 'datasamples', data_sample.pk))
+            self.assertEqual(dirhash(data_sample.path, 'sha256'), data_sample.pk)
+        # extracted archives are moved
+        self.assertEqual(len(os.listdir(os.path.join(MEDIA_ROOT, 'datasamples'))), 5)
+
+        # existing data samples are not registered again
+        with mock.patch('substrapp.serializers.ledger.utils.invoke_ledger') as minvoke_ledger:
+            data_samples = import_data_samples(self.paths, [DATA_MANAGER_KEY])
+        self.assertFalse(minvoke_ledger.called)
+        self.assertEqual(len(data_samples), 5)
+        self.assertEqual(len(os.listdir(os.path.join(MEDIA_ROOT, 'datasamples'))), 5)
+
+    def test_import_data_samples_resume(self):
+        with mock.patch('substrapp.serializers.ledger.utils.invoke_ledger',
+                        side_effect=[{}, LedgerBadResponse('error')]):
+            with self.assertRaises(LedgerException):
+                import_data_samples(self.paths, [DATA_MANAGER_KEY])
+
+        # data samples of the failed chunk are deleted, their files are kept
+        self.assertEqual(DataSample.objects.count(), 2)
+        self.assertEqual(list(DataSampleImport.objects.values_list('state', flat=True)),
+                         [DataSampleImport.COMMITTED] * 2 + [DataSampleImport.LINKED] * 2)
+
+        # inputs are resumed from their last step
+        with mock.patch('substrapp.serializers.ledger.utils.invoke_ledger', return_value={}) as minvoke_ledger, \
+                mock.patch('substrapp.bulk_import.hash_input', wraps=hash_input) as mhash_input:
+            data_samples = import_data_samples(self.paths, [DATA_MANAGER_KEY])
+
+        mhash_input.assert_called_once_with(self.paths[4])
+        self.assertEqual(minvoke_ledger.call_count, 2)
+        self.assertEqual(len(data_samples), 5)
+        self.assertEqual(DataSample.objects.filter(validated=True).count(), 5)
+        self.assertFalse(DataSampleImport.objects.exists())
+
+    def test_import_data_samples_resume_shifted(self):
+        with mock.patch('substrapp.serializers.ledger.utils.invoke_ledger',
+                        side_effect=[{}, LedgerBadResponse('error')]):
+            with self.assertRaises(LedgerException):
+                import_data_samples([self.directory], [DATA_MANAGER_KEY], multiple=True)
+
+        # a sub-directory inserted before the journaled inputs shifts their positions
+        data_path = os.path.join(self.directory, 'data00')
+        os.makedirs(data_path)
+        with open(os.path.join(data_path, 'data.csv'), 'w') as f:
+            f.write('00')
+
+        with mock.patch('substrapp.serializers.ledger.utils.invoke_ledger', return_value={}):
+            data_samples = import_data_samples([self.directory], [DATA_MANAGER_KEY], multiple=True)
+
+        self.assertEqual(len(data_samples), 5)
+        expected_pkhashes = {dirhash(x, 'sha256') for x in self.paths[:4] + [data_path]}
+        self.assertEqual(set(DataSample.objects.filter(validated=True).values_list('pkhash', flat=True)),
+                         expected_pkhashes)
+        self.assertFalse(DataSampleImport.objects.exists())
+
+    def test_import_data_samples_timeout(self):
+        with mock.patch('substrapp.serializers.ledger.utils.invoke_ledger', side_effect=LedgerTimeout('timeout')):
+            with self.assertRaises(LedgerException) as cm:
+                import_data_samples(self.paths, [DATA_MANAGER_KEY])
+
+        # data samples are kept until validated
+        self.assertEqual(cm.exception.st, LedgerTimeout.status)
+        pkhashes = cm.exception.data['pkhash']
+        self.assertEqual(len(pkhashes), 5)
+        self.assertEqual(DataSample.objects.filter(validated=False).count(), 5)
+
+        # the data samples registered meanwhile are validated, the others are registered again
+        ledger_data_samples = [{'key': pkhash} for pkhash in pkhashes[:2]]
+        with mock.patch('substrapp.bulk_import.query_ledger', return_value=ledger_data_samples), \
+                mock.patch('substrapp.serializers.ledger.utils.invoke_ledger', return_value={}) as minvoke_ledger:
+            import_data_samples(self.paths, [DATA_MANAGER_KEY])
+
+        self.assertEqual(minvoke_ledger.call_count, 2)
+        self.assertEqual(DataSample.objects.filter(validated=True).count(), 5)
+        self.assertFalse(DataSampleImport.objects.exists())
+
+    def test_import_data_samples_invalid(self):
+        with mock.patch('substrapp.bulk_import.LedgerDataSampleSerializer') as mserializer:
+            mserializer.return_value.is_valid.side_effect = [True, False]
+            mserializer.return_value.errors = {'data_manager_keys': ['invalid']}
+            mserializer.return_value.create.return_value = {'validated': True}
+            with self.assertRaises(ValidationError) as cm:
+                import_data_samples(self.paths, [DATA_MANAGER_KEY])
+
+        # the pkhashes of the imported data samples and of the failing chunk
+        self.assertEqual(cm.exception.pkhashes, [hash_input(x)['pkhash'] for x in self.paths[:4]])
+        self.assertEqual(DataSample.objects.count(), 2)
+
+    def test_reconcile_data_samples(self):
+        DataSample.objects.bulk_create([
+            DataSample(pkhash='a' * 64, path='a'),
+            DataSample(pkhash='b' * 64, path='b'),
+            DataSample(pkhash='c' * 64, path='c', validated=True),
+        ])
+
+        with mock.patch('substrapp.bulk_import.query_ledger', return_value=[{'key': 'a' * 64}, {'key': 'c' * 64}]):
+            self.assertEqual(reconcile_data_samples(), 1)
+
+        self.assertEqual(list(DataSample.objects.filter(validated=False).values_list('pkhash', flat=True)),
+                         ['b' * 64])
+
+    def test_import_data_samples_duplicate(self):
+        with mock.patch('substrapp.serializers.ledger.utils.invoke_ledger', return_value={}):
+            with self.assertRaises(Exception) as cm:
+                import_data_samples(self.paths + [self.paths[0]], [DATA_MANAGER_KEY])
+        self.assertIn('same pkhash', str(cm.exception))
+
+        # multiple: sub-directories are data samples
+        DataSample.objects.all().delete()
+        with mock.patch('substrapp.serializers.ledger.utils.invoke_ledger', return_value={}):
+            data_samples = import_data_samples([self.directory], [DATA_MANAGER_KEY], multiple=True)
+        self.assertEqual(len(data_samples), 4)
@@ -0,0 +1,178 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import mock
+from checksumdir import dirhash
+from django.test import TestCase, override_settings
+
+from substrapp.dirhash import (compute_dirhash, verify_dirhash, load_manifest, hash_directory, VERIFICATION_FULL,
+                               VERIFICATION_TRUST, compute_file_hash, verify_file_hash, link_hashed_file,
+                               get_unchanged_file_hashes, register_copied_dirhash, _get_hash_executor)
+from substrapp.utils import get_hash, uncompress_file
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class DirHashTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, 'sub'))
+        for name, content in (('a.csv', b'a'), ('b.csv', b'b'), ('sub/c.csv', b'c'), ('sub/.hidden', b'')):
+            with open(os.path.join(self.directory, name), 'wb') as f:
+                f.write(content)
+        # files are not modified during the test
+        self.racy_delay = mock.patch('substrapp.dirhash.RACY_DELAY', -60)
+        self.racy_delay.start()
+
+    def tearDown(self):
+        self.racy_delay.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def test_compute_dirhash(self):
+        dir_hash = compute_dirhash(self.directory)
+        self.assertEqual(dir_hash, dirhash(self.directory, 'sha256'))
+
+        manifest = load_manifest(dir_hash)
+        self.assertEqual(sorted(manifest['files']), ['a.csv', 'b.csv', 'sub/.hidden', 'sub/c.csv'])
+
+    def test_verify_dirhash_incremental(self):
+        dir_hash = compute_dirhash(self.directory)
+
+        with mock.patch('substrapp.dirhash.file_hash') as mfile_hash:
+            self.assertTrue(verify_dirhash(self.directory, dir_hash))
+            self.assertFalse(mfile_hash.called)
+
+        # only the modified file is rehashed
+        with open(os.path.join(self.directory, 'a.csv'), 'wb') as f:
+            f.write(b'modified')
+        with mock.patch('substrapp.dirhash.file_hash', return_value='modified') as mfile_hash:
+            self.assertFalse(verify_dirhash(self.directory, dir_hash))
+            mfile_hash.assert_called_once_with(os.path.join(self.directory, 'a.csv'))
+
+    def test_verify_dirhash_restored_mtime(self):
+        dir_hash = compute_dirhash(self.directory)
+
+        # rewritten with the same size and modification time
+        file_path = os.path.join(self.directory, 'a.csv')
+        stat = os.stat(file_path)
+        time.sleep(0.01)
+        with open(file_path, 'wb') as f:
+            f.write(b'z')
+        os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        self.assertFalse(verify_dirhash(self.directory, dir_hash))
+
+    def test_verify_dirhash_hardlinked_copy(self):
+        dir_hash = compute_dirhash(self.directory)
+
+        # hardlinks update the change time of the files, their hashes are read before
+        file_hashes = get_unchanged_file_hashes(self.directory, dir_hash)
+        copy_directory = os.path.join(MEDIA_ROOT, 'datasamples', dir_hash)
+        shutil.copytree(self.directory, copy_directory, copy_function=os.link)
+        self.assertEqual(register_copied_dirhash(self.directory, copy_directory, dir_hash, file_hashes), dir_hash)
+
+        with mock.patch('substrapp.dirhash.file_hash') as mfile_hash:
+            self.assertTrue(verify_dirhash(copy_directory, dir_hash))
+            self.assertFalse(mfile_hash.called)
+
+    def test_verify_dirhash_modes(self):
+        dir_hash = compute_dirhash(self.directory)
+
+        os.remove(os.path.join(self.directory, 'b.csv'))
+
+        self.assertFalse(verify_dirhash(self.directory, dir_hash, mode=VERIFICATION_FULL))
+        # the registered manifest is trusted
+        self.assertTrue(verify_dirhash(self.directory, dir_hash, mode=VERIFICATION_TRUST))
+        self.assertFalse(verify_dirhash(self.directory, 'unregistered', mode=VERIFICATION_TRUST))
+
+        with self.assertRaises(Exception):
+            verify_dirhash(self.directory, dir_hash, mode='unknown')
+
+    @override_settings(DIRHASH={'PARALLEL_MIN_FILES': 1})
+    def test_hash_directory_parallel(self):
+        for i in range(20):
+            with open(os.path.join(self.directory, f'{i}.csv'), 'wb') as f:
+                f.write(os.urandom(i * 1024))
+
+        expected = dirhash(self.directory, 'sha256')
+        with mock.patch('substrapp.dirhash._hash_executor', None), \
+                mock.patch('substrapp.dirhash.os.cpu_count', return_value=4), \
+                mock.patch('substrapp.dirhash.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as mexecutor:
+            self.assertEqual(hash_directory(self.directory, workers=2), expected)
+            self.assertEqual(hash_directory(self.directory, workers=2), expected)
+            # the pool of the process is reused
+            self.assertEqual(mexecutor.call_count, 1)
+
+            # the pool of the parent is not used by forked processes
+            parent_executor = _get_hash_executor(2)
+            with mock.patch('substrapp.dirhash._hash_executor', (-1, 2, parent_executor)):
+                self.assertEqual(hash_directory(self.directory, workers=2), expected)
+                self.assertIsNot(_get_hash_executor(2), parent_executor)
+                _get_hash_executor(2).shutdown()
+            self.assertEqual(mexecutor.call_count, 2)
+
+            # hash in threads from daemonic processes, logged once
+            with mock.patch('substrapp.dirhash.multiprocessing.current_process') as mcurrent_process, \
+                    mock.patch('substrapp.dirhash._daemonic_fallback_logged', False), \
+                    mock.patch('substrapp.dirhash.logger') as mlogger:
+                mcurrent_process.return_value.daemon = True
+                self.assertEqual(hash_directory(self.directory, workers=2), expected)
+                self.assertEqual(hash_directory(self.directory, workers=2), expected)
+            self.assertEqual(mlogger.info.call_count, 1)
+            self.assertEqual(mexecutor.call_count, 2)
+
+            _get_hash_executor(2).shutdown()
+
+    def test_verify_file_hash(self):
+        file_path = os.path.join(self.directory, 'a.csv')
+        file_hash = compute_file_hash(file_path, 'salt')
+        self.assertEqual(file_hash, get_hash(file_path, 'salt'))
+
+        # hardlinks of the verified file are not read
+        link_path = os.path.join(MEDIA_ROOT, 'model')
+        os.makedirs(MEDIA_ROOT, exist_ok=True)
+        link_hashed_file(file_path, link_path, file_hash)
+        with mock.patch('substrapp.dirhash.file_hash') as mfile_hash:
+            self.assertTrue(verify_file_hash(link_path, file_hash, 'salt'))
+            self.assertFalse(mfile_hash.called)
+
+        with open(file_path, 'ab') as f:
+            f.write(b'corrupted')
+        self.assertFalse(verify_file_hash(link_path, file_hash, 'salt'))
+
+    def test_uncompress_file(self):
+        expected = dirhash(self.directory, 'sha256')
+
+        zip_file = io.BytesIO()
+        with zipfile.ZipFile(zip_file, 'w') as zf:
+            for name in ('a.csv', 'b.csv', 'sub/c.csv', 'sub/.hidden'):
+                zf.write(os.path.join(self.directory, name), name)
+        tar_file = io.BytesIO()
+        with tarfile.open(fileobj=tar_file, mode='w:gz') as tf:
+            tf.add(self.directory, arcname='.')
+
+        for archive_file in (zip_file, tar_file):
+            to_directory = os.path.join(MEDIA_ROOT, 'extracted')
+            # files are hashed while extracted
+            with mock.patch('substrapp.dirhash.file_hash') as mfile_hash:
+                dir_hash = uncompress_file(archive_file, to_directory)
+                self.assertFalse(mfile_hash.called)
+            self.assertEqual(dir_hash, expected)
+            self.assertEqual(dirhash(to_directory, 'sha256'), expected)
+            self.assertEqual(sorted(load_manifest(dir_hash)['files']), ['a.csv', 'b.csv', 'sub/.hidden', 'sub/c.csv'])
+            shutil.rmtree(to_directory)
+
+        tar_file = io.BytesIO()
+        with tarfile.open(fileobj=tar_file, mode='w') as tf:
+            tf.add(os.path.join(self.directory, 'a.csv'), arcname='../a.csv')
+        with self.assertRaises(Exception):
+            uncompress_file(tar_file, os.path.join(MEDIA_ROOT, 'extracted'))
@@ -0,0 +1,355 @@
+from datetime import timedelta
+from unittest.mock import MagicMock
+
+from django.test import TestCase, override_settings
+from mock import patch
+
+from django.core.cache import caches
+from django.utils import timezone
+
+from substrapp.ledger_utils import (get_hfc, reset_hfc, call_ledger, LedgerError, LedgerCache, query_ledger,
+                                    invoke_ledger, invalidate_tuples_cache, LedgerNotFound, LedgerStatusError,
+                                    LedgerTimeout)
+from substrapp.ledger_reporter import enqueue_report, flush_reports, claim_reports, submit_report, SUBMIT_TIMEOUT
+from substrapp.models import LedgerReport
+from substrapp.tasks.tasks import report_tuple
+
+
+class HfcClientTests(TestCase):
+
+    def setUp(self):
+        reset_hfc()
+        self.hfc = MagicMock(side_effect=lambda: (MagicMock(), MagicMock()))
+        self.ledger = patch('substrapp.ledger_utils.LEDGER', {
+            'hfc': self.hfc,
+            'peer': {'name': 'peer'},
+            'requestor': 'requestor',
+            'channel_name': 'channel',
+            'chaincode_name': 'chaincode',
+        })
+        self.ledger.start()
+
+    def tearDown(self):
+        reset_hfc()
+        self.ledger.stop()
+
+    def test_get_hfc_reuses_client(self):
+        with get_hfc() as (loop, client):
+            pass
+
+        with get_hfc() as (loop2, client2):
+            pass
+
+        self.assertEqual(self.hfc.call_count, 1)
+        self.assertIs(loop, loop2)
+        self.assertIs(client, client2)
+        loop.close.assert_not_called()
+
+    @override_settings(LEDGER_CLIENT_TTL=60)
+    def test_get_hfc_ttl(self):
+        with patch('substrapp.ledger_utils.time.time') as mtime:
+            mtime.return_value = 1000
+            with get_hfc() as (loop, _):
+                pass
+
+            mtime.return_value = 1059
+            with get_hfc():
+                pass
+            self.assertEqual(self.hfc.call_count, 1)
+
+            mtime.return_value = 1061
+            with get_hfc() as (loop2, _):
+                pass
+
+        self.assertEqual(self.hfc.call_count, 2)
+        self.assertIsNot(loop, loop2)
+        loop.close.assert_called_once()
+
+    def test_get_hfc_reset(self):
+        with get_hfc() as (loop, _):
+            pass
+
+        reset_hfc()
+        loop.close.assert_called_once()
+
+        with get_hfc():
+            pass
+
+        self.assertEqual(self.hfc.call_count, 2)
+
+    def test_get_hfc_after_fork(self):
+        with get_hfc() as (loop, _):
+            pass
+
+        with patch('substrapp.ledger_utils.os.getpid') as mgetpid:
+            mgetpid.return_value = -1
+            with get_hfc() as (loop2, _):
+                pass
+
+        self.assertEqual(self.hfc.call_count, 2)
+        self.assertIsNot(loop, loop2)
+        # the parent loop must not be closed by the child
+        loop.close.assert_not_called()
+
+    def test_call_ledger_resets_client_on_network_error(self):
+        with get_hfc() as (loop, _):
+            loop.run_until_complete.side_effect = Exception('failed to connect to all addresses')
+
+        with self.assertRaises(LedgerError):
+            call_ledger('query', 'queryAlgos')
+
+        loop.close.assert_called_once()
+
+        with get_hfc():
+            pass
+
+        self.assertEqual(self.hfc.call_count, 2)
+
+
+@override_settings(LEDGER_CACHE={'ENABLED': True, 'MAX_SIZE': 10, 'BACKEND': 'default'})
+class LedgerCacheTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.cache = patch('substrapp.ledger_utils._ledger_cache', None)
+        self.cache.start()
+
+    def tearDown(self):
+        self.cache.stop()
+
+    def test_query_ledger_pinned(self):
+        with patch('substrapp.ledger_utils.call_ledger') as mcall_ledger:
+            mcall_ledger.return_value = {'key': 'pk', 'name': 'algo'}
+
+            data = query_ledger('queryAlgo', {'key': 'pk'})
+            data['name'] = 'updated by caller'
+
+            with patch('substrapp.ledger_utils.time.time') as mtime:
+                mtime.return_value = 2 ** 40
+                self.assertEqual(query_ledger('queryAlgo', {'key': 'pk'}), {'key': 'pk', 'name': 'algo'})
+
+            self.assertEqual(mcall_ledger.call_count, 1)
+
+            query_ledger('queryAlgo', {'key': 'other_pk'})
+            self.assertEqual(mcall_ledger.call_count, 2)
+
+    def test_query_ledger_ttl(self):
+        with patch('substrapp.ledger_utils.call_ledger') as mcall_ledger, \
+                patch('substrapp.ledger_utils.time.time') as mtime:
+            mcall_ledger.return_value = []
+            mtime.return_value = 1000
+
+            query_ledger('queryTraintuples', args=[])
+            mtime.return_value = 1004
+            query_ledger('queryTraintuples')
+            self.assertEqual(mcall_ledger.call_count, 1)
+
+            mtime.return_value = 1006
+            query_ledger('queryTraintuples', args=[])
+            self.assertEqual(mcall_ledger.call_count, 2)
+
+    def test_query_ledger_not_cached(self):
+        with patch('substrapp.ledger_utils.call_ledger') as mcall_ledger:
+            mcall_ledger.return_value = []
+            query_ledger('queryFilter', {'indexName': 'traintuple~worker~status'})
+            query_ledger('queryFilter', {'indexName': 'traintuple~worker~status'})
+            self.assertEqual(mcall_ledger.call_count, 2)
+
+        with patch('substrapp.ledger_utils.call_ledger') as mcall_ledger:
+            mcall_ledger.side_effect = LedgerNotFound('Not Found')
+            self.assertRaises(LedgerNotFound, query_ledger, 'queryAlgo', {'key': 'pk'})
+            self.assertRaises(LedgerNotFound, query_ledger, 'queryAlgo', {'key': 'pk'})
+            self.assertEqual(mcall_ledger.call_count, 2)
+
+    @override_settings(LEDGER_CACHE={'ENABLED': False})
+    def test_query_ledger_disabled(self):
+        with patch('substrapp.ledger_utils.call_ledger') as mcall_ledger:
+            mcall_ledger.return_value = {'key': 'pk'}
+            query_ledger('queryAlgo', {'key': 'pk'})
+            query_ledger('queryAlgo', {'key': 'pk'})
+            self.assertEqual(mcall_ledger.call_count, 2)
+
+    def test_invoke_ledger_invalidation(self):
+        with patch('substrapp.ledger_utils.call_ledger') as mcall_ledger:
+            mcall_ledger.return_value = []
+            query_ledger('queryAlgos', args=[])
+            query_ledger('queryTraintuple', {'key': 'pk'})
+
+            mcall_ledger.return_value = {'key': 'pk'}
+            invoke_ledger('registerAlgo', {'name': 'algo'})
+            invoke_ledger('logStartTrain', {'key': 'pk'})
+
+            mcall_ledger.return_value = []
+            query_ledger('queryAlgos', args=[])
+            query_ledger('queryTraintuple', {'key': 'pk'})
+
+            self.assertEqual(mcall_ledger.call_count, 6)
+
+    def test_invalidate_tuples_cache(self):
+        with patch('substrapp.ledger_utils.call_ledger') as mcall_ledger:
+            mcall_ledger.return_value = []
+            query_ledger('queryTesttuple', {'key': 'pk'})
+            query_ledger('queryTesttuples')
+            query_ledger('queryModels')
+
+            invalidate_tuples_cache('testtuple', ['pk'])
+
+            query_ledger('queryTesttuple', {'key': 'pk'})
+            query_ledger('queryTesttuples')
+            query_ledger('queryModels')
+
+            self.assertEqual(mcall_ledger.call_count, 6)
+
+    @override_settings(LEDGER_CACHE={'ENABLED': True, 'MAX_SIZE': 10})
+    def test_local_caches(self):
+        process_cache, other_process_cache = LedgerCache(), LedgerCache()
+
+        with patch('substrapp.ledger_utils.call_ledger') as mcall_ledger:
+            with patch('substrapp.ledger_utils._ledger_cache', process_cache):
+                mcall_ledger.return_value = []
+                query_ledger('queryAlgos')
+                mcall_ledger.return_value = {'key': 'pk'}
+                query_ledger('queryAlgo', {'key': 'pk'})
+
+            with patch('substrapp.ledger_utils._ledger_cache', other_process_cache):
+                invoke_ledger('registerAlgo', {'name': 'algo'})
+
+            # the invalidation of the other process is not seen: only immutable assets are cached
+            with patch('substrapp.ledger_utils._ledger_cache', process_cache):
+                mcall_ledger.return_value = [{'key': 'pk'}]
+                self.assertEqual(query_ledger('queryAlgos'), [{'key': 'pk'}])
+                mcall_ledger.return_value = {'key': 'pk'}
+                query_ledger('queryAlgo', {'key': 'pk'})
+
+            self.assertEqual(mcall_ledger.call_count, 4)
+
+    def test_lru_eviction(self):
+        cache = LedgerCache(max_size=2)
+        cache.set('a', '1', None)
+        cache.set('b', '2', None)
+        cache.get('a', None)
+        cache.set('c', '3', None)
+
+        self.assertEqual(cache.get('a', None), '1')
+        self.assertIsNone(cache.get('b', None))
+        self.assertEqual(cache.get('c', None), '3')
+
+    def test_shared_backend(self):
+        backend = caches['default']
+        backend.clear()
+
+        cache = LedgerCache(backend=backend)
+        other_process_cache = LedgerCache(backend=backend)
+
+        cache.set('a', '1', 10)
+        self.assertEqual(other_process_cache.get('a', 10), '1')
+
+        # invalidations of other processes evict the local entries
+        other_process_cache.delete('a')
+        self.assertIsNone(cache.get('a', 10))
+
+        cache.set('b', '1', 10)
+        other_process_cache.set('b', '2', 10)
+        self.assertEqual(cache.get('b', 10), '2')
+
+
+@override_settings(LEDGER_REPORTER={'ENABLED': True, 'BATCH_SIZE': 2, 'BACKOFF_BASE': 10},
+                   LEDGER={'name': 'test-org'})
+class LedgerReporterTests(TestCase):
+
+    def setUp(self):
+        # reports are submitted from the test thread, which owns the test transaction
+        self.executor = patch('substrapp.ledger_reporter.get_report_executor')
+        self.executor.start().return_value.map = map
+
+    def tearDown(self):
+        self.executor.stop()
+
+    def test_report_tuple(self):
+        with patch('substrapp.tasks.tasks.report_ledger_task.apply_async') as mapply_async, \
+                patch('substrapp.tasks.tasks.log_success_tuple') as mlog_success_tuple:
+            report_tuple('testtuple', 'testtuple_key', res={'global_perf': 0.5})
+
+            # reported without waiting for the ledger
+            mlog_success_tuple.assert_not_called()
+            mapply_async.assert_called_once_with(queue='scheduler')
+
+        report = LedgerReport.objects.get(pk='testtuple_key')
+        self.assertEqual(report.fcn, 'logSuccessTest')
+        self.assertEqual(report.get_args(), {'key': 'testtuple_key', 'perf': 0.5, 'log': ''})
+
+        with patch('substrapp.ledger_reporter.invoke_ledger') as minvoke_ledger:
+            self.assertEqual(flush_reports(), 1)
+        minvoke_ledger.assert_called_once_with(fcn='logSuccessTest', args=report.get_args(), sync=True)
+        self.assertFalse(LedgerReport.objects.exists())
+
+    @override_settings(LEDGER_REPORTER={'ENABLED': False})
+    def test_report_tuple_disabled(self):
+        with patch('substrapp.tasks.tasks.log_fail_tuple') as mlog_fail_tuple:
+            report_tuple('traintuple', 'traintuple_key', error_code='00-01-0000')
+        mlog_fail_tuple.assert_called_once_with('traintuple', 'traintuple_key', '00-01-0000')
+        self.assertFalse(LedgerReport.objects.exists())
+
+    def test_flush_reports_batches(self):
+        for i in range(5):
+            enqueue_report('traintuple', f'traintuple_{i}', 'logFailTrain', {'key': f'traintuple_{i}', 'log': ''})
+
+        with patch('substrapp.ledger_reporter.invoke_ledger') as minvoke_ledger:
+            self.assertEqual(flush_reports(), 5)
+        self.assertEqual(minvoke_ledger.call_count, 5)
+        self.assertFalse(LedgerReport.objects.exists())
+
+    def test_flush_reports_claim(self):
+        enqueue_report('traintuple', 'traintuple_key', 'logFailTrain', {'key': 'traintuple_key', 'log': ''})
+
+        # the claim of a batch covers its submission by the reporter threads
+        reports = claim_reports(2)
+        self.assertEqual(len(reports), 1)
+        claimed_at = reports[0].next_attempt_at
+        self.assertGreaterEqual(claimed_at - timezone.now(), timedelta(seconds=SUBMIT_TIMEOUT * 0.5))
+        self.assertEqual(claim_reports(2), [])
+
+        # the claim is renewed before the report is submitted
+        with patch('substrapp.ledger_reporter.invoke_ledger', side_effect=LedgerTimeout('timeout')):
+            submit_report(reports[0])
+        self.assertEqual(LedgerReport.objects.get().attempts, 1)
+
+        # a report claimed by another reporter meanwhile is not submitted
+        report = LedgerReport.objects.get()
+        LedgerReport.objects.update(next_attempt_at=timezone.now() + timedelta(seconds=SUBMIT_TIMEOUT))
+        with patch('substrapp.ledger_reporter.invoke_ledger') as minvoke_ledger:
+            submit_report(report)
+        minvoke_ledger.assert_not_called()
+
+    def test_flush_reports_replaced(self):
+        enqueue_report('traintuple', 'traintuple_key', 'logSuccessTrain', {'key': 'traintuple_key'})
+        report = claim_reports(2)[0]
+
+        def invoke_ledger(fcn, args, sync):
+            # the status is updated while the report is submitted
+            enqueue_report('traintuple', 'traintuple_key', 'logFailTrain', {'key': 'traintuple_key', 'log': ''})
+
+        with patch('substrapp.ledger_reporter.invoke_ledger', side_effect=invoke_ledger):
+            submit_report(report)
+
+        self.assertEqual(LedgerReport.objects.get().fcn, 'logFailTrain')
+
+    def test_flush_reports_retry(self):
+        enqueue_report('traintuple', 'timeout', 'logFailTrain', {'key': 'timeout', 'log': ''})
+        enqueue_report('traintuple', 'done', 'logFailTrain', {'key': 'done', 'log': ''})
+
+        def invoke_ledger(fcn, args, sync):
+            if args['key'] == 'timeout':
+                raise LedgerTimeout('timeout')
+            raise LedgerStatusError('cannot change status from done to failed')
+
+        with patch('substrapp.ledger_reporter.invoke_ledger', side_effect=invoke_ledger):
+            self.assertEqual(flush_reports(), 2)
+            # the failed report is not due yet
+            self.assertEqual(flush_reports(), 0)
+
+        # reports which cannot be applied are dropped, others are retried later
+        report = LedgerReport.objects.get()
+        self.assertEqual(report.pk, 'timeout')
+        self.assertEqual(report.attempts, 1)
+        self.assertEqual(report.last_error, 'timeout')
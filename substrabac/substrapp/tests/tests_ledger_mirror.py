@@ -0,0 +1,131 @@
+import copy
+from urllib.parse import quote
+
+from django.test import TestCase, override_settings
+from mock import patch
+
+from substrapp.ledger_mirror import sync_ledger_mirror, mirror_tuples, is_ledger_mirror_enabled
+from substrapp.serializers.ledger.algo.util import createLedgerAlgo
+from substrapp.models import AlgoMirror, TraintupleMirror, ModelMirror
+from substrapp.views.filters_utils import filter_list
+
+from .assets import objective, datamanager, algo, traintuple, testtuple, model
+
+LEDGER_ASSETS = {
+    'queryAlgos': algo,
+    'queryObjectives': objective,
+    'queryDataManagers': datamanager,
+    'queryTraintuples': traintuple,
+    'queryTesttuples': testtuple,
+    'queryModels': model,
+}
+
+OBJECT_TYPE_QUERIES = {
+    'algo': 'queryAlgos',
+    'objective': 'queryObjectives',
+    'dataset': 'queryDataManagers',
+    'traintuple': 'queryTraintuples',
+    'testtuple': 'queryTesttuples',
+    'model': 'queryModels',
+}
+
+
+def query_ledger(fcn, args=None):
+    return copy.deepcopy(LEDGER_ASSETS[fcn])
+
+
+def search(*filters):
+    return '-OR-'.join(','.join(quote(f) for f in group) for group in filters)
+
+
+class LedgerMirrorTests(TestCase):
+
+    def setUp(self):
+        with patch('substrapp.ledger_mirror.query_ledger', side_effect=query_ledger):
+            sync_ledger_mirror()
+
+    def assertSameSearch(self, object_type, *filters):
+        query_params = search(*filters)
+        with patch('substrapp.views.filters_utils.query_ledger', side_effect=query_ledger):
+            expected = filter_list(object_type, query_ledger(OBJECT_TYPE_QUERIES[object_type]), query_params)
+            mirrored = filter_list(object_type, None, query_params, use_mirror=True)
+
+        for expected_group, mirrored_group in zip(expected, mirrored):
+            self.assertEqual(sorted(x['key'] if 'key' in x else x['traintuple']['key'] for x in expected_group),
+                             sorted(x['key'] if 'key' in x else x['traintuple']['key'] for x in mirrored_group))
+        self.assertEqual(len(expected), len(mirrored))
+        return mirrored
+
+    def test_sync(self):
+        self.assertEqual(AlgoMirror.objects.count(), len(algo))
+        self.assertEqual(ModelMirror.objects.count(), len(model))
+        self.assertEqual(AlgoMirror.objects.get(key=algo[0]['key']).to_ledger(), algo[0])
+
+        # synchronizing again does not duplicate assets
+        with patch('substrapp.ledger_mirror.query_ledger', side_effect=query_ledger):
+            sync_ledger_mirror()
+        self.assertEqual(AlgoMirror.objects.count(), len(algo))
+
+    def test_filter_own_asset(self):
+        result = self.assertSameSearch('algo', ['algo:name:Logistic regression'])
+        self.assertEqual(len(result[0]), 1)
+
+        self.assertSameSearch('algo', ['algo:name:Logistic regression', f'algo:owner:{algo[0]["owner"]}'])
+        self.assertSameSearch('algo', ['algo:name:Neural Network'], ['algo:name:Random Forest'])
+        self.assertSameSearch('objective', ['objective:metrics:macro-average recall'])
+        self.assertSameSearch('dataset', ['dataset:name:ISIC 2018'])
+        self.assertSameSearch('traintuple', ['traintuple:tag:substra'])
+        self.assertSameSearch('traintuple', ['traintuple:status:done', 'traintuple:tag:'])
+        self.assertSameSearch('testtuple', ['testtuple:tag:substra'])
+
+        model_hash = model[1]['traintuple']['outModel']['hash']
+        result = self.assertSameSearch('model', [f'model:hash:{model_hash}'])
+        self.assertEqual(len(result[0]), 1)
+
+    def test_filter_other_asset(self):
+        model_hash = model[1]['traintuple']['outModel']['hash']
+        self.assertSameSearch('algo', [f'model:hash:{model_hash}'])
+        self.assertSameSearch('dataset', [f'model:hash:{model_hash}'])
+        self.assertSameSearch('objective', [f'model:hash:{model_hash}'])
+        self.assertSameSearch('objective', ['dataset:name:ISIC 2018'])
+        self.assertSameSearch('objective', ['dataset:name:Simplified ISIC 2018'])
+        self.assertSameSearch('dataset', ['objective:name:Skin Lesion Classification Objective'])
+        self.assertSameSearch('model', ['algo:name:Logistic regression'])
+        self.assertSameSearch('model', ['dataset:name:ISIC 2018'])
+        self.assertSameSearch('model', ['objective:metrics:macro-average recall'])
+
+    def test_filter_not_authorized(self):
+        with self.assertRaises(Exception):
+            filter_list('algo', None, search(['dataset:name:ISIC 2018']), use_mirror=True)
+
+    def test_filter_empty_ledger(self):
+        # an empty ledger is not searched in the mirror
+        self.assertEqual(filter_list('algo', None, search(['algo:name:Logistic regression'])), [[]])
+
+    def test_mirror_tuples(self):
+        updated_traintuple = dict(copy.deepcopy(traintuple[0]), status='done', tag='updated')
+        mirror_tuples('traintuple', [updated_traintuple])
+
+        instance = TraintupleMirror.objects.get(key=updated_traintuple['key'])
+        self.assertEqual(instance.tag, 'updated')
+        self.assertEqual(instance.to_ledger(), updated_traintuple)
+        self.assertEqual(ModelMirror.objects.get(key=updated_traintuple['key']).to_ledger()['traintuple'],
+                         updated_traintuple)
+
+    @override_settings(LEDGER_MIRROR={'ENABLED': True})
+    def test_mirror_registered_asset(self):
+        new_algo = dict(copy.deepcopy(algo[0]), key='a' * 64, name='New algo')
+
+        with patch('substrapp.serializers.ledger.utils.invoke_ledger', return_value={'pkhash': new_algo['key']}), \
+                patch('substrapp.ledger_mirror.query_ledger', return_value=new_algo) as mquery_ledger:
+            createLedgerAlgo({}, new_algo['key'], sync=True)
+
+        mquery_ledger.assert_called_once_with(fcn='queryAlgo', args={'key': new_algo['key']})
+        self.assertEqual(AlgoMirror.objects.get(key=new_algo['key']).to_ledger(), new_algo)
+        self.assertEqual(len(filter_list('algo', None, search(['algo:name:New algo']), use_mirror=True)[0]), 1)
+
+    def test_mirror_disabled_by_default(self):
+        self.assertFalse(is_ledger_mirror_enabled())
+
+        with override_settings(LEDGER_MIRROR={'ENABLED': True}):
+            self.assertTrue(is_ledger_mirror_enabled())
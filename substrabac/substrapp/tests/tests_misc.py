@@ -1,12 +1,22 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.test import TestCase, override_settings
 
 from mock import patch
-from substrapp.tasks.utils import get_cpu_sets, get_gpu_sets
+from substrapp.tasks.utils import parse_cpu_set, format_cpu_set, place_cpus, validate_resources
 
 from substrapp.ledger_utils import LedgerNotFound, LedgerBadResponse
 
 from substrapp.ledger_utils import get_object_from_ledger, log_fail_tuple, log_start_tuple, \
     log_success_tuple, query_tuples
+from substrapp.upload import HashingFileUploadHandler
+from substrapp.utils import get_hash
+
+MEDIA_ROOT = tempfile.mkdtemp()
 
 
 class MockDevice():
@@ -22,18 +32,37 @@ class MiscTests(TestCase):
     """Misc tests"""
 
     def test_cpu_sets(self):
-        cpu_count = 16
-        for concurrency in range(1, cpu_count + 1, 1):
-            self.assertEqual(concurrency,
-                             len(get_cpu_sets(cpu_count, concurrency)))
-
-    def test_gpu_sets(self):
-        gpu_list = ['0', '1']
-        for concurrency in range(1, len(gpu_list) + 1, 1):
-            self.assertEqual(concurrency,
-                             len(get_gpu_sets(gpu_list, concurrency)))
-
-        self.assertFalse(get_gpu_sets([], concurrency))
+        self.assertEqual(parse_cpu_set('0-3,8,10-11'), {0, 1, 2, 3, 8, 10, 11})
+        self.assertEqual(format_cpu_set({0, 1, 2, 3, 8, 10, 11}), '0-3,8,10-11')
+        self.assertEqual(parse_cpu_set(''), set())
+
+    def test_place_cpus(self):
+        numa_nodes = [{0, 1, 2, 3}, {4, 5, 6, 7}]
+        usage = {cpu: 0. for cpu in range(8)}
+
+        # whole cpus are taken in a single NUMA node
+        self.assertEqual(place_cpus(2, usage, numa_nodes), {0, 1})
+        usage.update({0: 1., 1: 1., 2: 1.})
+        self.assertEqual(place_cpus(2, usage, numa_nodes), {4, 5})
+        # the node with the least free cpus which can hold the request is preferred
+        self.assertEqual(place_cpus(1, usage, numa_nodes), {3})
+        # spread over nodes when no node can hold the request
+        usage.update({4: 1.})
+        self.assertEqual(place_cpus(4, usage, numa_nodes), {3, 5, 6, 7})
+        self.assertIsNone(place_cpus(5, usage, numa_nodes))
+
+        # fractional requests share the most used cpu they fit in
+        usage.update({3: 0.5, 5: 0.25})
+        self.assertEqual(place_cpus(0.5, usage, numa_nodes), {3})
+        self.assertEqual(place_cpus(0.75, usage, numa_nodes), {5})
+        self.assertEqual(place_cpus(1.5, usage, numa_nodes), {6, 7})
+
+    def test_validate_resources(self):
+        self.assertEqual(validate_resources({'cpu': 0.5, 'memory_mb': 512, 'gpu': 0}),
+                         {'cpu': 0.5, 'memory_mb': 512, 'gpu': 0})
+        for resources in ({'cpu': 0}, {'memory_mb': 'a lot'}, {'gpu': -1}, {'disk': 10}):
+            with self.assertRaises(Exception):
+                validate_resources(resources)
 
     def test_get_object_from_ledger(self):
         with patch('substrapp.ledger_utils.query_ledger') as mquery_ledger:
@@ -94,3 +123,31 @@ class MiscTests(TestCase):
         with patch('substrapp.ledger_utils.query_ledger') as mquery_ledger:
             mquery_ledger.return_value = None
             query_tuples('testtuple', 'data_owner')
+
+    @override_settings(MEDIA_ROOT=MEDIA_ROOT, UPLOAD={'CHUNK_SIZE': 16})
+    def test_hashing_upload_handler(self):
+        content = os.urandom(100)
+
+        handler = HashingFileUploadHandler()
+        handler.new_file('file', 'algo.tar.gz', 'application/gzip', len(content))
+        for start in range(0, len(content), handler.chunk_size):
+            handler.receive_data_chunk(content[start:start + handler.chunk_size], start)
+        uploaded_file = handler.file_complete(len(content))
+
+        try:
+            upload_path = uploaded_file.temporary_file_path()
+            self.assertEqual(os.path.dirname(upload_path), os.path.join(MEDIA_ROOT, 'uploads'))
+
+            # the uploaded file is not read again
+            with patch('substrapp.utils.file_hash') as mfile_hash:
+                self.assertEqual(get_hash(uploaded_file), hashlib.sha256(content).hexdigest())
+                self.assertFalse(mfile_hash.called)
+            self.assertEqual(get_hash(uploaded_file, 'key'), hashlib.sha256(content + b'key').hexdigest())
+
+            # moved to its final location
+            inode = os.stat(upload_path).st_ino
+            name = FileSystemStorage(location=MEDIA_ROOT).save('algos/algo.tar.gz', uploaded_file)
+            self.assertEqual(os.stat(os.path.join(MEDIA_ROOT, name)).st_ino, inode)
+        finally:
+            uploaded_file.close()
+            shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+
+import mock
+from checksumdir import dirhash
+from django.test import TestCase, override_settings
+
+from substrapp.dirhash import compute_dirhash, verify_dirhash
+from substrapp.storage import store_data_sample_directory, probe_strategy, LINK, COPY, REFERENCE, _strategies, \
+    store_directory as _store_directory
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class StorageTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, 'sub'))
+        for i in range(10):
+            with open(os.path.join(self.directory, 'sub' if i % 2 else '', f'{i}.csv'), 'wb') as f:
+                f.write(os.urandom(i * 100))
+        self.pkhash = dirhash(self.directory, 'sha256')
+        # files are not modified during the test
+        self.racy_delay = mock.patch('substrapp.dirhash.RACY_DELAY', -60)
+        self.racy_delay.start()
+        _strategies.clear()
+
+    def tearDown(self):
+        self.racy_delay.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def assertStored(self, strategy):
+        compute_dirhash(self.directory)
+
+        data_path, used_strategy = store_data_sample_directory(self.directory, self.pkhash)
+
+        self.assertEqual(used_strategy, strategy)
+        self.assertEqual(data_path, os.path.join(MEDIA_ROOT, 'datasamples', self.pkhash))
+        self.assertEqual(dirhash(data_path, 'sha256'), self.pkhash)
+        # stored files are not hashed again
+        with mock.patch('substrapp.dirhash.file_hash') as mfile_hash:
+            self.assertTrue(verify_dirhash(data_path, self.pkhash))
+            self.assertFalse(mfile_hash.called)
+        return data_path
+
+    @override_settings(DATA_SAMPLE_STORAGE={'STRATEGIES': [LINK]})
+    def test_store_link(self):
+        data_path = self.assertStored(LINK)
+        self.assertEqual(os.stat(os.path.join(data_path, '0.csv')).st_ino,
+                         os.stat(os.path.join(self.directory, '0.csv')).st_ino)
+
+    @override_settings(DATA_SAMPLE_STORAGE={'STRATEGIES': [COPY], 'WORKERS': 2, 'PARALLEL_MIN_FILES': 1})
+    def test_store_copy(self):
+        data_path = self.assertStored(COPY)
+        self.assertNotEqual(os.stat(os.path.join(data_path, '0.csv')).st_ino,
+                            os.stat(os.path.join(self.directory, '0.csv')).st_ino)
+
+    def test_store_reference(self):
+        with override_settings(DATA_SAMPLE_STORAGE={'STRATEGIES': []}):
+            data_path, strategy = store_data_sample_directory(self.directory, self.pkhash)
+        self.assertEqual((data_path, strategy), (self.directory, REFERENCE))
+        self.assertFalse(os.path.exists(os.path.join(MEDIA_ROOT, 'datasamples', self.pkhash)))
+
+    @override_settings(DATA_SAMPLE_STORAGE={'STRATEGIES': [COPY]})
+    def test_store_modified(self):
+        compute_dirhash(self.directory)
+
+        def store_directory(src_directory, dst_directory):
+            # modified once its hashes are read, before being copied
+            with open(os.path.join(src_directory, '0.csv'), 'wb') as f:
+                f.write(b'modified')
+            return _store_directory(src_directory, dst_directory)
+
+        with mock.patch('substrapp.storage.store_directory', side_effect=store_directory):
+            with self.assertRaises(Exception) as cm:
+                store_data_sample_directory(self.directory, self.pkhash)
+
+        self.assertIn('modified while stored', str(cm.exception))
+        self.assertFalse(os.path.exists(os.path.join(MEDIA_ROOT, 'datasamples', self.pkhash)))
+
+    def test_probe_strategy(self):
+        src_file = os.path.join(self.directory, '0.csv')
+        dst_directory = os.path.join(MEDIA_ROOT, 'datasamples')
+
+        # the first supported strategy is probed once
+        with mock.patch('substrapp.storage.reflink', side_effect=OSError('not supported')) as mreflink:
+            self.assertEqual(probe_strategy(src_file, dst_directory), LINK)
+            self.assertEqual(probe_strategy(src_file, dst_directory), LINK)
+        self.assertEqual(mreflink.call_count, 1)
+        self.assertEqual(os.listdir(dst_directory), [])
@@ -1,26 +1,41 @@
+import glob
 import os
+import re
 import shutil
+import socket
 import mock
 import uuid
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock
 
 from django.test import override_settings
 from rest_framework import status
 from rest_framework.test import APITestCase
-from django_celery_results.models import TaskResult
 
-from substrapp.models import DataSample
+from substrapp.models import DataSample, ComputePlanWorker
 from substrapp.ledger_utils import LedgerStatusError
 from substrapp.utils import store_datasamples_archive
-from substrapp.utils import compute_hash, get_remote_file_content, get_hash, create_directory
-from substrapp.tasks.utils import ResourcesManager, compute_docker
-from substrapp.tasks.tasks import (build_subtuple_folders, get_algo, get_model, get_models, get_objective, put_opener,
+from substrapp.utils import (compute_hash, get_remote_file, get_remote_file_content, get_remote_file_path, get_hash,
+                             get_remote_session, create_directory, NodeError)
+from substrapp.tasks.utils import ResourcesManager, compute_docker, get_asset_path, release_asset_path
+from substrapp.tasks.asset_cache import get_cached_asset, get_cached_asset_path, evict_cached_assets
+from substrapp.tasks.image_cache import get_cached_image, get_image_name, evict_cached_images
+from substrapp.tasks.metrics_pool import evaluate_in_pool, sweep_idle_containers, remove_orphan_containers, \
+    POOL_LABEL, POOL_HOST_LABEL
+from substrapp.tasks.pipeline import PipelineManager, pipeline_stage
+from substrapp.tasks.routing import get_worker_queue, release_compute_plan_worker
+from substrapp.tasks.workspace import (get_workspace_directory, get_workspace_model_path, add_workspace_model,
+                                       remove_workspace)
+from substrapp.tasks.tasks import (build_subtuple_folders, get_algo, _get_model, get_objective, put_opener,
                                    put_model, put_models, put_algo, put_metric, put_data_sample, prepare_task, do_task,
-                                   compute_task, remove_subtuple_materials, prepare_materials)
+                                   compute_task, remove_subtuple_materials, prepare_materials, get_resources,
+                                   prefetch_materials, prepare_tuple_image, save_model)
 
 from .common import (get_sample_algo, get_sample_script, get_sample_zip_data_sample, get_sample_tar_data_sample,
                      get_sample_model)
-from .common import FakeObjective, FakeDataManager, FakeModel, FakeRequest
+from .common import FakeObjective, FakeDataManager, FakeModel, FakeRequest, fake_remote_file_path
 from . import assets
 from node.models import OutgoingNode
 
@@ -84,34 +99,148 @@ class TasksTests(APITestCase):
                        }
 
         with mock.patch('substrapp.utils.get_owner') as get_owner,\
-                mock.patch('substrapp.utils.requests.get') as request_get:
+                mock.patch('substrapp.utils.requests.Session.get') as request_get:
             get_owner.return_value = 'external_node_id'
             request_get.return_value = FakeRequest(content=content, status=status.HTTP_200_OK)
 
-            content_remote = get_remote_file_content(remote_file, 'external_node_id', pkhash)
+            content_remote = get_remote_file_content(remote_file['storageAddress'], 'external_node_id', pkhash)
             self.assertEqual(content_remote, content)
 
         with mock.patch('substrapp.utils.get_owner') as get_owner,\
-                mock.patch('substrapp.utils.requests.get') as request_get:
+                mock.patch('substrapp.utils.requests.Session.get') as request_get:
             get_owner.return_value = 'external_node_id'
             request_get.return_value = FakeRequest(content=content, status=status.HTTP_200_OK)
 
             with self.assertRaises(Exception):
                 # contents (by pkhash) are different
-                get_remote_file_content(remote_file, 'external_node_id', 'fake_pkhash')
+                get_remote_file_content(remote_file['storageAddress'], 'external_node_id', 'fake_pkhash')
+
+    @override_settings(NODE_HTTP_CLIENT={'POOL_MAXSIZE': 4, 'RETRIES': 2, 'CONNECT_TIMEOUT': 1, 'READ_TIMEOUT': 2})
+    def test_get_remote_session(self):
+        session = get_remote_session('http://node-1:8000/algo/pk/file/')
+
+        self.assertIs(get_remote_session('http://node-1:8000/model/pk/file/'), session)
+        self.assertIsNot(get_remote_session('http://node-2:8000/algo/pk/file/'), session)
+
+        adapter = session.get_adapter('http://node-1:8000/')
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 2)
+
+        with mock.patch('substrapp.utils.requests.Session.get') as request_get:
+            get_remote_file('http://node-1:8000/algo/pk/file/', None)
+            self.assertEqual(request_get.call_args[1]['timeout'], (1, 2))
+
+    def test_get_remote_file_path(self):
+        content = self.model.read().encode()
+        salt = 'traintuple_key'
+        content_hash = compute_hash(content, salt)
+        dst_path = os.path.join(self.subtuple_path, 'model.bin')
+
+        with mock.patch('substrapp.utils.requests.Session.get') as request_get, \
+                mock.patch('substrapp.utils.DOWNLOAD_CHUNK_SIZE', 4):
+            request_get.return_value = FakeRequest(content=content, status=status.HTTP_200_OK)
+
+            self.assertEqual(get_remote_file_path('localhost', None, content_hash, dst_path, salt=salt), dst_path)
+            self.assertTrue(request_get.call_args[1]['stream'])
+
+        with open(dst_path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        os.remove(dst_path)
+
+        with mock.patch('substrapp.utils.requests.Session.get') as request_get:
+            request_get.return_value = FakeRequest(content=content, status=status.HTTP_200_OK)
+
+            with self.assertRaises(NodeError):
+                # the hash is not salted
+                get_remote_file_path('localhost', None, compute_hash(content), dst_path, salt=salt)
+
+        # corrupted files are removed
+        self.assertEqual([f for f in os.listdir(self.subtuple_path) if f.startswith('.download')], [])
+        self.assertFalse(os.path.exists(dst_path))
 
     def test_Ressource_Manager(self):
 
         self.assertTrue(isinstance(self.ResourcesManager.memory_limit_mb(), int))
 
-        cpu_set, gpu_set = self.ResourcesManager.get_cpu_gpu_sets()
-        self.assertIn(cpu_set, self.ResourcesManager._ResourcesManager__cpu_sets)
+        allocation = self.ResourcesManager.allocate('container')
+        self.ResourcesManager.release('container')
+        self.assertTrue(allocation['cpu_set'])
+        self.assertEqual(allocation['memory_mb'], self.ResourcesManager.memory_limit_mb())
 
-        if gpu_set is not None:
-            self.assertIn(gpu_set, self.ResourcesManager._ResourcesManager__gpu_sets)
+        with self.assertRaises(Exception):
+            self.ResourcesManager.allocate('container', {'cpu': os.cpu_count() + 1})
+
+    def test_Ressource_Manager_wait_release(self):
+        with mock.patch.object(ResourcesManager, '_ResourcesManager__docker') as mdocker, \
+                mock.patch.object(ResourcesManager, 'host_memory_mb', return_value=1024):
+            mdocker.containers.list.return_value = []
+
+            # memory is requested by containers
+            self.ResourcesManager.allocate('container_0', {'cpu': 0.1, 'memory_mb': 512})
+            self.ResourcesManager.allocate('container_1', {'cpu': 0.1, 'memory_mb': 512})
+
+            # all memory is allocated, wait for a release without polling docker
+            list_calls = mdocker.containers.list.call_count
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(self.ResourcesManager.allocate, 'container_2', {'cpu': 0.1,
+                                                                                         'memory_mb': 256})
+                time.sleep(0.1)
+                self.assertFalse(future.done())
+
+                self.ResourcesManager.release('container_0')
+                allocation = future.result(timeout=5)
+                self.assertEqual(allocation['memory_mb'], 256)
+                self.assertEqual(allocation['nano_cpus'], int(0.1 * 1e9))
+
+            self.assertEqual(mdocker.containers.list.call_count, list_calls)
+
+            for i in range(3):
+                self.ResourcesManager.release(f'container_{i}')
+
+    def test_Ressource_Manager_reconcile(self):
+        cpu_count = os.cpu_count()
+
+        with mock.patch.object(ResourcesManager, '_ResourcesManager__docker') as mdocker, \
+                mock.patch.object(ResourcesManager, '_ResourcesManager__reconciled_at', 0), \
+                mock.patch('substrapp.tasks.utils.LEASE_GRACE_PERIOD', -1):
+            # a container started by another process uses the first cpu
+            container = MagicMock()
+            container.name = 'other_container'
+            container.status = 'running'
+            container.attrs = {'HostConfig': {'CpusetCpus': '0', 'Memory': 0}, 'Config': {'Env': []}}
+            mdocker.containers.list.return_value = [container]
+
+            allocations = [self.ResourcesManager.allocate(f'container_{i}', {'cpu': 1, 'memory_mb': 1})
+                           for i in range(cpu_count - 1)]
+            self.assertNotIn('0', [allocation['cpu_set'] for allocation in allocations])
+
+            # containers of the leases do not exist and the other container exited
+            container.status = 'exited'
+            ResourcesManager._ResourcesManager__reconciled_at = 0
+            self.ResourcesManager.allocate('container', {'cpu': cpu_count, 'memory_mb': 1})
+            self.assertEqual(list(ResourcesManager._ResourcesManager__leases.keys()), ['container'])
+
+            self.ResourcesManager.release('container')
+
+    @override_settings(TASK={'RESOURCES': {'metrics': {'cpu': 0.5, 'memory_mb': 1024}}})
+    def test_get_resources(self):
+        self.assertEqual(get_resources(self.subtuple_path, 'train'), {})
+        self.assertEqual(get_resources(self.subtuple_path, 'metrics'), {'cpu': 0.5, 'memory_mb': 1024})
+
+        # declared by the archive
+        with open(os.path.join(self.subtuple_path, 'resources.json'), 'w') as f:
+            f.write('{"memory_mb": 512}')
+        self.assertEqual(get_resources(self.subtuple_path, 'metrics'), {'cpu': 0.5, 'memory_mb': 512})
+
+        with open(os.path.join(self.subtuple_path, 'resources.json'), 'w') as f:
+            f.write('[4]')
+        with self.assertRaises(Exception):
+            get_resources(self.subtuple_path, 'train')
 
     def test_put_algo_tar(self):
-        algo_content = self.algo.read()
+        algo_path = os.path.join(self.subtuple_path, self.algo_filename)
+        with open(algo_path, 'wb') as f:
+            f.write(self.algo.read())
         subtuple_key = get_hash(self.algo)
 
         subtuple = {'key': subtuple_key,
@@ -119,7 +248,7 @@ class TasksTests(APITestCase):
 
         with mock.patch('substrapp.tasks.tasks.get_hash') as mget_hash:
             mget_hash.return_value = subtuple_key
-            put_algo(os.path.join(self.subtuple_path, f'subtuple/{subtuple["key"]}/'), algo_content)
+            put_algo(os.path.join(self.subtuple_path, f'subtuple/{subtuple["key"]}/'), algo_path)
 
         self.assertTrue(os.path.exists(os.path.join(self.subtuple_path, f'subtuple/{subtuple["key"]}/algo.py')))
         self.assertTrue(os.path.exists(os.path.join(self.subtuple_path, f'subtuple/{subtuple["key"]}/Dockerfile')))
@@ -141,9 +270,8 @@ class TasksTests(APITestCase):
         subtuple = {'key': subtuple_key, 'algo': 'testalgo'}
 
         with mock.patch('substrapp.tasks.tasks.get_hash') as mget_hash:
-            with open(zippath, 'rb') as content:
-                mget_hash.return_value = get_hash(zippath)
-                put_algo(os.path.join(self.subtuple_path, f'subtuple/{subtuple["key"]}/'), content.read())
+            mget_hash.return_value = get_hash(zippath)
+            put_algo(os.path.join(self.subtuple_path, f'subtuple/{subtuple["key"]}/'), zippath)
 
         self.assertTrue(os.path.exists(os.path.join(self.subtuple_path, f'subtuple/{subtuple["key"]}/{filename}')))
 
@@ -164,9 +292,8 @@ class TasksTests(APITestCase):
         create_directory(metrics_directory)
 
         with mock.patch('substrapp.tasks.tasks.get_hash') as mget_hash:
-            with open(zippath, 'rb') as content:
-                mget_hash.return_value = 'hash_value'
-                put_metric(metrics_directory, content.read())
+            mget_hash.return_value = 'hash_value'
+            put_metric(metrics_directory, zippath)
 
         self.assertTrue(os.path.exists(os.path.join(metrics_directory, 'metrics.py')))
 
@@ -312,7 +439,10 @@ class TasksTests(APITestCase):
 
         model_directory = os.path.join(self.subtuple_path, 'model')
         create_directory(model_directory)
-        put_model(subtuple, self.subtuple_path, model_content)
+        downloaded_model_path = os.path.join(self.subtuple_path, 'downloaded_model')
+        with open(downloaded_model_path, 'wb') as f:
+            f.write(model_content)
+        put_model(subtuple, self.subtuple_path, downloaded_model_path)
 
         model_path = os.path.join(model_directory, traintupleKey)
         self.assertTrue(os.path.exists(model_path))
@@ -327,24 +457,47 @@ class TasksTests(APITestCase):
             mget.return_value = FakeModel(model_path + '-local')
             with self.assertRaises(Exception):
                 put_model({'model': {'hash': model_hash, 'traintupleKey': traintupleKey}},
-                          self.subtuple_path, model_content)
+                          self.subtuple_path, downloaded_model_path)
 
         os.remove(model_path)
 
         with mock.patch('substrapp.models.Model.objects.get') as mget:
             mget.return_value = FakeModel(model_path + '-local')
-            put_model(subtuple, self.subtuple_path, model_content)
+            put_model(subtuple, self.subtuple_path, downloaded_model_path)
             self.assertTrue(os.path.exists(model_path))
 
         with mock.patch('substrapp.models.Model.objects.get') as mget:
             mget.return_value = FakeModel(model_path)
             with self.assertRaises(Exception):
                 put_model({'model': {'hash': 'fail-hash', 'traintupleKey': traintupleKey}},
-                          self.subtuple_path, model_content)
+                          self.subtuple_path, downloaded_model_path)
 
         with self.assertRaises(Exception):
             put_model(subtuple, self.subtuple_path, None)
 
+    def test_get_model_local(self):
+        subtuple_directory = build_subtuple_folders({'key': 'traintuple_key'})
+        with open(os.path.join(subtuple_directory, 'model/model'), 'w') as f:
+            f.write('MODEL')
+        model_hash = get_hash(os.path.join(subtuple_directory, 'model/model'), 'traintuple_key')
+
+        with mock.patch('substrapp.tasks.tasks.reverse', return_value='/model/'), \
+                override_settings(DEFAULT_DOMAIN='http://testserver'):
+            save_model(subtuple_directory, 'traintuple_key')
+
+        # the model trained on this node is neither queried nor downloaded
+        with mock.patch('substrapp.tasks.tasks.get_object_from_ledger') as mget_object_from_ledger, \
+                mock.patch('substrapp.tasks.tasks.get_asset_path') as mget_asset_path:
+            model_path = _get_model({'hash': model_hash, 'traintupleKey': 'traintuple_key'})
+        self.assertFalse(mget_object_from_ledger.called)
+        self.assertFalse(mget_asset_path.called)
+        self.assertEqual(os.stat(model_path).st_ino,
+                         os.stat(os.path.join(subtuple_directory, 'model/model')).st_ino)
+
+        # local models are not released as downloads
+        release_asset_path(model_path)
+        self.assertTrue(os.path.exists(model_path))
+
     def test_put_models(self):
 
         model_content = self.model.read().encode()
@@ -366,7 +519,12 @@ class TasksTests(APITestCase):
         model_directory = os.path.join(self.subtuple_path, 'model/')
 
         create_directory(model_directory)
-        put_models(subtuple, self.subtuple_path, models_content)
+        downloaded_models_path = []
+        for i, content in enumerate(models_content):
+            downloaded_models_path.append(os.path.join(self.subtuple_path, f'downloaded_model_{i}'))
+            with open(downloaded_models_path[-1], 'wb') as f:
+                f.write(content)
+        put_models(subtuple, self.subtuple_path, downloaded_models_path)
 
         self.assertTrue(os.path.exists(model_path))
         self.assertTrue(os.path.exists(model_path2))
@@ -376,7 +534,7 @@ class TasksTests(APITestCase):
 
         with mock.patch('substrapp.models.Model.objects.get') as mget:
             mget.side_effect = [FakeModel(model_path + '-local'), FakeModel(model_path2 + '-local')]
-            put_models(subtuple, self.subtuple_path, models_content)
+            put_models(subtuple, self.subtuple_path, downloaded_models_path)
 
             self.assertTrue(os.path.exists(model_path))
             self.assertTrue(os.path.exists(model_path2))
@@ -384,7 +542,7 @@ class TasksTests(APITestCase):
         with mock.patch('substrapp.models.Model.objects.get') as mget:
             mget.return_value = FakeModel(model_path)
             with self.assertRaises(Exception):
-                put_models({'inModels': [{'hash': 'hash'}]}, self.subtuple_path, model_content)
+                put_models({'inModels': [{'hash': 'hash'}]}, self.subtuple_path, downloaded_models_path)
 
         with self.assertRaises(Exception):
             put_models({'model': {'hash': 'fail-hash'}}, self.subtuple_path, None)
@@ -393,44 +551,21 @@ class TasksTests(APITestCase):
         model_content = self.model.read().encode()
         traintupleKey = compute_hash(model_content)
         model_hash = compute_hash(model_content, traintupleKey)
-        model_type = 'model'
-        subtuple = {model_type: {'hash': model_hash, 'traintupleKey': traintupleKey}}
+        model = {'hash': model_hash, 'traintupleKey': traintupleKey}
 
-        with mock.patch('substrapp.tasks.utils.get_remote_file_content') as mget_remote_file, \
+        with mock.patch('substrapp.tasks.utils.get_remote_file_path') as mget_remote_file, \
                 mock.patch('substrapp.tasks.utils.get_owner') as mget_owner,\
                 mock.patch('substrapp.tasks.tasks.get_object_from_ledger') as mget_object_from_ledger:
-            mget_remote_file.return_value = model_content
+            mget_remote_file.side_effect = fake_remote_file_path(model_content)
             mget_owner.return_value = assets.traintuple[1]['creator']
             mget_object_from_ledger.return_value = assets.traintuple[1]  # uses index 1 to have a set value of outModel
-            model_content = get_model(subtuple)
-
-        self.assertIsNotNone(model_content)
-
-        self.assertIsNone(get_model({}))
-
-    def test_get_models(self):
-        model_content = self.model.read().encode()
-        models_content = [model_content, model_content + b', -2.0']
-
-        traintupleKey = compute_hash(models_content[0])
-        model_hash = compute_hash(models_content[0], traintupleKey)
-
-        traintupleKey2 = compute_hash(models_content[1])
-        model_hash2 = compute_hash(models_content[1], traintupleKey2)
-
-        model_type = 'inModels'
-        subtuple = {model_type: [{'hash': model_hash, 'traintupleKey': traintupleKey},
-                                 {'hash': model_hash2, 'traintupleKey': traintupleKey2}]}
-
-        with mock.patch('substrapp.tasks.utils.get_remote_file_content') as mget_remote_file, \
-                mock.patch('substrapp.tasks.utils.authenticate_worker'),\
-                mock.patch('substrapp.tasks.tasks.get_object_from_ledger'):
-            mget_remote_file.side_effect = (models_content[0], models_content[1])
-            models_content_res = get_models(subtuple)
+            model_path = _get_model(model)
 
-        self.assertEqual(models_content_res, models_content)
+        with open(model_path, 'rb') as f:
+            self.assertEqual(f.read(), model_content)
 
-        self.assertEqual(len(get_models({})), 0)
+        release_asset_path(model_path)
+        self.assertFalse(os.path.exists(model_path))
 
     def test_get_algo(self):
         algo_content = self.algo.read()
@@ -443,15 +578,16 @@ class TasksTests(APITestCase):
             }
         }
 
-        with mock.patch('substrapp.tasks.utils.get_remote_file_content') as mget_remote_file,\
+        with mock.patch('substrapp.tasks.utils.get_remote_file_path') as mget_remote_file,\
                 mock.patch('substrapp.tasks.utils.get_owner') as get_owner,\
                 mock.patch('substrapp.tasks.tasks.get_object_from_ledger') as get_object_from_ledger:
-            mget_remote_file.return_value = algo_content
+            mget_remote_file.side_effect = fake_remote_file_path(algo_content)
             get_owner.return_value = assets.algo[0]['owner']
             get_object_from_ledger.return_value = assets.algo[0]
 
-            data = get_algo(subtuple)
-            self.assertEqual(algo_content, data)
+            algo_path = get_algo(subtuple)
+            with open(algo_path, 'rb') as f:
+                self.assertEqual(algo_content, f.read())
 
     def test_get_objective(self):
         metrics_content = self.script.read().encode('utf-8')
@@ -463,22 +599,23 @@ class TasksTests(APITestCase):
 
             objective = get_objective({'objective': {'hash': objective_hash,
                                                      'metrics': ''}})
-            self.assertTrue(isinstance(objective, bytes))
-            self.assertEqual(objective, b'foo')
+            self.assertEqual(objective, 'path')
 
-        with mock.patch('substrapp.tasks.utils.get_remote_file_content') as mget_remote_file, \
+        with mock.patch('substrapp.tasks.utils.get_remote_file_path') as mget_remote_file, \
                 mock.patch('substrapp.tasks.tasks.get_object_from_ledger'), \
                 mock.patch('substrapp.tasks.utils.authenticate_worker'),\
                 mock.patch('substrapp.models.Objective.objects.update_or_create') as mupdate_or_create:
 
             mget.return_value = FakeObjective()
-            mget_remote_file.return_value = metrics_content
+            mget_remote_file.side_effect = fake_remote_file_path(metrics_content)
             mupdate_or_create.return_value = FakeObjective(), True
 
             objective = get_objective({'objective': {'hash': objective_hash,
                                                      'metrics': ''}})
-            self.assertTrue(isinstance(objective, bytes))
-            self.assertEqual(objective, b'foo')
+            self.assertEqual(objective, 'path')
+
+        # the downloaded metrics have been stored and released
+        self.assertEqual(os.listdir(os.path.join(MEDIA_ROOT, 'asset_downloads')), [])
 
     def test_compute_docker(self):
         cpu_set, gpu_set = None, None
@@ -531,18 +668,16 @@ class TasksTests(APITestCase):
         subtuple = [{'key': 'subtuple_test', 'computePlanID': 'flkey'}]
 
         with mock.patch('substrapp.tasks.tasks.settings') as msettings, \
-                mock.patch.object(TaskResult.objects, 'filter') as mtaskresult, \
                 mock.patch('substrapp.tasks.tasks.get_hash') as mget_hash, \
                 mock.patch('substrapp.tasks.tasks.query_tuples') as mquery_tuples, \
                 mock.patch('substrapp.tasks.tasks.get_objective') as mget_objective, \
                 mock.patch('substrapp.tasks.tasks.get_algo') as mget_algo, \
-                mock.patch('substrapp.tasks.tasks.get_model') as mget_model, \
+                mock.patch('substrapp.tasks.tasks._get_model') as mget_model, \
                 mock.patch('substrapp.tasks.tasks.build_subtuple_folders') as mbuild_subtuple_folders, \
                 mock.patch('substrapp.tasks.tasks.put_opener') as mput_opener, \
                 mock.patch('substrapp.tasks.tasks.put_data_sample') as mput_data_sample, \
                 mock.patch('substrapp.tasks.tasks.put_metric') as mput_metric, \
                 mock.patch('substrapp.tasks.tasks.put_algo') as mput_algo, \
-                mock.patch('substrapp.tasks.tasks.json.loads') as mjson_loads, \
                 mock.patch('substrapp.tasks.tasks.AsyncResult') as masyncres, \
                 mock.patch('substrapp.tasks.tasks.put_model') as mput_model, \
                 mock.patch('substrapp.tasks.tasks.get_owner') as get_owner:
@@ -551,8 +686,8 @@ class TasksTests(APITestCase):
             mget_hash.return_value = 'owkinhash'
             mquery_tuples.return_value = subtuple
             mget_objective.return_value = 'objective'
-            mget_algo.return_value = 'algo', 'algo_hash'
-            mget_model.return_value = 'model', 'model_hash'
+            mget_algo.return_value = 'algo'
+            mget_model.return_value = 'model'
             mbuild_subtuple_folders.return_value = MEDIA_ROOT
             mput_opener.return_value = 'opener'
             mput_data_sample.return_value = 'data'
@@ -563,11 +698,8 @@ class TasksTests(APITestCase):
 
             masyncres.return_value.state = 'PENDING'
 
-            mock_filter = MagicMock()
-            mock_filter.count.return_value = 1
-            mtaskresult.return_value = mock_filter
-
-            mjson_loads.return_value = {'worker': 'worker'}
+            # the compute plan runs on the worker of its first tuple
+            ComputePlanWorker.objects.create(compute_plan_id='flkey', worker='worker')
 
             with mock.patch('substrapp.tasks.tasks.log_start_tuple') as mlog_start_tuple:
                 mlog_start_tuple.side_effect = LedgerStatusError('Bad Response')
@@ -578,6 +710,27 @@ class TasksTests(APITestCase):
                 mlog_start_tuple.return_value = 'data', 201
                 mapply_async.return_value = 'do_task'
                 prepare_task('traintuple')
+                self.assertEqual(mapply_async.call_args[1]['queue'], 'worker')
+
+    def test_compute_plan_worker(self):
+        subtuple = {'key': 'subtuple_key', 'computePlanID': 'compute_plan_id', 'rank': 0}
+        self.assertEqual(get_worker_queue(subtuple), 'test-org.worker')
+
+        compute_task.push_request(hostname='celery@worker_0', delivery_info={'routing_key': 'worker_0'})
+        try:
+            with mock.patch('substrapp.tasks.tasks.prepare_materials'), \
+                    mock.patch('substrapp.tasks.tasks.do_task'), \
+                    mock.patch('substrapp.tasks.tasks.report_tuple'):
+                compute_task.run('traintuple', subtuple, 'compute_plan_id')
+        finally:
+            compute_task.pop_request()
+
+        self.assertEqual(get_worker_queue(subtuple), 'worker_0')
+        self.assertEqual(get_worker_queue({'key': 'other_key'}), 'test-org.worker')
+
+        # the worker is released once the last rank ends
+        release_compute_plan_worker('compute_plan_id')
+        self.assertEqual(get_worker_queue(subtuple), 'test-org.worker')
 
     def test_do_task(self):
 
@@ -609,10 +762,15 @@ class TasksTests(APITestCase):
             with open(os.path.join(subtuple_directory, 'model/model'), 'w') as f:
                 f.write("MODEL")
 
-            with mock.patch('substrapp.tasks.tasks.compute_docker') as mcompute_docker:
+            with mock.patch('substrapp.tasks.tasks.compute_docker') as mcompute_docker, \
+                    mock.patch('substrapp.tasks.tasks.prepare_image') as mprepare_image:
                 mcompute_docker.return_value = 'DONE'
                 do_task(subtuple, 'traintuple')
 
+                # the algo image is built in the build stage of the pipeline
+                self.assertEqual(mprepare_image.call_args_list[0][0][2], 'substra/algo_test_owk')
+                self.assertFalse(mcompute_docker.call_args_list[0][1]['build'])
+
     def test_compute_task(self):
 
         class FakeSettings(object):
@@ -682,7 +840,7 @@ class TasksTests(APITestCase):
                 mock.patch('substrapp.tasks.tasks.query_tuples') as mquery_tuples, \
                 mock.patch('substrapp.tasks.tasks.get_objective') as mget_objective, \
                 mock.patch('substrapp.tasks.tasks.get_algo') as mget_algo, \
-                mock.patch('substrapp.tasks.tasks.get_model') as mget_model, \
+                mock.patch('substrapp.tasks.tasks._get_model') as mget_model, \
                 mock.patch('substrapp.tasks.tasks.build_subtuple_folders') as mbuild_subtuple_folders, \
                 mock.patch('substrapp.tasks.tasks.put_opener') as mput_opener, \
                 mock.patch('substrapp.tasks.tasks.put_data_sample') as mput_data_sample, \
@@ -694,8 +852,8 @@ class TasksTests(APITestCase):
             mget_hash.return_value = 'owkinhash'
             mquery_tuples.return_value = subtuple, 200
             mget_objective.return_value = 'objective'
-            mget_algo.return_value = 'algo', 'algo_hash'
-            mget_model.return_value = 'model', 'model_hash'
+            mget_algo.return_value = 'algo'
+            mget_model.return_value = 'model'
             mbuild_subtuple_folders.return_value = MEDIA_ROOT
             mput_opener.return_value = 'opener'
             mput_data_sample.return_value = 'data'
@@ -705,3 +863,376 @@ class TasksTests(APITestCase):
 
             prepare_materials(subtuple[0], 'traintuple')
             prepare_materials(subtuple[0], 'testtuple')
+
+    def test_prepare_materials_concurrent_fetch(self):
+        subtuple = {'key': 'subtuple_test', 'inModels': [{'traintupleKey': 'model1', 'hash': 'hash1'},
+                                                         {'traintupleKey': 'model2', 'hash': 'hash2'}]}
+        fetching = set()
+        concurrent = threading.Event()
+
+        def fetch(name):
+            fetching.add(name)
+            if len(fetching) == 3:
+                concurrent.set()
+            # algo and models are fetched at the same time
+            self.assertTrue(concurrent.wait(5))
+            return name
+
+        with mock.patch('substrapp.tasks.tasks.get_objective') as mget_objective, \
+                mock.patch('substrapp.tasks.tasks.get_algo') as mget_algo, \
+                mock.patch('substrapp.tasks.tasks._get_model') as mget_model, \
+                mock.patch('substrapp.tasks.tasks.build_subtuple_folders'), \
+                mock.patch('substrapp.tasks.tasks.put_opener'), \
+                mock.patch('substrapp.tasks.tasks.put_data_sample'), \
+                mock.patch('substrapp.tasks.tasks.put_metric'), \
+                mock.patch('substrapp.tasks.tasks.put_algo') as mput_algo, \
+                mock.patch('substrapp.tasks.tasks.put_models') as mput_models, \
+                mock.patch('substrapp.tasks.tasks.release_asset_path') as mrelease_asset_path:
+
+            mget_objective.return_value = 'objective'
+            mget_algo.side_effect = lambda _: fetch('algo')
+            mget_model.side_effect = lambda model: fetch(model['traintupleKey'])
+
+            prepare_materials(subtuple, 'traintuple')
+
+            mput_algo.assert_called_once_with(mock.ANY, 'algo')
+            mput_models.assert_called_once_with(subtuple, mock.ANY, ['model1', 'model2'])
+            self.assertEqual(sorted(c[0][0] for c in mrelease_asset_path.call_args_list),
+                             ['algo', 'model1', 'model2'])
+
+    def test_prepare_materials_fetch_error(self):
+        subtuple = {'key': 'subtuple_test', 'inModels': [{'traintupleKey': 'model1', 'hash': 'hash1'}]}
+
+        with mock.patch('substrapp.tasks.tasks.get_objective') as mget_objective, \
+                mock.patch('substrapp.tasks.tasks.get_algo') as mget_algo, \
+                mock.patch('substrapp.tasks.tasks._get_model') as mget_model, \
+                mock.patch('substrapp.tasks.tasks.build_subtuple_folders') as mbuild_subtuple_folders, \
+                mock.patch('substrapp.tasks.tasks.release_asset_path') as mrelease_asset_path:
+
+            mget_objective.return_value = 'objective'
+            mget_algo.return_value = 'algo'
+            mget_model.side_effect = NodeError('unavailable')
+
+            with self.assertRaises(NodeError):
+                prepare_materials(subtuple, 'traintuple')
+
+            # fetched assets are released
+            mrelease_asset_path.assert_called_once_with('algo')
+            self.assertFalse(mbuild_subtuple_folders.called)
+
+    @override_settings(TASK={'PREFETCH_CONCURRENCY_PER_NODE': 1})
+    def test_get_asset_path_node_concurrency(self):
+        downloading = []
+        max_downloading = []
+
+        def download(url, auth, content_hash, dst_path, salt=None):
+            downloading.append(url)
+            max_downloading.append(len(downloading))
+            time.sleep(0.05)
+            downloading.remove(url)
+            with open(dst_path, 'wb') as f:
+                f.write(b'content')
+            return dst_path
+
+        with mock.patch('substrapp.tasks.utils.get_remote_file_path') as mget_remote_file, \
+                mock.patch('substrapp.tasks.utils.authenticate_worker'), \
+                mock.patch('substrapp.tasks.utils._node_semaphores', {}):
+            mget_remote_file.side_effect = download
+
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                paths = list(executor.map(lambda i: get_asset_path(f'http://node/{i}', 'node', 'hash'), range(3)))
+
+        for asset_path in paths:
+            release_asset_path(asset_path)
+        self.assertEqual(max(max_downloading), 1)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+@override_settings(TASK={'CACHE_ASSETS': True, 'ASSETS_CACHE_MAX_SIZE': 1024})
+class AssetCacheTests(APITestCase):
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def test_get_asset_path_cached(self):
+        content = b'algo'
+        content_hash = compute_hash(content)
+
+        with mock.patch('substrapp.tasks.utils.get_remote_file_path') as mget_remote_file, \
+                mock.patch('substrapp.tasks.utils.authenticate_worker'):
+            mget_remote_file.side_effect = fake_remote_file_path(content)
+
+            asset_path = get_asset_path('http://node/algo', 'node', content_hash)
+            release_asset_path(asset_path)
+            self.assertEqual(get_asset_path('http://node/algo', 'node', content_hash), asset_path)
+
+            self.assertEqual(mget_remote_file.call_count, 1)
+
+        self.assertEqual(asset_path, get_cached_asset_path(content_hash))
+        with open(asset_path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_get_asset_path_download_error(self):
+        content_hash = compute_hash(b'algo')
+
+        with mock.patch('substrapp.tasks.utils.get_remote_file_path') as mget_remote_file, \
+                mock.patch('substrapp.tasks.utils.authenticate_worker'):
+            mget_remote_file.side_effect = NodeError('hash mismatch')
+
+            with self.assertRaises(NodeError):
+                get_asset_path('http://node/algo', 'node', content_hash)
+
+        self.assertFalse(os.path.exists(get_cached_asset_path(content_hash)))
+
+    def test_evict_cached_assets(self):
+        contents = [b'first', b'second', b'third']
+        hashes = [compute_hash(content) for content in contents]
+
+        for i, (content, content_hash) in enumerate(zip(contents, hashes)):
+            get_cached_asset(content_hash, lambda dst_path: fake_remote_file_path(content)(None, None, None, dst_path))
+            os.utime(get_cached_asset_path(content_hash), (i, i))
+
+        # the first asset is used again
+        get_cached_asset(hashes[0], None)
+
+        evict_cached_assets(len(contents[0]) + len(contents[2]))
+
+        self.assertTrue(os.path.exists(get_cached_asset_path(hashes[0])))
+        self.assertFalse(os.path.exists(get_cached_asset_path(hashes[1])))
+        self.assertTrue(os.path.exists(get_cached_asset_path(hashes[2])))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+@override_settings(TASK={'CACHE_DOCKER_IMAGES': True, 'DOCKER_IMAGES_CACHE_MAX_SIZE': 1024})
+class ImageCacheTests(APITestCase):
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def test_get_cached_image(self):
+        client = MagicMock()
+        client.images.list.return_value = []
+        images = set()
+
+        def get(image_name):
+            if image_name not in images:
+                raise docker.errors.ImageNotFound(image_name)
+
+        client.images.get.side_effect = get
+        build = MagicMock(side_effect=lambda: images.add('substra/algo_hash'))
+
+        image_name = get_image_name('algo', 'hash')
+        self.assertEqual(get_cached_image(client, image_name, build), 'substra/algo_hash')
+        self.assertEqual(get_cached_image(client, image_name, build), 'substra/algo_hash')
+        self.assertEqual(build.call_count, 1)
+
+    def test_evict_cached_images(self):
+        client = MagicMock()
+
+        def image(name, size):
+            image = MagicMock()
+            image.tags = [f'{name}:latest']
+            image.attrs = {'Size': size}
+            return image
+
+        client.images.list.return_value = [image('substra/algo_old', 1000), image('substra/algo_recent', 1000)]
+        with mock.patch('substrapp.tasks.image_cache.EVICTION_MIN_AGE', 0):
+            for name in ('substra/algo_old', 'substra/algo_recent'):
+                get_cached_image(MagicMock(), name, MagicMock())
+                time.sleep(0.01)
+
+            evict_cached_images(client, 1024)
+
+        client.images.remove.assert_called_once_with('substra/algo_old')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+@override_settings(TASK={'CACHE_DOCKER_IMAGES': True, 'METRICS_CONTAINER_POOL': True})
+class MetricsPoolTests(APITestCase):
+
+    def setUp(self):
+        self.subtuple_directory = os.path.join(MEDIA_ROOT, 'subtuple', 'key')
+        for directory in ('data/datasample_key', 'pred', 'opener'):
+            os.makedirs(os.path.join(self.subtuple_directory, directory))
+        with open(os.path.join(self.subtuple_directory, 'opener/opener.py'), 'w') as f:
+            f.write('opener')
+        with open(os.path.join(self.subtuple_directory, 'pred/pred.csv'), 'w') as f:
+            f.write('pred')
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def evaluate(self, client, resources_manager):
+        return evaluate_in_pool(client, resources_manager, os.path.join(self.subtuple_directory, 'metrics'),
+                                'substra/metrics_hash', os.path.join(self.subtuple_directory, 'opener/opener.py'),
+                                os.path.join(self.subtuple_directory, 'data'),
+                                os.path.join(self.subtuple_directory, 'pred'))
+
+    def test_evaluate_in_pool(self):
+        client = MagicMock()
+        client.images.get.return_value.attrs = {
+            'Config': {'Entrypoint': ['python3', 'metrics.py'], 'Cmd': None, 'WorkingDir': '/sandbox'}}
+        client.containers.get.return_value.status = 'running'
+        resources_manager = MagicMock()
+        resources_manager.allocate.return_value = {'cpu_set': '0', 'nano_cpus': None, 'memory_mb': 1024,
+                                                   'gpu_set': None}
+
+        def exec_run(command, workdir):
+            # the metrics write their score in the predictions directory of the job
+            job_id = re.search(r'/sandbox/jobs/(\w+)', command[2]).group(1)
+            container_name = client.containers.run.call_args[1]['name']
+            job_directory = glob.glob(os.path.join(MEDIA_ROOT, 'metrics_pool', '*', '*', 'jobs', job_id))[0]
+            self.assertTrue(os.path.exists(os.path.join(job_directory, 'pred.csv')))
+            self.assertEqual(command[4:], ['python3', 'metrics.py'])
+            with open(os.path.join(job_directory, 'perf.json'), 'w') as f:
+                f.write('{"all": 1}')
+            return 0, f'{container_name} done'.encode()
+
+        client.containers.get.return_value.exec_run.side_effect = exec_run
+
+        with mock.patch('substrapp.tasks.metrics_pool.get_cached_image'):
+            self.assertTrue(self.evaluate(client, resources_manager))
+            self.assertTrue(self.evaluate(client, resources_manager))
+
+        # the container is started once, with the sandboxing of task containers
+        self.assertEqual(client.containers.run.call_count, 1)
+        run_args = client.containers.run.call_args[1]
+        self.assertTrue(run_args['network_disabled'])
+        self.assertEqual(run_args['cap_drop'], ['ALL'])
+        with open(os.path.join(self.subtuple_directory, 'pred/perf.json')) as f:
+            self.assertEqual(f.read(), '{"all": 1}')
+
+        # resources are leased by each job only, and applied to the container
+        self.assertEqual(resources_manager.allocate.call_count, 2)
+        self.assertEqual([x[0] for x, _ in resources_manager.allocate.call_args_list],
+                         [x[0] for x, _ in resources_manager.release.call_args_list])
+        self.assertNotIn(run_args['name'], [x[0] for x, _ in resources_manager.release.call_args_list])
+        client.containers.get.return_value.update.assert_called_with(
+            cpuset_cpus='0', cpu_period=100000, cpu_quota=-1, mem_limit='1024M', memswap_limit='2048M')
+
+        # idle containers are removed
+        with override_settings(TASK={'METRICS_POOL_IDLE_TIMEOUT': 0}):
+            sweep_idle_containers()
+        client.containers.get.return_value.remove.assert_called_once_with(force=True)
+        self.assertEqual(resources_manager.release.call_count, 2)
+
+    def test_remove_orphan_containers(self):
+        client = MagicMock()
+        orphan = MagicMock(labels={POOL_LABEL: '0'})
+        client.containers.list.return_value = [orphan]
+
+        with mock.patch('substrapp.tasks.metrics_pool.os.kill', side_effect=ProcessLookupError):
+            remove_orphan_containers(client)
+
+        # only the containers of this worker are listed
+        labels = client.containers.list.call_args[1]['filters']['label']
+        self.assertIn(f'{POOL_HOST_LABEL}={socket.gethostname()}', labels)
+        orphan.remove.assert_called_once_with(force=True)
+
+
+@override_settings(TASK={'PIPELINE': {'train': 1}})
+class PipelineTests(APITestCase):
+
+    def test_pipeline_stage_limit(self):
+        training = threading.Event()
+        done = threading.Event()
+
+        def train():
+            with pipeline_stage(PipelineManager, 'train', 'first'):
+                training.set()
+                done.wait(5)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            executor.submit(train)
+            self.assertTrue(training.wait(5))
+
+            # the next tuple is fetched while the first one is training, but waits for the train stage
+            with pipeline_stage(PipelineManager, 'fetch', 'second'):
+                pass
+            future = executor.submit(PipelineManager.acquire, 'train', 1, os.getpid())
+            time.sleep(0.1)
+            self.assertFalse(future.done())
+
+            done.set()
+            PipelineManager.release('train', future.result(timeout=5))
+
+        self.assertEqual(PipelineManager.occupancy()['train'], 0)
+
+    def test_pipeline_stage_killed_holder(self):
+        token = PipelineManager.acquire('train', 1, os.getpid())
+
+        with mock.patch('substrapp.tasks.pipeline.STALE_CHECK_PERIOD', 0.01), \
+                mock.patch('substrapp.tasks.pipeline._is_alive', return_value=False):
+            with pipeline_stage(PipelineManager, 'train', 'key'):
+                self.assertEqual(PipelineManager.occupancy()['train'], 1)
+
+        PipelineManager.release('train', token)
+        self.assertEqual(PipelineManager.occupancy()['train'], 0)
+
+    def test_pipeline_stage_error(self):
+        with self.assertRaises(Exception):
+            with pipeline_stage(PipelineManager, 'train', 'key'):
+                raise Exception('Training failed')
+        self.assertEqual(PipelineManager.occupancy()['train'], 0)
+
+        with self.assertRaises(Exception):
+            with pipeline_stage(PipelineManager, 'unknown', 'key'):
+                pass
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class WorkspaceTests(APITestCase):
+
+    def setUp(self):
+        self.compute_plan_id = 'compute_plan_id'
+        self.data_sample = DataSample(pkhash='data_sample_key', path=os.path.join(MEDIA_ROOT, 'datasamples', 'key'))
+        os.makedirs(self.data_sample.path)
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def subtuple(self, key, rank):
+        return {
+            'key': key,
+            'computePlanID': self.compute_plan_id,
+            'rank': rank,
+            'dataset': {'keys': [self.data_sample.pk]},
+            'algo': {'hash': 'algo_hash'},
+        }
+
+    def test_data_samples_verified_once(self):
+        with mock.patch('substrapp.models.DataSample.objects.get', return_value=self.data_sample), \
+                mock.patch('substrapp.tasks.tasks.verify_dirhash', return_value=True) as mverify_dirhash:
+            for rank in range(3):
+                subtuple = self.subtuple(f'traintuple_{rank}', rank)
+                put_data_sample(subtuple, build_subtuple_folders(subtuple))
+
+        mverify_dirhash.assert_called_once_with(self.data_sample.path, self.data_sample.pk)
+
+    def test_models_of_previous_ranks(self):
+        model_path = os.path.join(MEDIA_ROOT, 'model')
+        with open(model_path, 'w') as f:
+            f.write('model')
+        add_workspace_model(self.compute_plan_id, 'traintuple_0', model_path, 'model_hash')
+
+        subtuple = dict(self.subtuple('traintuple_1', 1), inModels=[{'traintupleKey': 'traintuple_0'}])
+        with mock.patch('substrapp.tasks.tasks.get_objective', return_value='metrics'), \
+                mock.patch('substrapp.tasks.tasks.get_algo', return_value='algo'), \
+                mock.patch('substrapp.tasks.tasks._get_model') as mget_model:
+            _, _, models_path = prefetch_materials(subtuple, 'traintuple')
+
+        # the model is not fetched
+        self.assertFalse(mget_model.called)
+        self.assertEqual(models_path, [get_workspace_model_path(self.compute_plan_id, 'traintuple_0')])
+
+    def test_images_built_once(self):
+        client = MagicMock()
+        with mock.patch('substrapp.tasks.tasks.prepare_image') as mprepare_image:
+            for _ in range(3):
+                prepare_tuple_image(client, self.compute_plan_id, 'algo', 'substra/algo_hash_plan', False, False)
+        self.assertEqual(mprepare_image.call_count, 1)
+
+        # the images of the compute plan are removed with its workspace
+        remove_workspace(client, self.compute_plan_id)
+        client.images.remove.assert_called_once_with('substra/algo_hash_plan', force=True)
+        self.assertFalse(os.path.exists(get_workspace_directory(self.compute_plan_id)))
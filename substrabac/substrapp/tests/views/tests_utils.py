@@ -78,7 +78,7 @@ def with_requests_mock(allowed):
 
             with mock.patch('substrapp.views.utils.authenticate_outgoing_request',
                             return_value=HTTPBasicAuth('foo', 'bar')), \
-                    mock.patch('substrapp.utils.requests.get', return_value=requests_response):
+                    mock.patch('substrapp.utils.requests.Session.get', return_value=requests_response):
                 f(*args, **kwargs)
         return wrapper
     return inner
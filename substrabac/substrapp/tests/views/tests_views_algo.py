@@ -15,6 +15,7 @@ from rest_framework.test import APITestCase
 from substrapp.serializers import LedgerAlgoSerializer
 
 from substrapp.ledger_utils import LedgerError
+from substrapp.ledger_mirror import mirror_assets
 
 from substrapp.utils import get_hash
 
@@ -102,6 +103,39 @@ class AlgoViewTests(APITestCase):
 
             self.assertEqual(len(r[0]), 1)
 
+    def test_algo_list_pagination(self):
+        url = reverse('substrapp:algo-list')
+        keys = sorted(a['key'] for a in algo)
+        with mock.patch('substrapp.views.algo.query_ledger') as mquery_ledger:
+            mquery_ledger.return_value = algo
+
+            response = self.client.get(url + '?page_size=2&fields=key,name,description', **self.extra)
+            r = response.json()
+            self.assertEqual([a['key'] for a in r['results'][0]], keys[:2])
+            self.assertEqual(set(r['results'][0][0].keys()), {'key', 'name', 'description'})
+            self.assertEqual(r['results'][0][0]['description']['storageAddress'],
+                             f'http://testserver/algo/{keys[0]}/description/')
+
+            response = self.client.get(r['next'], **self.extra)
+            r = response.json()
+            self.assertEqual([a['key'] for a in r['results'][0]], keys[2:])
+            self.assertIsNone(r['next'])
+
+            response = self.client.get(url + '?cursor=%%%', **self.extra)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(LEDGER_MIRROR={'ENABLED': True})
+    def test_algo_list_filter_ledger_mirror(self):
+        url = reverse('substrapp:algo-list')
+        mirror_assets('algo', algo)
+        with mock.patch('substrapp.views.algo.query_ledger') as mquery_ledger:
+            search_params = '?search=algo%253Aname%253ALogistic%2520regression'
+            response = self.client.get(url + search_params, **self.extra)
+            r = response.json()
+
+            self.assertEqual(len(r[0]), 1)
+            self.assertFalse(mquery_ledger.called)
+
     def test_algo_list_filter_datamanager_fail(self):
         url = reverse('substrapp:algo-list')
         with mock.patch('substrapp.views.algo.query_ledger') as mquery_ledger, \
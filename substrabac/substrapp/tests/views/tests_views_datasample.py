@@ -1,3 +1,4 @@
+import json
 import os
 import shutil
 import logging
@@ -198,3 +199,20 @@ class DataSampleViewTests(APITestCase):
             response = self.client.get(url, **self.extra)
             r = response.json()
             self.assertEqual(r, ['DataSampleA', 'DataSampleB'])
+
+    @override_settings(LIST_STREAMING_MIN_SIZE=2)
+    def test_datasamples_list_streaming(self):
+        url = reverse('substrapp:data_sample-list')
+        data_samples = [{'key': f'{i:064d}', 'ownerDataManagerKey': 'dm'} for i in range(3)]
+        with mock.patch('substrapp.views.datasample.query_ledger') as mquery_ledger:
+            mquery_ledger.return_value = data_samples
+
+            response = self.client.get(url, **self.extra)
+            self.assertTrue(response.streaming)
+            r = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+            self.assertEqual(r, data_samples)
+
+            response = self.client.get(url + '?page_size=1&fields=key', **self.extra)
+            self.assertFalse(response.streaming)
+            r = response.json()
+            self.assertEqual(r['results'], [{'key': data_samples[0]['key']}])
@@ -58,6 +58,23 @@ class ModelViewTests(APITestCase):
             r = response.json()
             self.assertEqual(r, [['ISIC']])
 
+    def test_model_list_pagination(self):
+        url = reverse('substrapp:model-list')
+        keys = sorted(m['traintuple']['key'] for m in model)
+        with mock.patch('substrapp.views.model.query_ledger') as mquery_ledger:
+            mquery_ledger.return_value = model
+
+            search_params = '?search=model%253Ahash%253Afoo-OR-model%253Ahash%253Abar&page_size=3'
+            response = self.client.get(url + search_params, **self.extra)
+            r = response.json()
+            self.assertEqual(r['results'], [[], []])
+            self.assertIsNone(r['next'])
+
+            response = self.client.get(url + '?page_size=3', **self.extra)
+            r = response.json()
+            self.assertEqual([m['traintuple']['key'] for m in r['results'][0]], keys[:3])
+            self.assertIsNotNone(r['next'])
+
     def test_model_list_filter_fail(self):
 
         with mock.patch('substrapp.views.model.query_ledger') as mquery_ledger:
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from datetime import timedelta
+from os import path
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.utils import timezone
+
+from substrapp.dirhash import file_hash
+from substrapp.models import UploadSession
+
+# Streaming of the uploaded files.
+#
+# Files larger than FILE_UPLOAD_MAX_MEMORY_SIZE are written by chunks of UPLOAD CHUNK_SIZE bytes to
+# MEDIA_ROOT/uploads and hashed while received, instead of being written to the system temporary
+# directory then read again in memory to be hashed. As they are on the file system of MEDIA_ROOT, they
+# are moved to their final location when the asset is saved. The sha256 of the file is available as
+# the `sha256` attribute of the uploaded file (see `substrapp.utils.get_hash`).
+#
+# Large data sample archives can also be uploaded by chunks in an upload session, resumed from its offset
+# after a dropped connection. The chunks are appended to MEDIA_ROOT/upload_sessions/<id> and hashed
+# incrementally while the chunks are received by the same process, the assembled archive is hashed again
+# otherwise. Sessions not updated for UPLOAD SESSION_EXPIRY seconds are removed.
+
+UPLOAD_DIRECTORY = 'uploads'
+UPLOAD_SESSION_DIRECTORY = 'upload_sessions'
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # bytes
+DEFAULT_SESSION_EXPIRY = 24 * 60 * 60  # seconds
+
+CONTENT_RANGE_REGEX = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+# sha256 of the received bytes by session id: (offset, hash)
+_session_hashes = {}
+_session_hashes_lock = threading.Lock()
+
+
+def get_upload_directory():
+    directory = path.join(getattr(settings, 'MEDIA_ROOT'), UPLOAD_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    """A file uploaded to MEDIA_ROOT/uploads, with its sha256"""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        _, ext = path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + ext, dir=get_upload_directory())
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+        self.sha256 = None
+
+
+class HashingFileUploadHandler(FileUploadHandler):
+    """Upload handler streaming data to MEDIA_ROOT/uploads and computing its sha256."""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.chunk_size = getattr(settings, 'UPLOAD', {}).get('CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = HashedUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+        self.sha256_hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256_hash.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.sha256_hash.hexdigest()
+        return self.file
+
+
+def get_upload_setting(name, default):
+    return getattr(settings, 'UPLOAD', {}).get(name, default)
+
+
+def get_session_file_path(session_id):
+    directory = path.join(getattr(settings, 'MEDIA_ROOT'), UPLOAD_SESSION_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+    return path.join(directory, session_id)
+
+
+def parse_content_range(content_range):
+    """Return the start, end (inclusive) and total size (None if unknown) of a `bytes` Content-Range header."""
+    match = CONTENT_RANGE_REGEX.match(content_range or '')
+    if match is None:
+        raise ValueError(f'Invalid Content-Range header: {content_range}, expected bytes <start>-<end>/<size>')
+
+    start, end, total = match.groups()
+    start, end = int(start), int(end)
+    total = None if total == '*' else int(total)
+    if end < start or (total is not None and end >= total):
+        raise ValueError(f'Invalid Content-Range header: {content_range}')
+    return start, end, total
+
+
+def write_session_chunk(session_id, stream, start, length):
+    """Write `length` bytes of `stream` at `start` in the session file, return the new offset."""
+    file_path = get_session_file_path(session_id)
+    chunk_size = get_upload_setting('CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+    with _session_hashes_lock:
+        offset, sha256_hash = _session_hashes.pop(session_id, (0, hashlib.sha256()))
+    if offset != start:  # chunks received by another process
+        sha256_hash = None
+
+    mode = 'r+b' if path.exists(file_path) else 'wb'
+    with open(file_path, mode) as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = stream.read(min(chunk_size, remaining))
+            if not data:
+                break
+            f.write(data)
+            if sha256_hash is not None:
+                sha256_hash.update(data)
+            remaining -= len(data)
+        # drop the bytes of an interrupted chunk
+        f.truncate()
+
+    offset = start + length - remaining
+    if sha256_hash is not None:
+        with _session_hashes_lock:
+            _session_hashes[session_id] = (offset, sha256_hash)
+    return offset
+
+
+def get_session_hash(session_id):
+    """Return the sha256 of the session file."""
+    with _session_hashes_lock:
+        offset, sha256_hash = _session_hashes.get(session_id, (None, None))
+
+    file_path = get_session_file_path(session_id)
+    if sha256_hash is not None and offset == path.getsize(file_path):
+        return sha256_hash.hexdigest()
+    return file_hash(file_path)
+
+
+def remove_session(session):
+    with _session_hashes_lock:
+        _session_hashes.pop(session.pk, None)
+    file_path = get_session_file_path(session.pk)
+    for session_path in (file_path, f'{file_path}.lock'):
+        if path.exists(session_path):
+            os.remove(session_path)
+    session.delete()
+
+
+def remove_expired_sessions():
+    """Remove the sessions not updated for UPLOAD SESSION_EXPIRY seconds, return their number."""
+    expiry = get_upload_setting('SESSION_EXPIRY', DEFAULT_SESSION_EXPIRY)
+    sessions = UploadSession.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=expiry))
+    count = 0
+    for session in sessions:
+        remove_session(session)
+        count += 1
+    return count
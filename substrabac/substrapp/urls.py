@@ -8,7 +8,7 @@ from rest_framework.routers import DefaultRouter
 from substrapp.views import ObjectiveViewSet, DataSampleViewSet, DataManagerViewSet, \
     AlgoViewSet, TrainTupleViewSet, TestTupleViewSet, ModelViewSet, TaskViewSet, \
     ComputePlanViewSet, ObjectivePermissionViewSet, AlgoPermissionViewSet, DataManagerPermissionViewSet, \
-    ModelPermissionViewSet
+    ModelPermissionViewSet, UploadSessionViewSet
 
 
 # Create a router and register our viewsets with it.
@@ -27,6 +27,7 @@ router.register(r'traintuple', TrainTupleViewSet, base_name='traintuple')
 router.register(r'testtuple', TestTupleViewSet, base_name='testtuple')
 router.register(r'task', TaskViewSet, base_name='task')
 router.register(r'compute_plan', ComputePlanViewSet, base_name='compute_plan')
+router.register(r'upload_session', UploadSessionViewSet, base_name='upload_session')
 
 urlpatterns = [
     url(r'^', include(router.urls)),
@@ -1,4 +1,6 @@
+import contextlib
 import io
+import fcntl
 import hashlib
 import logging
 import os
@@ -8,15 +10,21 @@ from os.path import isfile, isdir
 import shutil
 
 import requests
+import threading
 import tarfile
 import zipfile
 import uuid
 
-from checksumdir import dirhash
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from urllib.parse import urlparse
 
 from django.conf import settings
+from django.db.models.fields.files import FieldFile
 from rest_framework import status
 
+from substrapp.dirhash import compute_dirhash, register_dirhash, file_hash
+
 
 class JsonException(Exception):
     def __init__(self, msg):
@@ -27,39 +35,35 @@ class JsonException(Exception):
 def get_dir_hash(archive_object):
     with tempfile.TemporaryDirectory() as temp_dir:
         try:
-            content = archive_object.read()
-            archive_object.seek(0)
-            uncompress_content(content, temp_dir)
+            with open_archive(archive_object) as archive_file:
+                return uncompress_file(archive_file, temp_dir, register=False)
         except Exception as e:
             logging.error(e)
             raise e
-        else:
-            return dirhash(temp_dir, 'sha256')
+        finally:
+            archive_object.seek(0)
 
 
 def store_datasamples_archive(archive_object):
 
-    try:
-        content = archive_object.read()
-        archive_object.seek(0)
-    except Exception as e:
-        logging.error(e)
-        raise e
-
     # Temporary directory for uncompress
     datasamples_uuid = uuid.uuid4().hex
     tmp_datasamples_path = path.join(getattr(settings, 'MEDIA_ROOT'),
                                      f'datasamples/{datasamples_uuid}')
     try:
-        uncompress_content(content, tmp_datasamples_path)
+        # the directory is hashed while the archive is extracted
+        with open_archive(archive_object) as archive_file:
+            dir_hash = uncompress_file(archive_file, tmp_datasamples_path)
     except Exception as e:
         shutil.rmtree(tmp_datasamples_path, ignore_errors=True)
         logging.error(e)
         raise e
-    else:
-        # return the directory hash of the uncompressed file and the path of
-        # the temporary directory. The removal should be handled externally.
-        return dirhash(tmp_datasamples_path, 'sha256'), tmp_datasamples_path
+    finally:
+        archive_object.seek(0)
+
+    # return the directory hash of the uncompressed file and the path of
+    # the temporary directory. The removal should be handled externally.
+    return dir_hash, tmp_datasamples_path
 
 
 def get_hash(file, key=None):
@@ -68,12 +72,20 @@ def get_hash(file, key=None):
     else:
         if isinstance(file, (str, bytes, os.PathLike)):
             if isfile(file):
-                with open(file, 'rb') as f:
-                    data = f.read()
+                return file_hash(file, key)
             elif isdir(file):
-                return dirhash(file, 'sha256')
+                return compute_dirhash(file)
             else:
                 return ''
+        elif isinstance(file, FieldFile):
+            if not file._committed:  # not saved yet
+                return get_hash(file.file, key)
+            return file_hash(file.path, key)
+        elif key is None and isinstance(getattr(file, 'sha256', None), str):
+            # hashed while uploaded, see substrapp.upload
+            return file.sha256
+        elif callable(getattr(file, 'temporary_file_path', None)):
+            return file_hash(file.temporary_file_path(), key)
         else:
             openedfile = file.open()
             data = openedfile.read()
@@ -106,6 +118,24 @@ def create_directory(directory):
         os.makedirs(directory)
 
 
+# ioctl cloning a file on copy-on-write file systems (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Clone a file, raise OSError if the file system does not support it."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def reflink_or_copy(src, dst):
+    """Copy a file, sharing its blocks with the source if the file system supports it."""
+    try:
+        reflink(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
 class ZipFile(zipfile.ZipFile):
     """Override Zipfile to ensure unix file permissions are preserved.
 
@@ -141,38 +171,201 @@ def uncompress_path(archive_path, to_directory):
 
 
 def uncompress_content(archive_content, to_directory):
-    if zipfile.is_zipfile(io.BytesIO(archive_content)):
-        with ZipFile(io.BytesIO(archive_content)) as zf:
-            zf.extractall(to_directory)
+    return uncompress_file(io.BytesIO(archive_content), to_directory)
+
+
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+
+
+def _get_member_path(to_directory, name):
+    relative_path = path.normpath(name)
+    if path.isabs(relative_path) or relative_path.split(os.sep)[0] == '..':
+        raise Exception(f'Archive member outside of the archive directory: {name}')
+    return relative_path, path.join(to_directory, relative_path)
+
+
+def _extract_member(member_file, member_path):
+    """Write an archive member to `member_path` and return its sha256."""
+    os.makedirs(path.dirname(member_path), exist_ok=True)
+    sha256_hash = hashlib.sha256()
+    with open(member_path, 'wb') as f:
+        for chunk in iter(lambda: member_file.read(EXTRACT_CHUNK_SIZE), b''):
+            sha256_hash.update(chunk)
+            f.write(chunk)
+    return sha256_hash.hexdigest()
+
+
+def _extract_zip(zf, to_directory):
+    file_hashes = {}
+    for member in zf.infolist():
+        relative_path, member_path = _get_member_path(to_directory, member.filename)
+        if member.is_dir():
+            os.makedirs(member_path, exist_ok=True)
+            continue
+        with zf.open(member) as member_file:
+            file_hashes[relative_path] = _extract_member(member_file, member_path)
+        # preserve unix file permissions, see ZipFile
+        attr = member.external_attr >> 16
+        if attr:
+            os.chmod(member_path, attr)
+    return file_hashes
+
+
+def _extract_tar(tf, to_directory):
+    file_hashes = {}
+    for member in tf:
+        relative_path, member_path = _get_member_path(to_directory, member.name)
+        if member.isreg():
+            file_hashes[relative_path] = _extract_member(tf.extractfile(member), member_path)
+            os.chmod(member_path, member.mode & 0o777)
+            os.utime(member_path, (member.mtime, member.mtime))
+        elif member.isdir():
+            os.makedirs(member_path, exist_ok=True)
+        else:  # links and special files, hashed after extraction
+            tf.extract(member, to_directory)
+    return file_hashes
+
+
+@contextlib.contextmanager
+def open_archive(archive_object):
+    """Return a binary stream over an uploaded or stored archive, without loading it in memory if possible."""
+    if callable(getattr(archive_object, 'temporary_file_path', None)):  # upload streamed to disk
+        with open(archive_object.temporary_file_path(), 'rb') as f:
+            yield f
+    elif isinstance(archive_object, io.IOBase):
+        yield archive_object
+    elif isinstance(getattr(archive_object, 'file', None), io.IOBase):  # django File
+        yield archive_object.file
+    else:
+        yield io.BytesIO(archive_object.read())
+
+
+def uncompress_file(archive_file, to_directory, register=True):
+    """Extract a zip or tar archive file object to a directory, return the `dirhash` of the directory.
+
+    Members are streamed to disk and hashed while written: zip archives must be seekable, tar archives are
+    read sequentially, so that the archive is never loaded in memory nor read twice. The manifest of the
+    directory is not registered if `register` is false (temporary directory).
+    """
+    os.makedirs(to_directory, exist_ok=True)
+
+    if zipfile.is_zipfile(archive_file):
+        archive_file.seek(0)
+        with zipfile.ZipFile(archive_file) as zf:
+            file_hashes = _extract_zip(zf, to_directory)
     else:
+        archive_file.seek(0)
         try:
-            with tarfile.open(fileobj=io.BytesIO(archive_content)) as tf:
-                tf.extractall(to_directory)
+            with tarfile.open(fileobj=archive_file, mode='r|*') as tf:
+                file_hashes = _extract_tar(tf, to_directory)
         except tarfile.TarError:
             raise Exception('Archive must be zip or tar.*')
 
+    return register_dirhash(to_directory, file_hashes, register=register)
+
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 class NodeError(Exception):
     pass
 
 
+# pooled sessions by (process, node url scheme and location)
+_remote_sessions = {}
+_remote_sessions_lock = threading.Lock()
+
+
+def _get_node_http_client_setting(name, default):
+    return getattr(settings, 'NODE_HTTP_CLIENT', {}).get(name, default)
+
+
+def get_remote_session(url):
+    """Return the session to the node serving `url`, its connections are kept alive between calls"""
+    parsed_url = urlparse(url)
+    key = (os.getpid(), parsed_url.scheme, parsed_url.netloc)
+
+    with _remote_sessions_lock:
+        session = _remote_sessions.get(key)
+
+        if session is None:
+            retry = Retry(
+                total=_get_node_http_client_setting('RETRIES', 3),
+                backoff_factor=_get_node_http_client_setting('BACKOFF_FACTOR', 0.5),
+                status_forcelist=(502, 503, 504),
+                method_whitelist=frozenset(['GET', 'HEAD']),
+                raise_on_status=False,
+            )
+            pool_maxsize = _get_node_http_client_setting('POOL_MAXSIZE', 10)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _remote_sessions[key] = session
+
+    return session
+
+
 def get_remote_file(url, auth, **kwargs):
     kwargs.update({
         'headers': {'Accept': 'application/json;version=0.0'},
         'auth': auth
     })
 
+    kwargs.setdefault('timeout', (_get_node_http_client_setting('CONNECT_TIMEOUT', 5),
+                                  _get_node_http_client_setting('READ_TIMEOUT', 300)))
+
     if settings.DEBUG:
         kwargs['verify'] = False
 
     try:
-        response = requests.get(url, **kwargs)
+        response = get_remote_session(url).get(url, **kwargs)
     except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
         raise NodeError(f'Failed to fetch {url}') from e
 
     return response
 
 
+def get_remote_file_path(url, auth, content_hash, dst_path, salt=None):
+    """Download a remote file to `dst_path`, without holding its content in memory.
+
+    The content is hashed while written to a temporary file (the salt is hashed last),
+    which is renamed to `dst_path` only if its hash matches `content_hash`.
+    """
+    response = get_remote_file(url, auth, stream=True)
+
+    try:
+        if response.status_code != status.HTTP_200_OK:
+            logging.error(response.text)
+            raise NodeError(f'Url: {url} returned status code: {response.status_code}')
+
+        sha256_hash = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=path.dirname(dst_path), prefix='.download-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    sha256_hash.update(chunk)
+                    f.write(chunk)
+
+            if salt is not None and isinstance(salt, str):
+                sha256_hash.update(salt.encode())
+
+            computed_hash = sha256_hash.hexdigest()
+            if computed_hash != content_hash:
+                raise NodeError(f"url {url}: hash doesn't match {content_hash} vs {computed_hash}")
+
+            os.rename(tmp_path, dst_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    finally:
+        response.close()
+
+    return dst_path
+
+
 def get_remote_file_content(url, auth, content_hash, salt=None):
     response = get_remote_file(url, auth)
 
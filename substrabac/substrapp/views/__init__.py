@@ -9,8 +9,10 @@ from .traintuple import TrainTupleViewSet
 from .testtuple import TestTupleViewSet
 from .task import TaskViewSet
 from .computeplan import ComputePlanViewSet
+from .uploadsession import UploadSessionViewSet
 
 __all__ = ['DataSampleViewSet', 'DataManagerViewSet', 'DataManagerPermissionViewSet', 'ObjectiveViewSet',
            'ObjectivePermissionViewSet', 'ModelViewSet', 'ModelPermissionViewSet', 'AlgoViewSet',
-           'AlgoPermissionViewSet', 'TrainTupleViewSet', 'TestTupleViewSet', 'TaskViewSet', 'ComputePlanViewSet'
+           'AlgoPermissionViewSet', 'TrainTupleViewSet', 'TestTupleViewSet', 'TaskViewSet', 'ComputePlanViewSet',
+           'UploadSessionViewSet'
            ]
@@ -15,7 +15,8 @@ from substrapp.utils import get_hash
 from substrapp.ledger_utils import query_ledger, get_object_from_ledger, LedgerError, LedgerTimeout, LedgerConflict
 from substrapp.views.utils import (PermissionMixin, find_primary_key_error,
                                    validate_pk, get_success_create_code, LedgerException, ValidationException,
-                                   get_remote_asset, node_has_process_permission)
+                                   get_remote_asset, node_has_process_permission, get_list_response)
+from substrapp.ledger_mirror import is_ledger_mirror_enabled
 from substrapp.views.filters_utils import filter_list
 
 
@@ -173,22 +174,26 @@ class AlgoViewSet(mixins.CreateModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
-        try:
-            data = query_ledger(fcn='queryAlgos', args=[])
-        except LedgerError as e:
-            return Response({'message': str(e.msg)}, status=e.status)
+        query_params = request.query_params.get('search', None)
 
-        algos_list = [data]
+        use_mirror = query_params is not None and is_ledger_mirror_enabled()
+        if use_mirror:
+            data = None  # searched in the local copy of the ledger
+        else:
+            try:
+                data = query_ledger(fcn='queryAlgos', args=[])
+            except LedgerError as e:
+                return Response({'message': str(e.msg)}, status=e.status)
 
-        # parse filters
-        query_params = request.query_params.get('search', None)
+        algos_list = [data]
 
         if query_params is not None:
             try:
                 algos_list = filter_list(
                     object_type='algo',
                     data=data,
-                    query_params=query_params)
+                    query_params=query_params,
+                    use_mirror=use_mirror)
             except LedgerError as e:
                 return Response({'message': str(e.msg)}, status=e.status)
             except Exception as e:
@@ -197,11 +202,7 @@ class AlgoViewSet(mixins.CreateModelMixin,
                     {'message': f'Malformed search filters {query_params}'},
                     status=status.HTTP_400_BAD_REQUEST)
 
-        for group in algos_list:
-            for algo in group:
-                replace_storage_addresses(request, algo)
-
-        return Response(algos_list, status=status.HTTP_200_OK)
+        return get_list_response(request, algos_list, prepare=replace_storage_addresses)
 
 
 class AlgoPermissionViewSet(PermissionMixin,
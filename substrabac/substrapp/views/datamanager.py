@@ -19,7 +19,8 @@ from substrapp.utils import get_hash
 from substrapp.ledger_utils import query_ledger, get_object_from_ledger, LedgerError, LedgerTimeout, LedgerConflict
 from substrapp.views.utils import (PermissionMixin, find_primary_key_error,
                                    validate_pk, get_success_create_code, ValidationException, LedgerException,
-                                   get_remote_asset, node_has_process_permission)
+                                   get_remote_asset, node_has_process_permission, get_list_response)
+from substrapp.ledger_mirror import is_ledger_mirror_enabled
 from substrapp.views.filters_utils import filter_list
 
 
@@ -197,22 +198,26 @@ class DataManagerViewSet(mixins.CreateModelMixin,
 
     def list(self, request, *args, **kwargs):
 
-        try:
-            data = query_ledger(fcn='queryDataManagers', args=[])
-        except LedgerError as e:
-            return Response({'message': str(e.msg)}, status=e.status)
+        query_params = request.query_params.get('search', None)
 
-        data_managers_list = [data]
+        use_mirror = query_params is not None and is_ledger_mirror_enabled()
+        if use_mirror:
+            data = None  # searched in the local copy of the ledger
+        else:
+            try:
+                data = query_ledger(fcn='queryDataManagers', args=[])
+            except LedgerError as e:
+                return Response({'message': str(e.msg)}, status=e.status)
 
-        # parse filters
-        query_params = request.query_params.get('search', None)
+        data_managers_list = [data]
 
         if query_params is not None:
             try:
                 data_managers_list = filter_list(
                     object_type='dataset',
                     data=data,
-                    query_params=query_params)
+                    query_params=query_params,
+                    use_mirror=use_mirror)
             except LedgerError as e:
                 return Response({'message': str(e.msg)}, status=e.status)
             except Exception as e:
@@ -221,11 +226,7 @@ class DataManagerViewSet(mixins.CreateModelMixin,
                     {'message': f'Malformed search filters {query_params}'},
                     status=status.HTTP_400_BAD_REQUEST)
 
-        for group in data_managers_list:
-            for data_manager in group:
-                replace_storage_addresses(request, data_manager)
-
-        return Response(data_managers_list, status=status.HTTP_200_OK)
+        return get_list_response(request, data_managers_list, prepare=replace_storage_addresses)
 
     @action(methods=['post'], detail=True)
     def update_ledger(self, request, *args, **kwargs):
@@ -5,7 +5,6 @@ import os
 import ntpath
 import shutil
 
-from checksumdir import dirhash
 from django.conf import settings
 from rest_framework import status, mixins
 from rest_framework.decorators import action
@@ -19,8 +18,9 @@ from substrapp.serializers import DataSampleSerializer, LedgerDataSampleSerializ
 from substrapp.serializers.ledger.datasample.util import updateLedgerDataSample
 from substrapp.serializers.ledger.datasample.tasks import updateLedgerDataSampleAsync
 from substrapp.utils import store_datasamples_archive
+from substrapp.dirhash import compute_dirhash
 from substrapp.views.utils import find_primary_key_error, LedgerException, ValidationException, \
-    get_success_create_code
+    get_success_create_code, get_list_response
 from substrapp.ledger_utils import query_ledger, LedgerError, LedgerTimeout, LedgerConflict
 
 logger = logging.getLogger('django.request')
@@ -81,16 +81,18 @@ class DataSampleViewSet(mixins.CreateModelMixin,
 
         return serializer.data, st
 
-    def compute_data(self, request, paths_to_remove):
+    def compute_data(self, request, paths_to_remove, files=None):
 
         data = {}
+        # files assembled from an upload session are passed explicitly
+        files = request.FILES if files is None else files
 
         # files can be uploaded inside the HTTP request or can already be
         # available on local disk
-        if len(request.FILES) > 0:
+        if len(files) > 0:
             pkhash_map = {}
 
-            for k, file in request.FILES.items():
+            for k, file in files.items():
                 # Get dir hash uncompress the file into a directory
                 pkhash, datasamples_path_from_file = store_datasamples_archive(file)  # can raise
                 paths_to_remove.append(datasamples_path_from_file)
@@ -136,7 +138,7 @@ class DataSampleViewSet(mixins.CreateModelMixin,
                 if not os.path.isdir(path):
                     raise Exception(f'One of your paths does not exist, '
                                     f'is not a directory or is not an absolute path: {path}')
-                pkhash = dirhash(path, 'sha256')
+                pkhash = compute_dirhash(path)
                 try:
                     data[pkhash]
                 except KeyError:
@@ -156,7 +158,7 @@ class DataSampleViewSet(mixins.CreateModelMixin,
 
         return list(data.values())
 
-    def _create(self, request, data_manager_keys, test_only):
+    def _create(self, request, data_manager_keys, test_only, files=None):
 
         # compute_data will uncompress data archives to paths which will be
         # hardlinked thanks to datasample pre_save signal.
@@ -171,7 +173,7 @@ class DataSampleViewSet(mixins.CreateModelMixin,
 
         try:
             # will uncompress data archives to paths
-            computed_data = self.compute_data(request, paths_to_remove)
+            computed_data = self.compute_data(request, paths_to_remove, files)
 
             serializer = self.get_serializer(data=computed_data, many=True)
 
@@ -218,7 +220,7 @@ class DataSampleViewSet(mixins.CreateModelMixin,
 
         data = data if data else []
 
-        return Response(data, status=status.HTTP_200_OK)
+        return get_list_response(request, [data], grouped=False)
 
     def validate_bulk_update(self, data):
         try:
@@ -1,6 +1,7 @@
 from urllib.parse import unquote
 
 from substrapp.ledger_utils import query_ledger
+from substrapp.ledger_mirror import filter_mirror
 
 
 FILTER_QUERIES = {
@@ -59,10 +60,15 @@ def get_filters(query_params):
     return filters
 
 
-def filter_list(object_type, data, query_params):
+def filter_list(object_type, data, query_params, use_mirror=False):
 
     filters = get_filters(query_params)
 
+    if use_mirror:
+        # Assets were not queried from the ledger, search in its local copy
+        return filter_mirror(object_type, filters, AUTHORIZED_FILTERS)
+
+    data = data if data else []
     object_list = []
 
     for user_filter in filters:
@@ -103,7 +109,7 @@ def filter_list(object_type, data, query_params):
                 if filter_key == 'algo':
                     for attribute, val in subfilters.items():
                         filtering_data = [x for x in filtering_data if x[attribute] in val]
-                        hashes = [x['key'] for x in filtering_data]
+                        hashes = {x['key'] for x in filtering_data}
 
                         if object_type == 'model':
                             filtered_list = [x for x in filtered_list
@@ -115,28 +121,28 @@ def filter_list(object_type, data, query_params):
                                           if x['outModel'] is not None and x['outModel'][attribute] in val]
 
                         if object_type == 'algo':
-                            hashes = [x['algo']['hash'] for x in filtering_data]
+                            hashes = {x['algo']['hash'] for x in filtering_data}
                             filtered_list = [x for x in filtered_list if x['key'] in hashes]
 
                         elif object_type == 'dataset':
-                            hashes = [x['objective']['hash'] for x in filtering_data]
+                            hashes = {x['objective']['hash'] for x in filtering_data}
                             filtered_list = [x for x in filtered_list
                                              if x['objectiveKey'] in hashes]
 
                         elif object_type == 'objective':
-                            hashes = [x['objective']['hash'] for x in filtering_data]
+                            hashes = {x['objective']['hash'] for x in filtering_data}
                             filtered_list = [x for x in filtered_list if x['key'] in hashes]
 
                 elif filter_key == 'dataset':
                     for attribute, val in subfilters.items():
                         filtering_data = [x for x in filtering_data if x[attribute] in val]
-                        hashes = [x['key'] for x in filtering_data]
+                        hashes = {x['key'] for x in filtering_data}
 
                         if object_type == 'model':
                             filtered_list = [x for x in filtered_list
                                              if x['traintuple']['dataset']['openerHash'] in hashes]
                         elif object_type == 'objective':
-                            objectiveKeys = [x['objectiveKey'] for x in filtering_data]
+                            objectiveKeys = {x['objectiveKey'] for x in filtering_data}
                             filtered_list = [x for x in filtered_list
                                              if x['key'] in objectiveKeys or
                                              (x['testDataset'] and x['testDataset']['dataManagerKey'] in hashes)]
@@ -148,7 +154,7 @@ def filter_list(object_type, data, query_params):
                         else:
                             filtering_data = [x for x in filtering_data if x[attribute] in val]
 
-                        hashes = [x['key'] for x in filtering_data]
+                        hashes = {x['key'] for x in filtering_data}
 
                         if object_type == 'model':
                             filtered_list = [x for x in filtered_list
@@ -11,10 +11,16 @@ from node.authentication import NodeUser
 from substrapp.models import Model
 from substrapp.serializers import ModelSerializer
 from substrapp.ledger_utils import query_ledger, get_object_from_ledger, LedgerError
-from substrapp.views.utils import CustomFileResponse, validate_pk, get_remote_asset, PermissionMixin
+from substrapp.views.utils import (CustomFileResponse, validate_pk, get_remote_asset, PermissionMixin,
+                                   get_list_response)
+from substrapp.ledger_mirror import is_ledger_mirror_enabled
 from substrapp.views.filters_utils import filter_list
 
 
+def get_model_key(model):
+    return model['traintuple']['key']
+
+
 class ModelViewSet(mixins.RetrieveModelMixin,
                    mixins.ListModelMixin,
                    GenericViewSet):
@@ -83,20 +89,26 @@ class ModelViewSet(mixins.RetrieveModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
-        try:
-            data = query_ledger(fcn='queryModels', args=[])
-        except LedgerError as e:
-            return Response({'message': str(e.msg)}, status=e.status)
+        query_params = request.query_params.get('search', None)
+
+        use_mirror = query_params is not None and is_ledger_mirror_enabled()
+        if use_mirror:
+            data = None  # searched in the local copy of the ledger
+        else:
+            try:
+                data = query_ledger(fcn='queryModels', args=[])
+            except LedgerError as e:
+                return Response({'message': str(e.msg)}, status=e.status)
 
         models_list = [data]
 
-        query_params = request.query_params.get('search', None)
         if query_params is not None:
             try:
                 models_list = filter_list(
                     object_type='model',
                     data=data,
-                    query_params=query_params)
+                    query_params=query_params,
+                    use_mirror=use_mirror)
             except LedgerError as e:
                 return Response({'message': str(e.msg)}, status=e.status)
             except Exception as e:
@@ -105,7 +117,7 @@ class ModelViewSet(mixins.RetrieveModelMixin,
                     {'message': f'Malformed search filters {query_params}'},
                     status=status.HTTP_400_BAD_REQUEST)
 
-        return Response(models_list, status=status.HTTP_200_OK)
+        return get_list_response(request, models_list, get_key=get_model_key)
 
     @action(detail=True)
     def details(self, request, *args, **kwargs):
@@ -20,7 +20,8 @@ from substrapp.utils import get_hash
 from substrapp.views.utils import (PermissionMixin, find_primary_key_error, validate_pk,
                                    get_success_create_code, ValidationException,
                                    LedgerException, get_remote_asset, validate_sort,
-                                   node_has_process_permission)
+                                   node_has_process_permission, get_list_response)
+from substrapp.ledger_mirror import is_ledger_mirror_enabled
 from substrapp.views.filters_utils import filter_list
 
 
@@ -191,20 +192,26 @@ class ObjectiveViewSet(mixins.CreateModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
-        try:
-            data = query_ledger(fcn='queryObjectives', args=[])
-        except LedgerError as e:
-            return Response({'message': str(e.msg)}, status=e.status)
+        query_params = request.query_params.get('search', None)
+
+        use_mirror = query_params is not None and is_ledger_mirror_enabled()
+        if use_mirror:
+            data = None  # searched in the local copy of the ledger
+        else:
+            try:
+                data = query_ledger(fcn='queryObjectives', args=[])
+            except LedgerError as e:
+                return Response({'message': str(e.msg)}, status=e.status)
 
         objectives_list = [data]
 
-        query_params = request.query_params.get('search', None)
         if query_params is not None:
             try:
                 objectives_list = filter_list(
                     object_type='objective',
                     data=data,
-                    query_params=query_params)
+                    query_params=query_params,
+                    use_mirror=use_mirror)
             except LedgerError as e:
                 return Response({'message': str(e.msg)}, status=e.status)
             except Exception as e:
@@ -213,11 +220,7 @@ class ObjectiveViewSet(mixins.CreateModelMixin,
                     {'message': f'Malformed search filters {query_params}'},
                     status=status.HTTP_400_BAD_REQUEST)
 
-        for group in objectives_list:
-            for objective in group:
-                replace_storage_addresses(request, objective)
-
-        return Response(objectives_list, status=status.HTTP_200_OK)
+        return get_list_response(request, objectives_list, prepare=replace_storage_addresses)
 
     @action(detail=True)
     def data(self, request, *args, **kwargs):
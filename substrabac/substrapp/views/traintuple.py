@@ -6,8 +6,9 @@ from rest_framework.viewsets import GenericViewSet
 
 from substrapp.serializers import LedgerTrainTupleSerializer
 from substrapp.ledger_utils import query_ledger, get_object_from_ledger, LedgerError, LedgerConflict
+from substrapp.ledger_mirror import is_ledger_mirror_enabled
 from substrapp.views.filters_utils import filter_list
-from substrapp.views.utils import validate_pk, get_success_create_code, LedgerException
+from substrapp.views.utils import validate_pk, get_success_create_code, LedgerException, get_list_response
 
 
 class TrainTupleViewSet(mixins.CreateModelMixin,
@@ -72,20 +73,26 @@ class TrainTupleViewSet(mixins.CreateModelMixin,
             return Response(data, status=st, headers=headers)
 
     def list(self, request, *args, **kwargs):
-        try:
-            data = query_ledger(fcn='queryTraintuples', args=[])
-        except LedgerError as e:
-            return Response({'message': str(e.msg)}, status=e.status)
+        query_params = request.query_params.get('search', None)
+
+        use_mirror = query_params is not None and is_ledger_mirror_enabled()
+        if use_mirror:
+            data = None  # searched in the local copy of the ledger
+        else:
+            try:
+                data = query_ledger(fcn='queryTraintuples', args=[])
+            except LedgerError as e:
+                return Response({'message': str(e.msg)}, status=e.status)
 
         traintuple_list = [data]
 
-        query_params = request.query_params.get('search', None)
         if query_params is not None:
             try:
                 traintuple_list = filter_list(
                     object_type='traintuple',
                     data=data,
-                    query_params=query_params)
+                    query_params=query_params,
+                    use_mirror=use_mirror)
             except LedgerError as e:
                 return Response({'message': str(e.msg)}, status=e.status)
             except Exception as e:
@@ -94,7 +101,7 @@ class TrainTupleViewSet(mixins.CreateModelMixin,
                     {'message': f'Malformed search filters {query_params}'},
                     status=status.HTTP_400_BAD_REQUEST)
 
-        return Response(traintuple_list, status=status.HTTP_200_OK)
+        return get_list_response(request, traintuple_list)
 
     def _retrieve(self, pk):
         validate_pk(pk)
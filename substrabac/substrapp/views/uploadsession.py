@@ -0,0 +1,109 @@
+import logging
+
+from django.core.files import File
+from rest_framework import status, mixins
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet
+
+from substrapp.models import UploadSession
+from substrapp.serializers import UploadSessionSerializer
+from substrapp.tasks.asset_cache import file_lock
+from substrapp.upload import get_session_file_path, get_session_hash, parse_content_range, remove_expired_sessions, \
+    remove_session, write_session_chunk
+from substrapp.views.datasample import DataSampleViewSet
+from substrapp.views.utils import LedgerException, ValidationException
+
+logger = logging.getLogger('django.request')
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           GenericViewSet):
+    """Resumable upload of a data sample archive: create a session, upload its chunks then finalize it"""
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+
+    def create(self, request, *args, **kwargs):
+        remove_expired_sessions()
+        return super().create(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        remove_session(instance)
+
+    @action(methods=['put'], detail=True)
+    def chunk(self, request, pk=None):
+        session = self.get_object()
+
+        try:
+            start, end, size = parse_content_range(request.META.get('HTTP_CONTENT_RANGE'))
+        except ValueError as e:
+            return Response({'message': str(e), 'offset': session.offset}, status=status.HTTP_400_BAD_REQUEST)
+
+        if size is not None and session.size is not None and size != session.size:
+            return Response({'message': f'Invalid size {size}, expected {session.size}', 'offset': session.offset},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # chunks of a session are written one at a time
+        with file_lock(f'{get_session_file_path(session.pk)}.lock'):
+            session.refresh_from_db()
+            if start != session.offset:
+                return Response({'message': f'Invalid chunk start {start}, expected {session.offset}',
+                                 'offset': session.offset},
+                                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            # the size of ranges `bytes <start>-<end>/*` is the one already announced
+            if session.size is not None and end >= session.size:
+                return Response({'message': f'Invalid chunk end {end}, expected less than {session.size}',
+                                 'offset': session.offset},
+                                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+            session.offset = write_session_chunk(session.pk, request.stream, start, end - start + 1)
+            if size is not None:
+                session.size = size
+            session.save()
+
+        if session.offset != end + 1:
+            return Response({'message': f'Incomplete chunk, received up to {session.offset}',
+                             'offset': session.offset},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(self.get_serializer(session).data, status=status.HTTP_200_OK)
+
+    @action(methods=['post'], detail=True)
+    def finalize(self, request, pk=None):
+        session = self.get_object()
+
+        if session.size is None or session.offset != session.size:
+            return Response({'message': f'Incomplete upload, received {session.offset} of {session.size} bytes',
+                             'offset': session.offset},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        sha256 = get_session_hash(session.pk)
+        expected_sha256 = request.data.get('sha256')
+        if expected_sha256 and expected_sha256 != sha256:
+            remove_session(session)
+            return Response({'message': f'Invalid sha256 {sha256} of the uploaded file, expected {expected_sha256}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        test_only = request.data.get('test_only', False)
+        data_manager_keys = request.data.getlist('data_manager_keys', [])
+
+        # the assembled archive is registered as if it had been uploaded in a single request
+        data_sample_view = DataSampleViewSet(request=request, format_kwarg=self.format_kwarg)
+        try:
+            with open(get_session_file_path(session.pk), 'rb') as f:
+                files = {session.filename: File(f, name=session.filename)}
+                data, st = data_sample_view._create(request, data_manager_keys, test_only, files)
+        except ValidationException as e:
+            remove_session(session)
+            return Response({'message': e.data, 'pkhash': e.pkhash}, status=e.st)
+        except LedgerException as e:
+            remove_session(session)
+            return Response({'message': e.data}, status=e.st)
+        except Exception as e:
+            # the session is kept to finalize it again with valid parameters
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            remove_session(session)
+            return Response(data, status=st)
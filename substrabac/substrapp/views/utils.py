@@ -9,6 +9,8 @@ from rest_framework.authentication import SessionAuthentication, BasicAuthentica
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from libs.pagination import LedgerCursorPagination
+from libs.renderers import StreamingJSONResponse
 from substrapp.ledger_utils import get_object_from_ledger, LedgerError
 from substrapp.utils import NodeError, get_remote_file, get_owner, get_remote_file_content
 from node.models import OutgoingNode
@@ -228,3 +230,46 @@ def get_success_create_code():
         return status.HTTP_201_CREATED
     else:
         return status.HTTP_202_ACCEPTED
+
+
+def get_asset_key(asset):
+    return asset['key']
+
+
+def project_fields(asset, fields):
+    return {field: asset[field] for field in fields if field in asset}
+
+
+def get_list_response(request, groups, get_key=get_asset_key, prepare=None, grouped=True):
+    """Build the response of a ledger list endpoint.
+
+    Supports cursor pagination (`page_size` and `cursor` query params), projection
+    of assets (`fields` query param, comma separated) and streams large responses.
+    `prepare` is applied to the assets of the page only, before projection.
+    """
+    paginator = LedgerCursorPagination()
+    pages = paginator.paginate_groups(groups, request, get_key)
+    if pages is not None:
+        groups = pages
+
+    if prepare is not None:
+        for group in groups:
+            for asset in group or []:
+                prepare(request, asset)
+
+    fields = request.query_params.get('fields')
+    if fields:
+        fields = [field for field in fields.split(',') if field]
+        groups = [[project_fields(asset, fields) for asset in group or []] for group in groups]
+
+    data = groups if grouped else groups[0]
+    if pages is not None:
+        data = paginator.get_paginated_data(data)
+
+    size = sum(len(group or []) for group in groups)
+    accepted_renderer = getattr(request, 'accepted_renderer', None)
+    if (size >= getattr(settings, 'LIST_STREAMING_MIN_SIZE', 1000) and
+            accepted_renderer is not None and accepted_renderer.format == 'json'):
+        return StreamingJSONResponse(data, status=status.HTTP_200_OK)
+
+    return Response(data, status=status.HTTP_200_OK)